@@ -19,6 +19,8 @@ from qtpy.QtCore import Qt, Signal, QObject
 from qtpy.QtGui import QColor
 from qtpy.QtWidgets import QMessageBox
 
+from cnapy.results_cache import ResultsCache
+
 # from straindesign.parse_constr import linexprdict2str # indirectly leads to a JVM restart exception?!?
 
 class ModelItemType(IntEnum):
@@ -56,6 +58,8 @@ class AppData(QObject):
             pathlib.Path.home(), "CNApy-projects"))
         self.use_results_cache = False
         self.results_cache_dir: pathlib.Path = pathlib.Path(".")
+        self.results_cache_max_size = 1000 # MB, 0 means no limit
+        self.results_cache_max_age = 30 # days since the last access, 0 means no limit
         self.last_scen_directory = str(os.path.join(
             pathlib.Path.home(), "CNApy-projects"))
         self.temp_dir = TemporaryDirectory()
@@ -164,10 +168,18 @@ class AppData(QObject):
         parser.set('cnapy-config', 'abs_tol', str(self.abs_tol))
         parser.set('cnapy-config', 'use_results_cache', str(self.use_results_cache))
         parser.set('cnapy-config', 'results_cache_directory', str(self.results_cache_dir))
+        parser.set('cnapy-config', 'results_cache_max_size', str(self.results_cache_max_size))
+        parser.set('cnapy-config', 'results_cache_max_age', str(self.results_cache_max_age))
         parser.set('cnapy-config', 'recent_cna_files', str(self.recent_cna_files))
         parser.write(fp)
         fp.close()
 
+    def results_cache(self) -> ResultsCache:
+        # None if caching of results is switched off
+        if not self.use_results_cache:
+            return None
+        return ResultsCache(self.results_cache_dir, self.results_cache_max_size, self.results_cache_max_age)
+
     def compute_color_onoff(self, value: Tuple[float, float]):
         (vl, vh) = value
         vl = round(vl, self.rounding)
@@ -379,6 +391,7 @@ class ProjectData:
         self.comp_values: Dict[str, Tuple[float, float]] = {}
         self.comp_values_type = 0 # 0: simple flux vector, 1: bounds/FVA result
         self.fva_values: Dict[str, Tuple[float, float]] = {} # store FVA results persistently
+        self.fva_result = None # FVAResult of the last basic FVA, used to update it incrementally
         self.conc_values: Dict[str, float] = {} # Metabolite concentrations
         self.df_values: Dict[str, float] = {} # Driving forces
         self.modes = []
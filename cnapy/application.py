@@ -206,6 +206,10 @@ class Application:
                     'use_results_cache', fallback=self.appdata.use_results_cache)
             self.appdata.results_cache_dir = Path(config_parser.get('cnapy-config',
                     'results_cache_directory', fallback=self.appdata.results_cache_dir))
+            self.appdata.results_cache_max_size = config_parser.getint('cnapy-config',
+                    'results_cache_max_size', fallback=self.appdata.results_cache_max_size)
+            self.appdata.results_cache_max_age = config_parser.getint('cnapy-config',
+                    'results_cache_max_age', fallback=self.appdata.results_cache_max_age)
 
         except NoSectionError:
             print("Could not find section cnapy-config in cnapy-config.txt")
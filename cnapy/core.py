@@ -1,7 +1,10 @@
 """UI independent computations"""
 
 import itertools
+import hashlib
+import os
 from collections import defaultdict
+from tempfile import TemporaryDirectory
 from typing import Dict, Tuple, List
 from collections import Counter
 import gurobipy
@@ -14,61 +17,284 @@ from qtpy.QtWidgets import QMessageBox
 
 import efmtool_link.efmtool4cobra as efmtool4cobra
 import efmtool_link.efmtool_extern as efmtool_extern
-from cnapy.flux_vector_container import FluxVectorMemmap, FluxVectorContainer
+from cnapy.flux_vector_container import FluxVectorMemmap, FluxVectorMemmapWriter, FluxVectorCompact
+from cnapy.parallel_efm import parallel_efm_computation
+from cnapy.network_compression import CompressedNetwork, cached_compress_network
 from cnapy.appdata import Scenario
 
 organic_elements = ['C', 'O', 'H', 'N', 'P', 'S']
 
 
+class EFMResultCache:
+    '''
+    Keeps the most recently computed EFM set together with a hash of the network, the reactions that
+    were set to 0 and the reversible reactions that were restricted to one direction. A later computation
+    on the same network that only adds such constraints is answered by selecting the EFMs that fulfill
+    them; reversible EFMs are reversed where only their opposite direction fulfills them.
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.network_hash = None
+        self.zero_reactions = frozenset()
+        self.forward_reactions = frozenset()
+        self.backward_reactions = frozenset()
+        self.ems = None
+
+    def store(self, network_hash: bytes, zero_reactions, forward_reactions, backward_reactions, ems: FluxVectorMemmap):
+        self.clear()
+        # use a separate object on the same file because the mode navigator clears the container it displays
+        if ems._containing_temp_dir is not None:
+            fname = os.path.basename(ems._memmap_fname)
+        else:
+            fname = ems._memmap_fname
+        self.ems = FluxVectorMemmap(fname, ems.reac_id, containing_temp_dir=ems._containing_temp_dir)
+        self.ems.irreversible = ems.irreversible
+        self.network_hash = network_hash
+        self.zero_reactions = frozenset(zero_reactions)
+        self.forward_reactions = frozenset(forward_reactions)
+        self.backward_reactions = frozenset(backward_reactions)
+
+    def lookup(self, network_hash: bytes, zero_reactions, forward_reactions=(), backward_reactions=(),
+               print_progress_function=print) -> FluxVectorMemmap:
+        zero_reactions = frozenset(zero_reactions)
+        forward_reactions = frozenset(forward_reactions)
+        backward_reactions = frozenset(backward_reactions)
+        if self.ems is None or network_hash != self.network_hash or not self.zero_reactions <= zero_reactions \
+                or not self.forward_reactions <= forward_reactions or not self.backward_reactions <= backward_reactions:
+            return None
+        reac_index = {r: i for i, r in enumerate(self.ems.reac_id)}
+        additional = [reac_index[r] for r in zero_reactions - self.zero_reactions]
+        forward = [reac_index[r] for r in forward_reactions - self.forward_reactions]
+        backward = [reac_index[r] for r in backward_reactions - self.backward_reactions]
+        selection = self.ems.support_index.select(must_not_occur=additional)
+        keep = numpy.setdiff1d(numpy.arange(len(self.ems.reac_id)), additional)
+        is_irrev_efm = []
+        work_dir = TemporaryDirectory()
+        with FluxVectorMemmapWriter(os.path.join(work_dir.name, 'efms.bin'), len(keep)) as writer:
+            for start, block in self.ems.iter_chunks(max(1, 2**22 // max(len(keep), 1))):
+                block = numpy.array(block, dtype=float)
+                selected = selection[start:start+block.shape[0]].copy()
+                irrev = self.ems.irreversible[start:start+block.shape[0]]
+                if len(forward) + len(backward) > 0:
+                    as_is = numpy.all(block[:, forward] >= 0, axis=1) & numpy.all(block[:, backward] <= 0, axis=1)
+                    opposite = ~irrev & numpy.all(block[:, forward] <= 0, axis=1) & numpy.all(block[:, backward] >= 0, axis=1)
+                    selected &= as_is | opposite
+                    block[~as_is & opposite, :] *= -1
+                    irrev = irrev | numpy.any(block[:, forward + backward] != 0, axis=1)
+                writer.append(block[selected, :][:, keep])
+                is_irrev_efm.append(irrev[selected])
+        ems = FluxVectorMemmap('efms.bin', [self.ems.reac_id[i] for i in keep], containing_temp_dir=work_dir)
+        ems.irreversible = numpy.concatenate(is_irrev_efm) if len(is_irrev_efm) > 0 else numpy.zeros(0, dtype=bool)
+        print_progress_function("Selected "+str(len(ems))+" of the "+str(len(self.ems))+
+                                " EFMs of the previous computation without running efmtool.")
+        return ems
+
+
+efm_result_cache = EFMResultCache()
+
+
+def network_hash(stdf, reversible, irrev_backwards_idx) -> bytes:
+    # identifies the network on which EFMs are computed
+    h = hashlib.blake2b(digest_size=16)
+    h.update("\0".join(stdf.columns).encode())
+    h.update(numpy.ascontiguousarray(stdf.values, dtype=float).tobytes())
+    h.update(numpy.asarray(reversible, dtype=numpy.int64).tobytes())
+    h.update(numpy.asarray(irrev_backwards_idx, dtype=numpy.int64).tobytes())
+    return h.digest()
+
+
 def efm_computation(model: cobra.Model, scen_values: Dict[str, Tuple[float, float]], constraints: bool,
-                    print_progress_function=print, abort_callback=None):
+                    print_progress_function=print, abort_callback=None, split_reactions: List[str] = None,
+                    processes: int = 1, use_cache: bool = True, compact_storage: bool = False, efmtool_worker=None,
+                    network_compression: bool = False):
+    # with split reactions the enumeration is divided into subproblems that run in parallel processes,
+    # otherwise efmtool runs in efmtool_worker (a cnapy.efmtool_worker.EFMToolWorker) if one is given
+    # with compact_storage the EFMs are returned as FluxVectorCompact instead of FluxVectorMemmap
+    # with network_compression efmtool runs on the network compressed by cnapy.network_compression
     stdf = create_stoichiometric_matrix(
         model, array_type='DataFrame')
     reversible, irrev_backwards_idx = efmtool4cobra.get_reversibility(
         model)
-    if len(irrev_backwards_idx) > 0:
-        irrev_back = numpy.zeros(len(reversible), dtype=numpy.bool)
-        irrev_back[irrev_backwards_idx] = True
+    stdf_hash = network_hash(stdf, reversible, irrev_backwards_idx)
+    irrev_back = numpy.zeros(len(reversible), dtype=bool)
+    irrev_back[irrev_backwards_idx] = True
     scenario = {}
+    zero_reactions = []
+    # reversible reactions that the scenario restricts to one direction, these become irreversible
+    forward_reactions = []
+    backward_reactions = []
+    # irreversible reactions that the scenario only allows in their opposite direction
+    reversed_reactions = []
     if constraints:
         for r in scen_values.keys():
             (vl, vu) = scen_values[r]
+            r_idx = stdf.columns.get_loc(r)
             if vl == vu and vl == 0:
-                r_idx = stdf.columns.get_loc(r)
                 reversible = numpy.delete(reversible, r_idx)
                 del stdf[r]
-                if len(irrev_backwards_idx) > 0:
-                    irrev_back = numpy.delete(irrev_back, r_idx)
+                irrev_back = numpy.delete(irrev_back, r_idx)
+                zero_reactions.append(r)
                 scenario[r] = (0, 0)
+            elif vl >= 0 or vu <= 0:
+                backward = vl < 0
+                if reversible[r_idx]:
+                    if backward:
+                        backward_reactions.append(r)
+                    else:
+                        forward_reactions.append(r)
+                elif irrev_back[r_idx] != backward:
+                    reversed_reactions.append(r)
+                reversible[r_idx] = 0
+                irrev_back[r_idx] = backward # backward reactions are reversed for efmtool and afterwards
+                scenario[r] = (vl, vu)
+    if len(reversed_reactions) > 0: # changes the network, EFMs cannot be derived from a previous result
+        stdf_hash = hashlib.blake2b(stdf_hash + "\0".join(reversed_reactions).encode(), digest_size=16).digest()
+    if use_cache:
+        ems = efm_result_cache.lookup(stdf_hash, zero_reactions, forward_reactions, backward_reactions,
+                                      print_progress_function=print_progress_function)
+        if ems is not None:
+            if compact_storage:
+                ems = compact_efm_storage(ems, print_progress_function)
+            return (ems, scenario)
+    irrev_backwards_idx = numpy.where(irrev_back)[0]
     if len(irrev_backwards_idx) > 0:
-        irrev_backwards_idx = numpy.where(irrev_back)[0]
         stdf.values[:, irrev_backwards_idx] *= -1
-    work_dir = efmtool_extern.calculate_flux_modes(
-        stdf.values, reversible, return_work_dir_only=True, print_progress_function=print_progress_function, abort_callback=abort_callback)
+    split_idx = [stdf.columns.get_loc(r) for r in split_reactions or [] if r in stdf.columns]
+    st = stdf.values
+    efmtool_reversible = reversible
+    if network_compression:
+        network = cached_compress_network(st, reversible)
+        st = network.stoich
+        efmtool_reversible = network.reversible
+        split_idx = network.compressed_reactions(split_idx)
+        print_progress_function("Compressed the network from "+str(stdf.shape[0])+" x "+str(stdf.shape[1])+" to "+
+                                str(st.shape[0])+" x "+str(st.shape[1])+", "+str(len(network.blocked))+
+                                " reactions are blocked.")
+    if len(split_idx) > 0:
+        work_dir = parallel_efm_computation(st, efmtool_reversible, split_idx, processes,
+                                            print_progress_function=print_progress_function, abort_callback=abort_callback)
+    elif efmtool_worker is not None:
+        work_dir = efmtool_worker.calculate_flux_modes(st, efmtool_reversible,
+                                                       print_progress_function=print_progress_function, abort_callback=abort_callback)
+    else:
+        work_dir = efmtool_extern.calculate_flux_modes(
+            st, efmtool_reversible, return_work_dir_only=True, print_progress_function=print_progress_function, abort_callback=abort_callback)
     reac_id = stdf.columns.tolist()
     if work_dir is None:
         ems = None
     else:
-        ems = FluxVectorMemmap('efms.bin', reac_id,
-                               containing_temp_dir=work_dir)
-        del work_dir  # lose this reference to the temporary directory to facilitate garbage collection
-        is_irrev_efm = numpy.any(ems.fv_mat[:, reversible == 0], axis=1)
-        rev_emfs_idx = numpy.nonzero(is_irrev_efm == False)[0]
-        # reversible modes come in forward/backward pairs; delete one from each pair
-        if len(rev_emfs_idx) > 0:
-            del_idx = rev_emfs_idx[numpy.unique(
-                ems.fv_mat[rev_emfs_idx, :] != 0., axis=0, return_index=True)[1]]
-            is_irrev_efm = numpy.delete(is_irrev_efm, del_idx)
-            ems = FluxVectorContainer(numpy.delete(
-                ems.fv_mat, del_idx, axis=0), reac_id=ems.reac_id, irreversible=is_irrev_efm)
+        if network_compression:
+            ems = FluxVectorMemmap('efms.bin', ['R'+str(i) for i in range(st.shape[1])],
+                                   containing_temp_dir=work_dir)
+            del work_dir
+            ems = compact_efm_memmap(ems, efmtool_reversible, [])
+            ems = expand_efm_memmap(ems, network, irrev_backwards_idx, reac_id)
         else:
-            ems.irreversible = is_irrev_efm
-        if len(irrev_backwards_idx) > 0:
-            ems.fv_mat[:, irrev_backwards_idx] *= -1
+            ems = FluxVectorMemmap('efms.bin', reac_id,
+                                   containing_temp_dir=work_dir)
+            del work_dir  # lose this reference to the temporary directory to facilitate garbage collection
+            ems = compact_efm_memmap(ems, reversible, irrev_backwards_idx)
+        if use_cache:
+            efm_result_cache.store(stdf_hash, zero_reactions, forward_reactions, backward_reactions, ems)
+        if compact_storage:
+            ems = compact_efm_storage(ems, print_progress_function)
 
     return (ems, scenario)
 
 
+def expand_efm_memmap(ems: FluxVectorMemmap, network: CompressedNetwork, irrev_backwards_idx, reac_id: List[str],
+                      chunk_size: int = None) -> FluxVectorMemmap:
+    # maps the compacted EFMs of the compressed network chunk by chunk back to the original reactions
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(len(reac_id), 1))
+    fname = os.path.join(os.path.dirname(ems._memmap_fname), 'efms_expanded.bin')
+    with FluxVectorMemmapWriter(fname, len(reac_id)) as writer:
+        for _, block in ems.iter_chunks(chunk_size):
+            block = network.expand(block)
+            if len(irrev_backwards_idx) > 0:
+                block[:, irrev_backwards_idx] *= -1
+            writer.append(block)
+    irreversible = ems.irreversible
+    containing_temp_dir = ems._containing_temp_dir
+    old_fname = ems._memmap_fname
+    ems.clear()
+    del ems
+    try:
+        os.remove(old_fname)
+    except OSError:
+        pass
+    if containing_temp_dir is not None:
+        fname = os.path.basename(fname)
+    expanded = FluxVectorMemmap(fname, reac_id, containing_temp_dir=containing_temp_dir)
+    expanded.irreversible = irreversible
+    return expanded
+
+
+def compact_efm_storage(ems: FluxVectorMemmap, print_progress_function=print) -> FluxVectorCompact:
+    # the compact matrices are memory mapped in a new temporary directory, the float64 file is released
+    compact = FluxVectorCompact.from_modes(ems, work_dir=TemporaryDirectory())
+    float_bytes = ems.fv_mat.nbytes
+    ems.clear()
+    print_progress_function("Stored the EFMs as "+("integers" if compact.is_integral else "float32")+" using "+
+                            str(round(compact.fv_mat.nbytes/2**20, 1))+" MB instead of "+
+                            str(round(float_bytes/2**20, 1))+" MB.")
+    return compact
+
+
+def compact_efm_memmap(ems: FluxVectorMemmap, reversible, irrev_backwards_idx, chunk_size: int = None) -> FluxVectorMemmap:
+    """
+    Streams the raw efmtool result through memory chunk by chunk: determines which EFMs are irreversible,
+    drops the backward copy of each reversible EFM pair, restores the direction of the irreversible backward
+    reactions and writes the remaining EFMs into a new memory mapped file next to the original one.
+    Apart from the irreversibility flags and the hashes of the reversible supports only one chunk
+    is held in memory at any time.
+    """
+    num_efm, num_reac = ems.fv_mat.shape
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(num_reac, 1)) # 32 MB of doubles per chunk
+    irrev_reac = numpy.asarray(reversible) == 0
+    seen_rev_supports = set()
+    is_irrev_efm = []
+    fname = os.path.join(os.path.dirname(ems._memmap_fname), 'efms_compact.bin')
+    with FluxVectorMemmapWriter(fname, num_reac) as writer:
+        for start in range(0, num_efm, chunk_size):
+            chunk = numpy.asarray(ems.fv_mat[start:start+chunk_size, :], dtype=float)
+            irrev = numpy.any(chunk[:, irrev_reac] != 0, axis=1)
+            keep = numpy.ones(chunk.shape[0], dtype=bool)
+            # reversible modes come in forward/backward pairs with the same support; keep only one from each pair
+            rev_idx = numpy.nonzero(~irrev)[0]
+            if len(rev_idx) > 0:
+                packed = numpy.packbits(chunk[rev_idx, :] != 0, axis=1)
+                for i, support in zip(rev_idx, packed):
+                    key = hashlib.blake2b(support.tobytes(), digest_size=16).digest()
+                    if key in seen_rev_supports:
+                        keep[i] = False
+                    else:
+                        seen_rev_supports.add(key)
+            chunk = chunk[keep, :]
+            if len(irrev_backwards_idx) > 0:
+                chunk[:, irrev_backwards_idx] *= -1
+            writer.append(chunk)
+            is_irrev_efm.append(irrev[keep])
+    reac_id = ems.reac_id
+    containing_temp_dir = ems._containing_temp_dir
+    old_fname = ems._memmap_fname
+    ems.clear()
+    del ems
+    try:
+        os.remove(old_fname) # free the disk space of the uncompacted result
+    except OSError:
+        pass
+    if containing_temp_dir is not None:
+        fname = os.path.basename(fname)
+    compacted = FluxVectorMemmap(fname, reac_id, containing_temp_dir=containing_temp_dir)
+    compacted.irreversible = numpy.concatenate(is_irrev_efm) if len(is_irrev_efm) > 0 else numpy.zeros(0, dtype=bool)
+    return compacted
+
+
 class QPnotSupportedException(Exception):
     pass
 
@@ -0,0 +1,161 @@
+"""A long-lived efmtool process that keeps its JVM running between EFM computations"""
+import multiprocessing
+import os
+import threading
+from tempfile import TemporaryDirectory
+import numpy
+
+import efmtool_link.efmtool_extern as efmtool_extern
+
+
+def _worker_main(conn, efmtool_jar: str, jvm_max_memory: int):
+    # runs in the worker process: starts the JVM once and then executes efmtool calls sent over conn
+    import jpype
+    jpype.startJVM('-Xmx'+str(jvm_max_memory)+'M', classpath=[efmtool_jar])
+    calculate_flux_modes = jpype.JClass("ch.javasoft.metabolic.efm.main.CalculateFluxModes")
+    conn.send(("ready", None))
+    while True:
+        args = conn.recv()
+        if args is None:
+            break
+        try:
+            # main is the command line entry point which ends with System.exit, matlab returns the exit code instead
+            exit_code = calculate_flux_modes.matlab(jpype.JArray(jpype.JString)(args))
+            if exit_code == 0:
+                conn.send(("done", None))
+            else:
+                conn.send(("error", "efmtool finished with exit code "+str(exit_code)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class EFMToolWorker:
+    '''
+    Owns a worker process in which the efmtool JVM is started once and then reused so that repeated
+    EFM computations do not pay for JVM startup and class loading. Only one computation runs at a time;
+    aborting a computation kills the worker which is then restarted in the background.
+    '''
+
+    def __init__(self, jvm_max_memory=efmtool_extern.default_jvm_memory, max_threads=efmtool_extern.default_threads):
+        self.jvm_max_memory = jvm_max_memory
+        self.max_threads = max_threads
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, efmtool_extern.efmtool_jar, self.jvm_max_memory),
+                                   daemon=True)
+        self.process.start()
+        self._ready = False
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.kill() # also ends a running efmtool computation
+            self.process.join()
+        self.process = None
+        self.conn = None
+
+    def _efmtool_args(self, work_dir: str):
+        # same options as efmtool_extern.calculate_flux_modes but with absolute paths
+        # because the working directory of the JVM is fixed when it starts
+        def path(fname):
+            return os.path.join(work_dir, fname)
+        return ['-kind', 'stoichiometry', '-arithmetic', 'double', '-zero', '1e-10',
+                '-compression', 'default', '-level', 'INFO', '-maxthreads', str(self.max_threads),
+                '-normalize', 'min', '-adjacency-method', 'pattern-tree-minzero',
+                '-rowordering', 'MostZerosOrAbsLexMin', '-tmpdir', work_dir, '-stoich', path('stoich.txt'),
+                '-rev', path('revs.txt'), '-meta', path('mnames.txt'), '-reac', path('rnames.txt'),
+                '-out', 'binary-doubles', path('efms.bin'), '-log', 'file', path('log.txt')]
+
+    def calculate_flux_modes(self, st: numpy.ndarray, reversible, print_progress_function=print, abort_callback=None):
+        '''
+        Like efmtool_extern.calculate_flux_modes with return_work_dir_only=True: returns a temporary
+        directory which contains the result file efms.bin or None if the computation failed or was aborted.
+        When the worker is busy or cannot be started the computation is passed on to efmtool_extern.
+        '''
+        if not self.lock.acquire(blocking=False):
+            return self._fallback(st, reversible, print_progress_function, abort_callback)
+        try:
+            self.start()
+            work_dir = TemporaryDirectory()
+            curr_dir = os.getcwd()
+            os.chdir(work_dir.name)
+            try:
+                efmtool_extern.write_efmtool_input(st, reversible, ['R'+str(i) for i in range(st.shape[1])],
+                                                   ['M'+str(i) for i in range(st.shape[0])])
+            finally:
+                os.chdir(curr_dir)
+            if not self._wait_until_ready(print_progress_function, abort_callback):
+                return None if abort_callback is not None and abort_callback() else \
+                    self._fallback(st, reversible, print_progress_function, abort_callback)
+            self.conn.send(self._efmtool_args(work_dir.name))
+            log_fname = os.path.join(work_dir.name, 'log.txt')
+            log_file = None
+            status = None
+            while status is None:
+                if self.conn.poll(0.5):
+                    status, message = self.conn.recv()
+                elif not self.process.is_alive():
+                    status, message = "error", "The efmtool worker terminated unexpectedly."
+                if log_file is None and os.path.isfile(log_fname):
+                    log_file = open(log_fname)
+                if log_file is not None:
+                    ln = log_file.readlines()
+                    if len(ln) > 0:
+                        print_progress_function("".join(ln).rstrip())
+                if status is None and abort_callback is not None and abort_callback():
+                    if log_file is not None:
+                        log_file.close()
+                    self.stop()
+                    self.start() # warm up again for the next computation
+                    return None
+            if log_file is not None:
+                log_file.close()
+            if status == "done" and os.path.isfile(os.path.join(work_dir.name, 'efms.bin')):
+                return work_dir
+            print_progress_function(message or "EFMtool failure")
+            if not self.process.is_alive(): # e.g. the JVM ran out of memory, restart for the next computation
+                self.stop()
+                self.start()
+            return None
+        finally:
+            self.lock.release()
+
+    def _wait_until_ready(self, print_progress_function, abort_callback) -> bool:
+        if self._ready:
+            return True
+        print_progress_function("Starting the efmtool worker...")
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive():
+                print_progress_function("The efmtool worker could not be started.")
+                self.stop()
+                return False
+            if abort_callback is not None and abort_callback():
+                self.stop()
+                self.start()
+                return False
+        self._ready = self.conn.recv()[0] == "ready"
+        return self._ready
+
+    def _fallback(self, st, reversible, print_progress_function, abort_callback):
+        return efmtool_extern.calculate_flux_modes(st, reversible, return_work_dir_only=True,
+                    jvm_max_memory=self.jvm_max_memory, max_threads=self.max_threads,
+                    print_progress_function=print_progress_function, abort_callback=abort_callback)
+
+
+_shared_worker = None
+
+
+def shared_worker() -> EFMToolWorker:
+    # the worker of the application, its JVM starts on first use and runs until the application ends
+    global _shared_worker
+    if _shared_worker is None:
+        _shared_worker = EFMToolWorker()
+    _shared_worker.start()
+    return _shared_worker
@@ -0,0 +1,107 @@
+"""Random sampling of the flux space with hit-and-run chains that run in parallel processes"""
+import multiprocessing
+import queue
+import traceback
+from typing import Callable
+import numpy
+import cobra
+from cobra.sampling import ACHRSampler
+
+from cnapy.flux_vector_container import FluxVectorMemmapWriter
+
+
+def _chain_sample_counts(num_samples: int, chains: int):
+    # distributes the samples as evenly as possible over the chains
+    return [num_samples // chains + (1 if c < num_samples % chains else 0) for c in range(chains)]
+
+
+def _sample_chain(model: cobra.Model, reac_id, num_samples: int, thinning: int, batch_size: int, seed: int,
+                  abort: Callable[[], bool]):
+    # generator that yields the samples of one ACHR chain in batches, the rows follow the order of reac_id
+    sampler = ACHRSampler(model, thinning=thinning, seed=seed)
+    remaining = num_samples
+    while remaining > 0 and not abort():
+        n = min(batch_size, remaining)
+        yield sampler.sample(n, fluxes=True)[reac_id].to_numpy()
+        remaining -= n
+
+
+def _chain_worker(model, reac_id, num_samples, thinning, batch_size, seed, result_queue, abort_event):
+    # runs in a worker process which receives its own copy of the model and solver instance for its chain
+    try:
+        for samples in _sample_chain(model, reac_id, num_samples, thinning, batch_size, seed, abort_event.is_set):
+            result_queue.put(('samples', samples))
+        result_queue.put(('done', None))
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+
+
+def sample_fluxes(model: cobra.Model, num_samples: int, fname: str, chains=1, thinning=100, batch_size=100,
+                  seed=None, samples_callback: Callable[[int], None] = None,
+                  abort_callback: Callable[[], bool] = None, print_progress_function=print) -> int:
+    '''
+    Draws num_samples flux vectors uniformly from the flux space of the model with ACHR hit-and-run chains
+    and writes them in the efmtool binary-doubles format to fname (see FluxVectorMemmapWriter). With more
+    than one chain each chain runs in its own worker process with its own seed (OptGP-style). The samples
+    are passed on in batches and written as they arrive; after each batch the file header is updated so
+    that the file can already be opened as FluxVectorMemmap and samples_callback receives the number of
+    samples written so far. Only the batches in transit are held in memory. Returns the number of samples
+    written which is smaller than num_samples if abort_callback returned True.
+    '''
+    reac_id = model.reactions.list_attr("id")
+    chains = max(1, min(chains, num_samples))
+    seeds = numpy.random.SeedSequence(seed).generate_state(chains).tolist()
+    counts = _chain_sample_counts(num_samples, chains)
+    abort = abort_callback if abort_callback is not None else (lambda: False)
+
+    def written(writer: FluxVectorMemmapWriter):
+        writer.flush()
+        print_progress_function("Sampled "+str(writer.num_rows)+" of "+str(num_samples)+" flux vectors.")
+        if samples_callback is not None:
+            samples_callback(writer.num_rows)
+
+    with FluxVectorMemmapWriter(fname, len(reac_id)) as writer:
+        if chains == 1:
+            with model:
+                for samples in _sample_chain(model, reac_id, num_samples, thinning, batch_size, seeds[0], abort):
+                    writer.append(samples)
+                    written(writer)
+            return writer.num_rows
+
+        ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+        result_queue = ctx.Queue(maxsize=2*chains) # the chains wait when the samples are not written fast enough
+        abort_event = ctx.Event()
+        # the model is pickled together with its solver so that the scenario constraints are kept
+        workers = [ctx.Process(target=_chain_worker, daemon=True,
+                               args=(model, reac_id, counts[c], thinning, batch_size, seeds[c],
+                                     result_queue, abort_event))
+                   for c in range(chains)]
+        for w in workers:
+            w.start()
+        running = chains
+        try:
+            while running > 0:
+                if abort():
+                    abort_event.set()
+                    break
+                alive = any(w.is_alive() for w in workers) # checked first, a finished worker has sent all its results
+                try:
+                    kind, content = result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if not alive:
+                        raise RuntimeError("The sampling processes terminated unexpectedly.")
+                    continue
+                if kind == 'samples':
+                    writer.append(content)
+                    written(writer)
+                elif kind == 'done':
+                    running -= 1
+                else:
+                    raise RuntimeError("Flux sampling failed in a worker process:\n"+content)
+        finally:
+            if running > 0: # aborted or failed, the remaining chains are not needed anymore
+                for w in workers:
+                    w.terminate()
+            for w in workers:
+                w.join()
+        return writer.num_rows
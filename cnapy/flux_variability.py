@@ -0,0 +1,525 @@
+"""Flux variability analysis in worker processes that each keep their own solver instance"""
+import hashlib
+import multiprocessing
+import pickle
+from typing import Callable, List
+import numpy
+import pandas
+import cobra
+from cobra.util.solver import fix_objective_as_constraint
+from optlang.interface import OPTIMAL, UNBOUNDED, INFEASIBLE
+from optlang.symbolics import Zero
+
+from cnapy.network_compression import cached_compress_network
+from cnapy.results_cache import ResultsCache
+
+# witness index of a range that holds in every steady state (blocked reaction)
+_ALWAYS_VALID = -2
+
+
+class _FVASolver:
+    '''
+    Minimizes and maximizes the flux of single reactions in one model; only the objective
+    coefficients of the current reaction are changed between the LPs so that the solver
+    can start from the previous basis. With prune the fluxes of every optimal solution are
+    recorded and an LP is skipped when a recorded solution already reaches the bound of the
+    reaction in the respective direction. With record_witnesses the solutions in which the
+    minimum and maximum of each reaction are attained are kept as witnesses.
+    '''
+
+    def __init__(self, model: cobra.Model, prune=False, record_witnesses=False):
+        self.model = model
+        self.prune = prune
+        self.record_witnesses = record_witnesses
+        self.num_lps = 0
+        self.num_skipped = 0
+        model.objective = model.problem.Objective(Zero, direction='max')
+        if prune or record_witnesses:
+            self.reac_index = {r.id: i for i, r in enumerate(model.reactions)}
+            var_index = {v.name: i for i, v in enumerate(model.variables)}
+            self.forward_idx = numpy.array([var_index[r.forward_variable.name] for r in model.reactions], dtype=int)
+            self.reverse_idx = numpy.array([var_index[r.reverse_variable.name] for r in model.reactions], dtype=int)
+            self.lower_bounds = numpy.array(model.reactions.list_attr("lower_bound"), dtype=float)
+            self.upper_bounds = numpy.array(model.reactions.list_attr("upper_bound"), dtype=float)
+            self.observed_min = numpy.full(len(model.reactions), numpy.inf)
+            self.observed_max = numpy.full(len(model.reactions), -numpy.inf)
+            # the solutions in which observed_min and observed_max were attained
+            self.argmin = numpy.full(len(model.reactions), -1, dtype=int)
+            self.argmax = numpy.full(len(model.reactions), -1, dtype=int)
+            self.solutions = {}
+            self.num_solutions = 0
+
+    def _observe(self):
+        primal = numpy.fromiter(self.model.solver.primal_values.values(), dtype=float,
+                                count=len(self.model.variables))
+        fluxes = primal[self.forward_idx] - primal[self.reverse_idx]
+        if self.record_witnesses:
+            self.argmin[fluxes < self.observed_min] = self.num_solutions
+            self.argmax[fluxes > self.observed_max] = self.num_solutions
+            self.solutions[self.num_solutions] = fluxes
+            self.num_solutions += 1
+        numpy.minimum(self.observed_min, fluxes, out=self.observed_min)
+        numpy.maximum(self.observed_max, fluxes, out=self.observed_max)
+
+    def _optimize(self, direction: str) -> float:
+        self.model.solver.objective.direction = direction
+        status = self.model.solver.optimize()
+        self.num_lps += 1
+        if status == OPTIMAL:
+            if self.prune or self.record_witnesses:
+                self._observe()
+            return self.model.solver.objective.value
+        if status == UNBOUNDED:
+            return -numpy.inf if direction == 'min' else numpy.inf
+        return numpy.nan
+
+    def flux_range(self, reac_id: str):
+        # returns (minimum, maximum, witness of the minimum, witness of the maximum), -1 means no witness
+        at_lower = at_upper = False
+        if self.prune:
+            i = self.reac_index[reac_id]
+            at_lower = self.observed_min[i] <= self.lower_bounds[i] + self.model.tolerance
+            at_upper = self.observed_max[i] >= self.upper_bounds[i] - self.model.tolerance
+            self.num_skipped += int(at_lower) + int(at_upper)
+        if at_lower and at_upper:
+            minimum, maximum = self.lower_bounds[i], self.upper_bounds[i]
+        else:
+            reaction = self.model.reactions.get_by_id(reac_id)
+            self.model.solver.objective.set_linear_coefficients({reaction.forward_variable: 1,
+                                                                 reaction.reverse_variable: -1})
+            try:
+                minimum = self.lower_bounds[i] if at_lower else self._optimize('min')
+                maximum = self.upper_bounds[i] if at_upper else self._optimize('max')
+            finally:
+                self.model.solver.objective.set_linear_coefficients({reaction.forward_variable: 0,
+                                                                     reaction.reverse_variable: 0})
+        if not self.record_witnesses:
+            return minimum, maximum, -1, -1
+        i = self.reac_index[reac_id]
+        return minimum, maximum, int(self.argmin[i]) if numpy.isfinite(minimum) else -1, \
+            int(self.argmax[i]) if numpy.isfinite(maximum) else -1
+
+    def solve_chunk(self, reac_ids: List[str]):
+        # returns the ranges with their witnesses (row indices into the matrix of the witness solutions
+        # of this chunk) together with the number of LPs solved and skipped for them
+        num_lps, num_skipped = self.num_lps, self.num_skipped
+        ranges = [self.flux_range(r) for r in reac_ids]
+        witnesses = None
+        if self.record_witnesses:
+            used = sorted({w for r in ranges for w in r[2:] if w >= 0})
+            local = {w: j for j, w in enumerate(used)}
+            ranges = [(lb, ub, local.get(wmin, -1), local.get(wmax, -1)) for lb, ub, wmin, wmax in ranges]
+            witnesses = numpy.array([self.solutions[w] for w in used]).reshape(len(used), len(self.reac_index))
+            # only the solutions that can still become witnesses of later reactions are kept
+            referenced = set(self.argmin.tolist()) | set(self.argmax.tolist())
+            self.solutions = {w: s for w, s in self.solutions.items() if w in referenced}
+        return ranges, self.num_lps - num_lps, self.num_skipped - num_skipped, witnesses
+
+
+def flux_coupling(model: cobra.Model):
+    '''
+    Finds the reactions that are blocked and the groups of fully coupled reactions with the steady-state
+    steps of compress_network; no LP is solved. Returns the set of blocked reaction IDs and a dictionary
+    that maps each coupled reaction that is not the representative of its group to
+    (representative ID, factor) such that flux = factor * flux of the representative.
+    '''
+    reac_id = model.reactions.list_attr("id")
+    st = cobra.util.array.create_stoichiometric_matrix(model, array_type='dense')
+    lower_bounds = numpy.array(model.reactions.list_attr("lower_bound"), dtype=float)
+    upper_bounds = numpy.array(model.reactions.list_attr("upper_bound"), dtype=float)
+    # reactions that can only run backwards are inverted so that they count as irreversible
+    sign = numpy.where((lower_bounds < 0) & (upper_bounds <= 0), -1.0, 1.0)
+    network = cached_compress_network(st * sign, (lower_bounds < 0) & (upper_bounds > 0))
+    blocked = {reac_id[r] for r in network.blocked}
+    coupled = {}
+    expansion = network.expansion.tocsc()
+    for c in range(expansion.shape[1]):
+        rows = expansion.indices[expansion.indptr[c]:expansion.indptr[c+1]]
+        factors = expansion.data[expansion.indptr[c]:expansion.indptr[c+1]] * sign[rows]
+        for r, f in zip(rows[1:], factors[1:]):
+            coupled[reac_id[r]] = (reac_id[rows[0]], f/factors[0])
+    return blocked, coupled
+
+
+def _guided_chunks(num_items: int, processes: int, min_chunk_size: int, num_first=0):
+    # guided scheduling: each chunk takes a share of the remaining reactions so that the chunks
+    # become smaller towards the end and the workers finish at about the same time;
+    # the first num_first items are handed out in chunks of min_chunk_size so that their results come early
+    chunks = [(start, min(start + min_chunk_size, num_first)) for start in range(0, num_first, min_chunk_size)]
+    start = num_first
+    while start < num_items:
+        size = max(min_chunk_size, (num_items - start) // (2*processes))
+        chunks.append((start, min(start + size, num_items)))
+        start += size
+    return chunks
+
+
+_worker_solver = None
+
+
+def _init_worker(model, prune, record_witnesses):
+    # runs once in each worker process which then keeps its model and solver instance for all its chunks;
+    # the model is passed pickled together with its solver so that additional (scenario) constraints are kept
+    global _worker_solver
+    _worker_solver = _FVASolver(model, prune, record_witnesses)
+
+
+def _solve_chunk(chunk):
+    start, reac_ids = chunk
+    return start, _worker_solver.solve_chunk(reac_ids)
+
+
+def _prepare_model(model: cobra.Model, fraction_of_optimum: float):
+    # raises cobra.exceptions.Infeasible if there is no flux vector, must be called in a model context
+    status = model.solver.optimize()
+    if status == INFEASIBLE:
+        raise cobra.exceptions.Infeasible("The model is infeasible.")
+    if fraction_of_optimum > 0:
+        if status != OPTIMAL:
+            raise cobra.exceptions.Infeasible("The objective of the model has no finite optimum.")
+        fix_objective_as_constraint(model, fraction=fraction_of_optimum)
+
+
+def _solve_ranges(model: cobra.Model, reaction_list: List[str], processes: int, min_chunk_size: int, prune: bool,
+                  record_witnesses: bool, result_callback, abort_callback, print_progress_function, num_priority=0):
+    # returns (minimum, maximum, witness of the minimum, witness of the maximum, witness matrix, aborted);
+    # the witness indices refer to the rows of the witness matrix whose columns are the model reactions;
+    # the first num_priority reactions of reaction_list are solved first
+    n = len(reaction_list)
+    minimum = numpy.full(n, numpy.nan)
+    maximum = numpy.full(n, numpy.nan)
+    min_witness = numpy.full(n, -1, dtype=int)
+    max_witness = numpy.full(n, -1, dtype=int)
+    witnesses = []
+    num_witnesses = 0
+    done = 0
+    num_lps = 0
+    num_skipped = 0
+
+    def store(positions, ranges):
+        nonlocal done
+        minimum[positions] = [r[0] for r in ranges]
+        maximum[positions] = [r[1] for r in ranges]
+        min_witness[positions] = [r[2] for r in ranges]
+        max_witness[positions] = [r[3] for r in ranges]
+        done += len(positions)
+        print_progress_function("FVA: "+str(done)+" of "+str(n)+" reactions.")
+        if result_callback is not None:
+            result_callback([reaction_list[i] for i in positions], minimum[positions].tolist(),
+                            maximum[positions].tolist())
+
+    # the reactions whose ranges are computed and for each of them the requested reactions
+    # (position in reaction_list, factor) that take over its range
+    dependents = {}
+    blocked = []
+    if prune:
+        blocked_reactions, coupled = flux_coupling(model)
+        for pos, r in enumerate(reaction_list):
+            if r in blocked_reactions:
+                blocked.append(pos)
+            else:
+                rep, factor = coupled.get(r, (r, 1.0))
+                dependents.setdefault(rep, []).append((pos, factor))
+        print_progress_function(str(len(blocked))+" reactions are blocked, "+
+                                str(n - len(blocked) - len(dependents))+" are coupled to other reactions.")
+    else:
+        for pos, r in enumerate(reaction_list):
+            dependents.setdefault(r, []).append((pos, 1.0))
+    if len(blocked) > 0:
+        store(blocked, [(0.0, 0.0, _ALWAYS_VALID, _ALWAYS_VALID)]*len(blocked))
+    solve_ids = list(dependents)
+
+    def store_solved(start, result):
+        nonlocal num_lps, num_skipped, num_witnesses
+        ranges, lps, skipped, chunk_witnesses = result
+        num_lps += lps
+        num_skipped += skipped
+        offset = num_witnesses
+        if chunk_witnesses is not None:
+            witnesses.append(chunk_witnesses)
+            num_witnesses += chunk_witnesses.shape[0]
+        positions = []
+        dependent_ranges = []
+        for r, (lb, ub, wmin, wmax) in zip(solve_ids[start:start+len(ranges)], ranges):
+            wmin = wmin + offset if wmin >= 0 else wmin
+            wmax = wmax + offset if wmax >= 0 else wmax
+            for pos, factor in dependents[r]:
+                positions.append(pos)
+                # a coupled reaction attains its extremes in the same flux vectors as its representative
+                dependent_ranges.append((factor*lb, factor*ub, wmin, wmax) if factor > 0 else
+                                        (factor*ub, factor*lb, wmax, wmin))
+        store(positions, dependent_ranges)
+
+    # the reactions that are solved for the priority reactions come first because dependents keeps the insertion order
+    num_first = sum(1 for d in dependents.values() if d[0][0] < num_priority)
+    chunks = [(start, solve_ids[start:end])
+              for start, end in _guided_chunks(len(solve_ids), processes, min_chunk_size, num_first)]
+    processes = max(1, min(processes, len(chunks)))
+    aborted = False
+    if processes == 1:
+        solver = _FVASolver(model, prune, record_witnesses)
+        for start, reac_ids in chunks:
+            store_solved(start, solver.solve_chunk(reac_ids))
+            if abort_callback is not None and abort_callback():
+                aborted = True
+                break
+    else:
+        ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+        with ctx.Pool(processes, initializer=_init_worker, initargs=(model, prune, record_witnesses)) as pool:
+            for start, result in pool.imap_unordered(_solve_chunk, chunks):
+                store_solved(start, result)
+                if abort_callback is not None and abort_callback():
+                    pool.terminate()
+                    aborted = True
+                    break
+    if prune:
+        print_progress_function("FVA: "+str(num_lps)+" LPs solved, "+str(num_skipped+2*(n-len(solve_ids)))+
+                                " of "+str(2*n)+" LPs were not needed.")
+    if not record_witnesses:
+        witnesses = None
+    elif len(witnesses) > 0:
+        witnesses = numpy.concatenate(witnesses)
+    else:
+        witnesses = numpy.zeros((0, len(model.reactions)))
+    return minimum, maximum, min_witness, max_witness, witnesses, aborted
+
+
+def _prioritize(reaction_list: List[str], priority_reactions: List[str]):
+    # reorders reaction_list so that the reactions from priority_reactions come first, also returns their number
+    if not priority_reactions:
+        return reaction_list, 0
+    included = set(reaction_list)
+    first = [r for r in dict.fromkeys(priority_reactions) if r in included]
+    first_set = set(first)
+    return first + [r for r in reaction_list if r not in first_set], len(first)
+
+
+def _cache_key(fva_hash, model: cobra.Model, fraction_of_optimum: float) -> str:
+    # same name as in optlang_enumerator.mcs_computation.flux_variability_analysis so that
+    # the results are shared with the MCS computation and with caches written before
+    return ResultsCache.key(model.id+"_FVA", fva_hash, (False, fraction_of_optimum, model.tolerance),
+                            model.reactions.list_attr("objective_coefficient"), model.objective_direction.encode())
+
+
+def _load_from_cache(results_cache: ResultsCache, name: str, result_callback, print_progress_function):
+    result = results_cache.load(name, pandas.read_pickle)
+    if result is not None:
+        print_progress_function("Loaded FVA result from "+str(results_cache.path(name)))
+        if result_callback is not None:
+            result_callback(result.index.tolist(), result.minimum.tolist(), result.maximum.tolist())
+    return result
+
+
+def _save_to_cache(result: pandas.DataFrame, results_cache: ResultsCache, name: str, print_progress_function):
+    if results_cache.save(name, result, lambda df, path: df.to_pickle(path)):
+        print_progress_function("Saved FVA result to "+str(results_cache.path(name)))
+    else:
+        print_progress_function("Failed to save FVA result to "+str(results_cache.path(name)))
+
+
+def flux_variability_analysis(model: cobra.Model, reaction_list: List[str] = None, fraction_of_optimum=0.0,
+                              processes=1, min_chunk_size=4, prune=False, results_cache: ResultsCache = None,
+                              fva_hash=None, priority_reactions: List[str] = None,
+                              result_callback: Callable[[List[str], List[float], List[float]], None] = None,
+                              abort_callback: Callable[[], bool] = None,
+                              print_progress_function=print) -> pandas.DataFrame:
+    '''
+    Computes the minimal and maximal flux of the reactions in reaction_list (default: all reactions)
+    while the objective of the model stays at fraction_of_optimum of its optimum. With more than one
+    process the reactions are handed out in chunks of decreasing size to worker processes that each
+    set up their own solver instance once. The ranges of each chunk are passed to result_callback
+    as soon as they are available; the reactions in priority_reactions (e.g. those on the map that
+    is shown) are solved first in small chunks. Unbounded ranges are given as infinite values.
+    With prune the ranges of blocked reactions and of reactions that are fully coupled to another
+    one are inferred from a pre-pass without LPs (see flux_coupling) and the LPs whose bound is
+    already reached by an earlier solution are skipped.
+    Returns a DataFrame with the columns 'minimum' and 'maximum' indexed by the reaction IDs like
+    cobra.flux_analysis.flux_variability_analysis; if abort_callback returned True the ranges that
+    have not been computed are NaN. Raises cobra.exceptions.Infeasible if the model is infeasible.
+    When results_cache and fva_hash (see CNApyModel.stoichiometry_hash_object) are given the
+    result for all reactions is loaded from or saved to the cache.
+    '''
+    cache_key = None
+    if results_cache is not None and fva_hash is not None and reaction_list is None:
+        cache_key = _cache_key(fva_hash, model, fraction_of_optimum)
+        result = _load_from_cache(results_cache, cache_key, result_callback, print_progress_function)
+        if result is not None:
+            return result
+
+    if reaction_list is None:
+        reaction_list = model.reactions.list_attr("id")
+    solve_order, num_priority = _prioritize(reaction_list, priority_reactions)
+    with model:
+        _prepare_model(model, fraction_of_optimum)
+        minimum, maximum, _, _, _, aborted = _solve_ranges(model, solve_order, processes, min_chunk_size, prune,
+                                                           False, result_callback, abort_callback,
+                                                           print_progress_function, num_priority)
+
+    result = pandas.DataFrame({'minimum': minimum, 'maximum': maximum}, index=solve_order).loc[reaction_list]
+    if cache_key is not None and not aborted:
+        _save_to_cache(result, results_cache, cache_key, print_progress_function)
+    return result
+
+
+class FluxSpaceFingerprint:
+    '''
+    Describes the flux space of a model by a hash of its reactions and their stoichiometry, the reaction
+    bounds and the additional linear constraints on the reaction fluxes (e.g. from the scenario).
+    constraints is None if some constraint cannot be expressed in terms of the reaction fluxes.
+    '''
+
+    def __init__(self, model: cobra.Model):
+        self.reac_id = model.reactions.list_attr("id")
+        h = hashlib.blake2b(digest_size=16)
+        for r in model.reactions:
+            h.update(pickle.dumps((r.id, sorted((m.id, c) for m, c in r.metabolites.items()))))
+        self.network_hash = h.digest()
+        self.lower_bounds = numpy.array(model.reactions.list_attr("lower_bound"), dtype=float)
+        self.upper_bounds = numpy.array(model.reactions.list_attr("upper_bound"), dtype=float)
+        self.constraints = {} # tuple of (reaction index, coefficient) -> (lb, ub)
+        variables = {}
+        for i, r in enumerate(model.reactions):
+            variables[r.forward_variable.name] = (i, 1.0)
+            variables[r.reverse_variable.name] = (i, -1.0)
+        metabolites = set(model.metabolites.list_attr("id"))
+        for constraint in model.constraints:
+            if constraint.name in metabolites:
+                continue
+            coefficients = {}
+            for variable, c in constraint.get_linear_coefficients(constraint.variables).items():
+                if variable.name not in variables:
+                    self.constraints = None
+                    return
+                i, sign = variables[variable.name]
+                coefficients.setdefault(i, []).append(sign * c)
+            # the forward and reverse variable of a reaction must have opposite coefficients
+            if any(len(c) != 2 or c[0] != c[1] for c in coefficients.values()):
+                self.constraints = None
+                return
+            key = tuple(sorted((i, c[0]) for i, c in coefficients.items() if c[0] != 0))
+            self.constraints[key] = (-numpy.inf if constraint.lb is None else constraint.lb,
+                                     numpy.inf if constraint.ub is None else constraint.ub)
+
+    def tightens(self, previous) -> bool:
+        # True if this flux space is contained in the previous one because it only has tighter bounds or more constraints
+        if self.constraints is None or previous.constraints is None or self.reac_id != previous.reac_id \
+            or self.network_hash != previous.network_hash:
+            return False
+        if numpy.any(self.lower_bounds < previous.lower_bounds) or numpy.any(self.upper_bounds > previous.upper_bounds):
+            return False
+        for key, (lb, ub) in previous.constraints.items():
+            if key not in self.constraints or self.constraints[key][0] < lb or self.constraints[key][1] > ub:
+                return False
+        return True
+
+    def contains(self, fluxes: numpy.ndarray, tolerance: float) -> numpy.ndarray:
+        # for each row of fluxes whether it fulfills the bounds and constraints (the steady state is not checked)
+        def tol(bounds):
+            return tolerance * numpy.maximum(1.0, numpy.abs(numpy.nan_to_num(bounds, posinf=0, neginf=0)))
+        inside = numpy.all((fluxes >= self.lower_bounds - tol(self.lower_bounds)) &
+                           (fluxes <= self.upper_bounds + tol(self.upper_bounds)), axis=1)
+        for key, (lb, ub) in self.constraints.items():
+            values = fluxes[:, [i for i, _ in key]] @ numpy.array([c for _, c in key])
+            inside &= (values >= lb - tol(lb)) & (values <= ub + tol(ub))
+        return inside
+
+
+class FVAResult:
+    '''
+    The ranges of all reactions together with a witness flux vector for the minimum and the maximum
+    of each reaction (row indices into witnesses, -1 if there is none) and the fingerprint of the
+    flux space for which they were computed; witnesses is None if the ranges were loaded from the cache
+    '''
+
+    def __init__(self, ranges: pandas.DataFrame, witnesses: numpy.ndarray, min_witness: numpy.ndarray,
+                 max_witness: numpy.ndarray, fingerprint: FluxSpaceFingerprint):
+        self.ranges = ranges
+        self.witnesses = witnesses
+        self.min_witness = min_witness
+        self.max_witness = max_witness
+        self.fingerprint = fingerprint
+
+    def valid_ranges(self, fingerprint: FluxSpaceFingerprint, tolerance: float) -> numpy.ndarray:
+        # for each reaction whether its range is unchanged in a flux space that tightens the one of this result:
+        # the range stays the same when both of its witnesses are still feasible
+        valid_witness = fingerprint.contains(self.witnesses, tolerance)
+
+        def valid(w):
+            return (w == _ALWAYS_VALID) | ((w >= 0) & valid_witness[numpy.maximum(w, 0)])
+        return valid(self.min_witness) & valid(self.max_witness)
+
+    def merge(self, positions: numpy.ndarray, minimum, maximum, min_witness, max_witness, witnesses,
+              fingerprint: FluxSpaceFingerprint):
+        # replaces the ranges at positions, only the witnesses that are still referenced are kept
+        ranges = self.ranges.copy()
+        ranges.iloc[positions, 0] = minimum
+        ranges.iloc[positions, 1] = maximum
+        offset = self.witnesses.shape[0]
+        all_min_witness = self.min_witness.copy()
+        all_max_witness = self.max_witness.copy()
+        all_min_witness[positions] = numpy.where(min_witness >= 0, min_witness + offset, min_witness)
+        all_max_witness[positions] = numpy.where(max_witness >= 0, max_witness + offset, max_witness)
+        all_witnesses = numpy.concatenate((self.witnesses, witnesses))
+        used = numpy.unique(numpy.concatenate((all_min_witness, all_max_witness)))
+        used = used[used >= 0]
+        remap = numpy.full(all_witnesses.shape[0] + 1, -1, dtype=int)
+        remap[used] = numpy.arange(len(used))
+        all_min_witness = numpy.where(all_min_witness >= 0, remap[all_min_witness], all_min_witness)
+        all_max_witness = numpy.where(all_max_witness >= 0, remap[all_max_witness], all_max_witness)
+        return FVAResult(ranges, all_witnesses[used, :], all_min_witness, all_max_witness, fingerprint)
+
+
+def incremental_flux_variability_analysis(model: cobra.Model, previous: FVAResult = None, processes=1,
+                                          min_chunk_size=4, prune=True, results_cache: ResultsCache = None,
+                                          fva_hash=None, priority_reactions: List[str] = None,
+                                          result_callback: Callable[[List[str], List[float], List[float]], None] = None,
+                                          abort_callback: Callable[[], bool] = None,
+                                          print_progress_function=print) -> FVAResult:
+    '''
+    FVA of all reactions without an optimality requirement on the objective that keeps a witness flux
+    vector for each minimum and maximum. If the flux space of the model is contained in the one of the
+    previous result (only tighter bounds or additional constraints), the range of a reaction is taken
+    over when both of its witnesses are still feasible and only the other reactions are solved again.
+    Otherwise all ranges are computed (or loaded from the cache) as in flux_variability_analysis.
+    result_callback first receives the ranges that are taken over and then those of the priority_reactions.
+    Returns None if abort_callback returned True.
+    '''
+    reac_id = model.reactions.list_attr("id")
+    fingerprint = FluxSpaceFingerprint(model)
+    incremental = previous is not None and previous.witnesses is not None and fingerprint.tightens(previous.fingerprint)
+    cache_key = None
+    if not incremental and results_cache is not None and fva_hash is not None:
+        cache_key = _cache_key(fva_hash, model, 0.0)
+        ranges = _load_from_cache(results_cache, cache_key, result_callback, print_progress_function)
+        if ranges is not None:
+            # the cached ranges have no witnesses, therefore the next FVA will not be incremental
+            return FVAResult(ranges, None, None, None, fingerprint)
+    with model:
+        _prepare_model(model, 0.0)
+        if incremental:
+            valid = previous.valid_ranges(fingerprint, model.tolerance)
+            print_progress_function("FVA: the ranges of "+str(numpy.sum(valid))+" of "+str(len(reac_id))+
+                                    " reactions are still valid.")
+            if result_callback is not None:
+                result_callback([reac_id[i] for i in numpy.nonzero(valid)[0]],
+                                previous.ranges.minimum.values[valid].tolist(),
+                                previous.ranges.maximum.values[valid].tolist())
+            positions = numpy.nonzero(~valid)[0]
+        else:
+            positions = numpy.arange(len(reac_id))
+        solve_order, num_priority = _prioritize([reac_id[i] for i in positions], priority_reactions)
+        reac_index = {r: i for i, r in enumerate(reac_id)}
+        positions = numpy.array([reac_index[r] for r in solve_order], dtype=int)
+        minimum, maximum, min_witness, max_witness, witnesses, aborted = _solve_ranges(
+            model, solve_order, processes, min_chunk_size, prune, True,
+            result_callback, abort_callback, print_progress_function, num_priority)
+    if aborted:
+        return None
+    if incremental:
+        return previous.merge(positions, minimum, maximum, min_witness, max_witness, witnesses, fingerprint)
+    order = numpy.argsort(positions) # back to the order of the model reactions
+    minimum, maximum, min_witness, max_witness = minimum[order], maximum[order], min_witness[order], max_witness[order]
+    ranges = pandas.DataFrame({'minimum': minimum, 'maximum': maximum}, index=reac_id)
+    if cache_key is not None:
+        _save_to_cache(ranges, results_cache, cache_key, print_progress_function)
+    return FVAResult(ranges, witnesses, min_witness, max_witness, fingerprint)
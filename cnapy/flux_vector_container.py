@@ -1,14 +1,25 @@
+import io
+import itertools
+import json
 import os
+from collections import OrderedDict
 import numpy
+import scipy.sparse
 from qtpy.QtWidgets import QMessageBox
 
+from cnapy.mode_index import SupportIndex, InvertedModeIndex
+
 
 class FluxVectorContainer:
     def __init__(self, matORfname, reac_id=None, irreversible=None, unbounded=None):
         if type(matORfname) is str:
             try:
                 l = numpy.load(matORfname, allow_pickle=True)  # allow_pickle to read back sparse matrices saved as fv_mat
-                self.fv_mat = l['fv_mat']
+                if 'fv_mat' in l:
+                    self.fv_mat = l['fv_mat']
+                else: # saved by FluxVectorSparse
+                    self.fv_mat = scipy.sparse.csr_matrix((l['fv_mat_data'], l['fv_mat_indices'], l['fv_mat_indptr']),
+                                                          shape=tuple(l['fv_mat_shape']))
             except Exception:
                 QMessageBox.critical(
                     None,
@@ -39,6 +50,25 @@ class FluxVectorContainer:
     def __len__(self):
         return self.fv_mat.shape[0]
 
+    @property
+    def support_index(self) -> SupportIndex:
+        # built on first access and then kept until the container is cleared
+        if getattr(self, '_support_index', None) is None or len(self._support_index) != len(self):
+            self._support_index = SupportIndex.from_modes(self)
+        return self._support_index
+
+    @property
+    def inverted_index(self) -> InvertedModeIndex:
+        # built on first access and then kept until the container is cleared
+        if getattr(self, '_inverted_index', None) is None or self._inverted_index.num_modes != len(self):
+            self._inverted_index = InvertedModeIndex.from_modes(self)
+        return self._inverted_index
+
+    def iter_chunks(self, chunk_size=10000):
+        # yields (first row index, block of rows) so that statistics can be computed without loading all of fv_mat
+        for start in range(0, self.fv_mat.shape[0], chunk_size):
+            yield start, self.fv_mat[start:start+chunk_size, :]
+
     def is_integer_vector_rounded(self, idx, decimals=0):
         # TODO: does not yet work when fv_mat is list of lists sparse matrix
         # return all([val.is_integer() for val in numpy.round(self.fv_mat[idx, :], decimals)])
@@ -53,11 +83,66 @@ class FluxVectorContainer:
 
     def clear(self):
         self.fv_mat = numpy.zeros((0, 0))
+        self._support_index = None
+        self._inverted_index = None
         self.reac_id = []
         self.irreversible = numpy.array(0)
         self.unbounded = numpy.array(0)
 
 
+class FluxVectorSparse(FluxVectorContainer):
+    '''
+    Keeps fv_mat as scipy.sparse.csr_matrix; the support of a flux vector is directly available
+    from the CSR structure so that single vectors can be accessed without densifying them
+    '''
+
+    def __init__(self, matORfname, reac_id=None, irreversible=None, unbounded=None):
+        super().__init__(matORfname, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+        if not hasattr(self, 'fv_mat'): # loading failed
+            self.clear()
+            return
+        self.fv_mat = scipy.sparse.csr_matrix(self.fv_mat)
+        self.fv_mat.eliminate_zeros()
+        self.fv_mat.sort_indices()
+
+    @classmethod
+    def from_dense_chunks(cls, mat, reac_id, irreversible=None, unbounded=None, rows=None, chunk_size=10000):
+        # mat can be a numpy.memmap; only chunk_size rows of it are held densely in memory at any time
+        if rows is None:
+            rows = numpy.arange(mat.shape[0])
+        blocks = [scipy.sparse.csr_matrix(numpy.asarray(mat[rows[i:i+chunk_size], :], dtype=float))
+                  for i in range(0, len(rows), chunk_size)]
+        if len(blocks) == 0:
+            fv_mat = scipy.sparse.csr_matrix((0, len(reac_id)))
+        else:
+            fv_mat = scipy.sparse.vstack(blocks, format='csr')
+        return cls(fv_mat, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+
+    def support(self, idx):
+        # indices of the reactions with non-zero flux in flux vector idx
+        return self.fv_mat.indices[self.fv_mat.indptr[idx]:self.fv_mat.indptr[idx+1]]
+
+    def support_sizes(self):
+        return numpy.diff(self.fv_mat.indptr)
+
+    def is_integer_vector_rounded(self, idx, decimals=0):
+        values = self.fv_mat.data[self.fv_mat.indptr[idx]:self.fv_mat.indptr[idx+1]]
+        return bool(numpy.all(numpy.mod(numpy.round(values, decimals), 1) == 0))
+
+    def __getitem__(self, idx):
+        start, end = self.fv_mat.indptr[idx], self.fv_mat.indptr[idx+1]
+        return {self.reac_id[i]: float(v) for i, v in zip(self.fv_mat.indices[start:end], self.fv_mat.data[start:end])}
+
+    def save(self, fname):
+        numpy.savez_compressed(fname, fv_mat_data=self.fv_mat.data, fv_mat_indices=self.fv_mat.indices,
+                               fv_mat_indptr=self.fv_mat.indptr, fv_mat_shape=numpy.array(self.fv_mat.shape),
+                               reac_id=self.reac_id, irreversible=self.irreversible, unbounded=self.unbounded)
+
+    def clear(self):
+        super().clear()
+        self.fv_mat = scipy.sparse.csr_matrix((0, 0))
+
+
 class FluxVectorMemmap(FluxVectorContainer):
     '''
     This class can be used to open an efmtool binary-doubles file directly as a memory map
@@ -74,8 +159,11 @@ class FluxVectorMemmap(FluxVectorContainer):
         with open(self._memmap_fname, 'rb') as fh:
             num_efm = numpy.fromfile(fh, dtype='>i8', count=1)[0]
             num_reac = numpy.fromfile(fh, dtype='>i4', count=1)[0]
-        super().__init__(numpy.memmap(self._memmap_fname, mode='r+', dtype='>d',
-                                      offset=13, shape=(num_efm, num_reac), order='C'), reac_id)
+        if num_efm == 0: # an empty file cannot be memory mapped
+            super().__init__(numpy.zeros((0, num_reac)), reac_id)
+        else:
+            super().__init__(numpy.memmap(self._memmap_fname, mode='r+', dtype='>d',
+                                          offset=13, shape=(num_efm, num_reac), order='C'), reac_id)
 
     def clear(self):
         # lose the reference to the memmap (does not have a close() method)
@@ -86,3 +174,640 @@ class FluxVectorMemmap(FluxVectorContainer):
 
     def __del__(self):
         del self.fv_mat  # lose the reference to the memmap so that the later implicit deletion of the temporary directory can proceed without problems
+
+
+class FluxVectorMemmapWriter:
+    '''
+    Appends flux vectors to a file in the efmtool binary-doubles format which can afterwards be
+    opened as FluxVectorMemmap; only the vectors passed to append are held in memory
+    '''
+
+    def __init__(self, fname, num_reac):
+        self.fname = fname
+        self.num_reac = num_reac
+        self.num_rows = 0
+        self._fh = open(fname, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self._fh.write(numpy.array(self.num_rows, dtype='>i8').tobytes())
+        self._fh.write(numpy.array(self.num_reac, dtype='>i4').tobytes())
+        self._fh.write(b'\x00') # binary flag (boolean written as byte)
+
+    def append(self, rows):
+        rows = numpy.asarray(rows, dtype='>d')
+        if rows.ndim != 2 or rows.shape[1] != self.num_reac:
+            raise ValueError('rows must be a matrix with '+str(self.num_reac)+' columns')
+        self._fh.write(numpy.ascontiguousarray(rows).tobytes())
+        self.num_rows += rows.shape[0]
+
+    def flush(self):
+        # updates the header so that the vectors written so far can be opened as FluxVectorMemmap while writing continues
+        self._fh.flush() # the rows must be in the file before the header announces them
+        self._fh.seek(0)
+        self._write_header()
+        self._fh.seek(0, os.SEEK_END)
+        self._fh.flush()
+
+    def close(self):
+        if not self._fh.closed:
+            self._fh.seek(0)
+            self._write_header()
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _integer_scale_factors(block: numpy.ndarray, tol=1e-9):
+    # for each row a factor that makes it integral, 0 where neither 1 nor 1/(smallest absolute value) does so
+    abs_block = numpy.abs(block)
+    min_abs = numpy.where(abs_block > 0, abs_block, numpy.inf).min(axis=1)
+    min_abs[numpy.isinf(min_abs)] = 1.0 # zero rows
+    factors = numpy.zeros(block.shape[0])
+    for candidate in (numpy.ones(block.shape[0]), 1.0/min_abs):
+        scaled = block * candidate[:, None]
+        integral = numpy.all(numpy.abs(scaled - numpy.round(scaled)) <= tol * numpy.maximum(1.0, numpy.abs(scaled)), axis=1)
+        integral &= numpy.abs(scaled).max(axis=1, initial=0) < 2**31
+        factors = numpy.where((factors == 0) & integral, candidate, factors)
+    return factors
+
+
+class CompactFluxMatrix:
+    '''
+    Read-only matrix view on the compact storage of FluxVectorCompact; indexing returns float values
+    '''
+
+    def __init__(self, groups, scale: numpy.ndarray, num_reac: int):
+        self.groups = groups # list of (column indices, matrix with the stored values of these columns)
+        self.scale = scale # float value = stored value * scale of the mode
+        self.shape = (len(scale), num_reac)
+        self.dtype = numpy.dtype(float)
+
+    @property
+    def nbytes(self) -> int:
+        return self.scale.nbytes + sum(mat.nbytes + cols.nbytes for cols, mat in self.groups)
+
+    def get_rows(self, rows) -> numpy.ndarray:
+        scale = self.scale[rows]
+        values = numpy.zeros((len(scale), self.shape[1]))
+        for cols, mat in self.groups:
+            values[:, cols] = mat[rows, :]
+        values *= scale[:, None]
+        return values
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+        else:
+            rows, cols = key, slice(None)
+        if isinstance(rows, (int, numpy.integer)):
+            return self.get_rows(numpy.array([rows]))[0, cols]
+        return self.get_rows(rows)[:, cols]
+
+
+class FluxVectorCompact(FluxVectorContainer):
+    '''
+    Stores each flux vector as small integers times a scale factor per mode; the integer type
+    (int8, int16 or int32) is chosen for each column by its value range. When some vectors are
+    not integer-scalable all vectors are stored as float32 scaled to a maximum absolute value of 1.
+    fv_mat is a CompactFluxMatrix so that callers still get float values.
+    '''
+
+    def __init__(self, matORfname, reac_id=None, irreversible=None, unbounded=None):
+        if type(matORfname) is str:
+            try:
+                l = numpy.load(matORfname, allow_pickle=False)
+                groups = [(l['compact_cols_'+str(k)], l['compact_values_'+str(k)]) for k in range(int(l['compact_groups']))]
+                fv_mat = CompactFluxMatrix(groups, l['compact_scale'], len(l['reac_id']))
+                reac_id, irreversible, unbounded = l['reac_id'].tolist(), l['irreversible'], l['unbounded']
+            except Exception:
+                QMessageBox.critical(None, 'Could not open file',
+                                     "File could not be opened as it does not seem to be a valid compact EFM file.")
+                self.clear()
+                return
+            super().__init__(fv_mat, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+        else:
+            super().__init__(matORfname, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+
+    @classmethod
+    def from_modes(cls, modes: FluxVectorContainer, work_dir=None, chunk_size=None):
+        '''
+        Two passes over modes.iter_chunks: the first determines the scale factors and the column ranges,
+        the second fills the compact matrices. If work_dir (a TemporaryDirectory) is given the matrices
+        are memory mapped .npy files in it instead of being held in memory.
+        '''
+        num_modes, num_reac = len(modes), len(modes.reac_id)
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // max(num_reac, 1))
+        scale = numpy.ones(num_modes)
+        col_max = numpy.zeros(num_reac)
+        integral = True
+        for start, block in modes.iter_chunks(chunk_size):
+            block = block.toarray() if scipy.sparse.issparse(block) else numpy.asarray(block, dtype=float)
+            factors = _integer_scale_factors(block)
+            if integral and numpy.all(factors > 0):
+                scale[start:start+block.shape[0]] = 1.0/factors
+                col_max = numpy.maximum(col_max, numpy.abs(numpy.round(block * factors[:, None])).max(axis=0, initial=0))
+            else:
+                integral = False
+                row_max = numpy.abs(block).max(axis=1, initial=0)
+                scale[start:start+block.shape[0]] = numpy.where(row_max > 0, row_max, 1.0)
+        if not integral: # scale factors of the previous chunks must be determined again for float32 storage
+            for start, block in modes.iter_chunks(chunk_size):
+                block = block.toarray() if scipy.sparse.issparse(block) else numpy.asarray(block, dtype=float)
+                row_max = numpy.abs(block).max(axis=1, initial=0)
+                scale[start:start+block.shape[0]] = numpy.where(row_max > 0, row_max, 1.0)
+            col_groups = [(numpy.arange(num_reac), numpy.float32)]
+        else:
+            col_groups = []
+            lower = -1
+            for dtype in (numpy.int8, numpy.int16, numpy.int32):
+                upper = numpy.iinfo(dtype).max
+                col_groups.append((numpy.nonzero((col_max > lower) & (col_max <= upper))[0], dtype))
+                lower = upper
+        groups = []
+        for k, (cols, dtype) in enumerate(col_groups):
+            if len(cols) == 0:
+                continue
+            if work_dir is None:
+                mat = numpy.empty((num_modes, len(cols)), dtype=dtype)
+            else:
+                mat = numpy.lib.format.open_memmap(os.path.join(work_dir.name, 'compact_'+str(k)+'.npy'),
+                                                   mode='w+', dtype=dtype, shape=(num_modes, len(cols)))
+            groups.append((cols, mat))
+        for start, block in modes.iter_chunks(chunk_size):
+            block = block.toarray() if scipy.sparse.issparse(block) else numpy.asarray(block, dtype=float)
+            block = block / scale[start:start+block.shape[0], None]
+            if integral:
+                block = numpy.round(block)
+            for cols, mat in groups:
+                mat[start:start+block.shape[0], :] = block[:, cols]
+        compact = cls(CompactFluxMatrix(groups, scale, num_reac), reac_id=list(modes.reac_id),
+                      irreversible=modes.irreversible, unbounded=modes.unbounded)
+        compact._containing_temp_dir = work_dir # keeps the memory mapped files alive
+        return compact
+
+    @property
+    def is_integral(self) -> bool:
+        return all(mat.dtype.kind == 'i' for _, mat in self.fv_mat.groups)
+
+    def iter_chunks(self, chunk_size=10000):
+        for start in range(0, len(self), chunk_size):
+            yield start, self.fv_mat.get_rows(slice(start, start+chunk_size))
+
+    def __getitem__(self, idx):
+        values = self.fv_mat[idx]
+        return {self.reac_id[i]: float(values[i]) for i in numpy.nonzero(values)[0]}
+
+    def save(self, fname):
+        arrays = {}
+        for k, (cols, mat) in enumerate(self.fv_mat.groups):
+            arrays['compact_cols_'+str(k)] = cols
+            arrays['compact_values_'+str(k)] = mat
+        numpy.savez_compressed(fname, compact_groups=len(self.fv_mat.groups), compact_scale=self.fv_mat.scale,
+                               reac_id=self.reac_id, irreversible=self.irreversible, unbounded=self.unbounded, **arrays)
+
+    def clear(self):
+        super().clear()
+        self._containing_temp_dir = None
+
+
+def _cut_set_incidence(indptr: numpy.ndarray, indices: numpy.ndarray, num_reac: int) -> scipy.sparse.csr_matrix:
+    # 0/1 matrix with one row per cut set
+    return scipy.sparse.csr_matrix((numpy.ones(len(indices), dtype=numpy.int32), indices.astype(numpy.int32), indptr),
+                                   shape=(len(indptr) - 1, num_reac))
+
+
+def _cut_set_words(indptr: numpy.ndarray, indices: numpy.ndarray, num_reac: int) -> numpy.ndarray:
+    # the cut sets as bitsets in the layout of SupportIndex
+    rows = numpy.repeat(numpy.arange(len(indptr) - 1), numpy.diff(indptr))
+    indices = indices.astype(numpy.int64)
+    words = numpy.zeros((len(indptr) - 1, (num_reac + 63) // 64), dtype='<u8')
+    numpy.bitwise_or.at(words, (rows, indices // 64), numpy.left_shift(numpy.uint64(1), (indices % 64).astype('<u8')))
+    return words
+
+
+def superset_rows(indptr: numpy.ndarray, indices: numpy.ndarray, num_reac: int, words: numpy.ndarray = None,
+                  chunk_size=10000) -> numpy.ndarray:
+    '''
+    Marks the cut sets which are a proper superset of another one or a repetition of an earlier one.
+    The cut sets are processed by increasing size and only compared with the smaller cut sets
+    that have been kept. A cut set j can only be contained in cut set i if i contains the two rarest
+    reactions of j, so the candidate pairs are obtained as a sparse product of the cut sets with
+    the rarest reactions of the kept ones and then checked on the bitsets (words) of the cut sets.
+    '''
+    num_sets = len(indptr) - 1
+    sizes = numpy.diff(indptr)
+    if words is None:
+        words = _cut_set_words(indptr, indices, num_reac)
+    redundant = numpy.ones(num_sets, dtype=bool)
+    if num_sets == 0:
+        return redundant
+    _, first = numpy.unique(numpy.ascontiguousarray(words).view(numpy.dtype((numpy.void, words.shape[1] * 8))).ravel(),
+                            return_index=True)
+    redundant[first] = False
+    # the two rarest reactions of each cut set (-1 if it has fewer reactions)
+    rarest = numpy.full((num_sets, 2), -1, dtype=numpy.int64)
+    nonempty = numpy.nonzero(sizes > 0)[0]
+    if len(nonempty) > 0:
+        frequency = numpy.bincount(indices, minlength=num_reac).astype(numpy.int64)
+        keys = frequency[indices] * num_reac + indices
+        no_key = (frequency.max() + 1) * num_reac
+        for k in range(2):
+            min_keys = numpy.minimum.reduceat(keys, indptr[nonempty])
+            rarest[nonempty, k] = numpy.where(min_keys < no_key, min_keys % num_reac, -1)
+            keys = numpy.where(keys == numpy.repeat(min_keys, sizes[nonempty]), no_key, keys)
+    num_pivots = (rarest >= 0).sum(axis=1)
+    incidence = _cut_set_incidence(indptr, indices, num_reac)
+    kept = numpy.zeros(0, dtype=numpy.int64)
+    for size in numpy.unique(sizes[first]):
+        level = numpy.sort(first[sizes[first] == size])
+        kept_nonempty = kept[sizes[kept] > 0]
+        if len(kept_nonempty) > 0:
+            pivots = rarest[kept_nonempty, :]
+            has_pivot = pivots >= 0
+            rarest_of = scipy.sparse.csr_matrix((numpy.ones(numpy.count_nonzero(has_pivot), dtype=numpy.int32),
+                                                 (pivots[has_pivot], numpy.nonzero(has_pivot)[0])),
+                                                shape=(num_reac, len(kept_nonempty)))
+            for start in range(0, len(level), chunk_size):
+                rows = level[start:start+chunk_size]
+                pairs = (incidence[rows, :] @ rarest_of).tocoo()
+                both = pairs.data == num_pivots[kept_nonempty[pairs.col]] # i contains the pivots of j
+                i, j = rows[pairs.row[both]], kept_nonempty[pairs.col[both]]
+                contained = numpy.all((words[i, :] & words[j, :]) == words[j, :], axis=1)
+                redundant[i[contained]] = True
+        elif len(kept) > 0: # the empty set is contained in every cut set
+            redundant[level] = True
+        kept = numpy.concatenate((kept, level[~redundant[level]]))
+    return redundant
+
+
+class CutSetMatrix:
+    '''
+    The reactions of each cut set as sorted indices in CSR layout (without a data array); rows are
+    only converted to flux vectors with -1.0 for the cut reactions when they are accessed
+    '''
+
+    def __init__(self, indptr: numpy.ndarray, indices: numpy.ndarray, num_reac: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.shape = (len(indptr) - 1, num_reac)
+        self.dtype = numpy.dtype(float)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def get_rows(self, rows) -> scipy.sparse.csr_matrix:
+        if isinstance(rows, slice) and rows.step in (None, 1): # contiguous rows without building the whole matrix
+            start, stop, _ = rows.indices(self.shape[0])
+            indptr = self.indptr[start:max(start, stop)+1]
+            mat = _cut_set_incidence(indptr - indptr[0], self.indices[indptr[0]:indptr[-1]], self.shape[1])
+        else:
+            mat = _cut_set_incidence(self.indptr, self.indices, self.shape[1])[rows, :]
+        return scipy.sparse.csr_matrix((numpy.full(mat.nnz, -1.0), mat.indices, mat.indptr), shape=mat.shape)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+        else:
+            rows, cols = key, slice(None)
+        if isinstance(rows, (int, numpy.integer)):
+            return self.get_rows(slice(rows, rows+1)).toarray()[0, cols]
+        return self.get_rows(rows)[:, cols]
+
+
+class FluxVectorCutSets(FluxVectorContainer):
+    '''
+    A container for minimal cut sets which only stores the indices of the cut reactions (as uint16 when
+    there are fewer than 65536 reactions); the support index is built directly from these indices
+    and set operations on the cut sets work on their incidence matrix
+    '''
+
+    def __init__(self, matORfname, reac_id=None, irreversible=None, unbounded=None):
+        if type(matORfname) is str:
+            try:
+                l = numpy.load(matORfname, allow_pickle=False)
+                reac_id = l['reac_id'].tolist()
+                fv_mat = CutSetMatrix(l['cut_set_indptr'], l['cut_set_indices'], len(reac_id))
+                irreversible = l['irreversible'] if 'irreversible' in l.files else None
+                unbounded = l['unbounded'] if 'unbounded' in l.files else None
+            except Exception:
+                QMessageBox.critical(None, 'Could not open file',
+                                     "File could not be opened as it does not seem to be a valid cut set file.")
+                self.clear()
+                return
+            super().__init__(fv_mat, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+        else:
+            super().__init__(matORfname, reac_id=reac_id, irreversible=irreversible, unbounded=unbounded)
+
+    @classmethod
+    def from_cut_sets(cls, mcs, reac_id):
+        # mcs is an iterable of reaction index collections
+        mcs = [sorted(m) for m in mcs]
+        indptr = numpy.zeros(len(mcs) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(m) for m in mcs], out=indptr[1:])
+        index_type = numpy.uint16 if len(reac_id) <= 2**16 else numpy.int32
+        indices = numpy.fromiter(itertools.chain.from_iterable(mcs), dtype=index_type, count=indptr[-1])
+        return cls(CutSetMatrix(indptr, indices, len(reac_id)), reac_id=list(reac_id))
+
+    @classmethod
+    def merge(cls, cut_set_containers, minimal=True):
+        # combines the results of several computations with the same reactions
+        reac_id = cut_set_containers[0].reac_id
+        if any(c.reac_id != reac_id for c in cut_set_containers):
+            raise ValueError("The cut sets refer to different reactions.")
+        merged = cls.from_cut_sets(itertools.chain.from_iterable(c.cut_sets() for c in cut_set_containers), reac_id)
+        return merged.minimal() if minimal else merged
+
+    def cut_set(self, idx) -> numpy.ndarray:
+        return self.fv_mat.indices[self.fv_mat.indptr[idx]:self.fv_mat.indptr[idx+1]]
+
+    def cut_sets(self):
+        return (tuple(int(r) for r in self.cut_set(i)) for i in range(len(self)))
+
+    def support(self, idx):
+        return self.cut_set(idx)
+
+    def support_sizes(self):
+        return numpy.diff(self.fv_mat.indptr)
+
+    @property
+    def support_index(self) -> SupportIndex:
+        if getattr(self, '_support_index', None) is None or len(self._support_index) != len(self):
+            self._support_index = SupportIndex(_cut_set_words(self.fv_mat.indptr, self.fv_mat.indices, len(self.reac_id)),
+                                               len(self.reac_id))
+        return self._support_index
+
+    def cardinality_histogram(self, selection=None) -> numpy.ndarray:
+        # number of cut sets of each size (index = size)
+        sizes = self.support_sizes()
+        return numpy.bincount(sizes if selection is None else sizes[selection])
+
+    def containing(self, reac_ids) -> numpy.ndarray:
+        # boolean array of the cut sets that contain all of the given reactions
+        return self.support_index.select(must_occur=[self.reac_id.index(r) for r in reac_ids])
+
+    def minimal(self):
+        # a new container without the cut sets that are supersets (or repetitions) of others, sorted by size
+        keep = numpy.nonzero(~superset_rows(self.fv_mat.indptr, self.fv_mat.indices, len(self.reac_id),
+                                            words=self.support_index.words))[0]
+        keep = keep[numpy.argsort(self.support_sizes()[keep], kind='stable')]
+        return FluxVectorCutSets.from_cut_sets((self.cut_set(i) for i in keep), self.reac_id)
+
+    def iter_chunks(self, chunk_size=10000):
+        for start in range(0, len(self), chunk_size):
+            yield start, self.fv_mat.get_rows(slice(start, start+chunk_size))
+
+    def is_integer_vector_rounded(self, idx, decimals=0):
+        return True
+
+    def __getitem__(self, idx):
+        return {self.reac_id[i]: -1.0 for i in self.cut_set(idx)}
+
+    def save(self, fname):
+        numpy.savez_compressed(fname, cut_set_indptr=self.fv_mat.indptr, cut_set_indices=self.fv_mat.indices,
+                               reac_id=self.reac_id, irreversible=self.irreversible, unbounded=self.unbounded)
+
+    def clear(self):
+        super().clear()
+        self.fv_mat = CutSetMatrix(numpy.zeros(1, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.uint16), 0)
+
+
+CHUNKED_FILE_MAGIC = b'CNAPYFVC'
+CHUNKED_FILE_VERSION = 1
+
+
+def _npz_bytes(**arrays) -> bytes:
+    buffer = io.BytesIO()
+    numpy.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+class ChunkedModeSetWriter:
+    '''
+    Writes flux vectors into the chunked mode set format (.fvc): a sequence of independently compressed
+    CSR chunks followed by a JSON header with reac_id, the chunk offsets and the location of the
+    irreversible/unbounded flags. Because the header is written last, vectors can be appended incrementally.
+    '''
+
+    def __init__(self, fname, reac_id, chunk_size=10000):
+        self.fname = fname
+        self.reac_id = list(reac_id)
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self._chunks = [] # (offset, length, number of rows)
+        self._pending = []
+        self._num_pending = 0
+        self._fh = open(fname, 'wb')
+        self._fh.write(CHUNKED_FILE_MAGIC)
+        self._fh.write(numpy.array(CHUNKED_FILE_VERSION, dtype='<u4').tobytes())
+
+    def append(self, rows):
+        # rows can be a dense array or a scipy.sparse matrix
+        rows = scipy.sparse.csr_matrix(rows)
+        if rows.shape[1] != len(self.reac_id):
+            raise ValueError('rows must have '+str(len(self.reac_id))+' columns')
+        self._pending.append(rows)
+        self._num_pending += rows.shape[0]
+        while self._num_pending >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def _flush(self, num_rows):
+        block = scipy.sparse.vstack(self._pending, format='csr')
+        chunk, rest = block[:num_rows, :], block[num_rows:, :]
+        chunk.eliminate_zeros()
+        data = _npz_bytes(data=chunk.data, indices=chunk.indices, indptr=chunk.indptr)
+        self._chunks.append((self._fh.tell(), len(data), chunk.shape[0]))
+        self._fh.write(data)
+        self.num_rows += chunk.shape[0]
+        self._pending = [rest] if rest.shape[0] > 0 else []
+        self._num_pending = rest.shape[0]
+
+    def close(self, irreversible=None, unbounded=None):
+        if self._fh.closed:
+            return
+        if self._num_pending > 0:
+            self._flush(self._num_pending)
+        flags = _npz_bytes(irreversible=numpy.array(0) if irreversible is None else numpy.asarray(irreversible),
+                           unbounded=numpy.array(0) if unbounded is None else numpy.asarray(unbounded))
+        flags_offset = self._fh.tell()
+        self._fh.write(flags)
+        header = json.dumps({'reac_id': self.reac_id, 'num_rows': self.num_rows, 'chunk_size': self.chunk_size,
+                             'chunks': self._chunks, 'flags': (flags_offset, len(flags))}).encode('utf-8')
+        header_offset = self._fh.tell()
+        self._fh.write(header)
+        self._fh.write(numpy.array([header_offset, len(header)], dtype='<u8').tobytes())
+        self._fh.write(CHUNKED_FILE_MAGIC)
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ChunkedFluxMatrix:
+    '''
+    Read-only matrix view on a .fvc file; chunks are only decompressed when rows from them are accessed
+    and the most recently used chunks are kept in memory
+    '''
+
+    def __init__(self, fname, header, max_cached_chunks=8):
+        self.fname = fname
+        self.shape = (header['num_rows'], len(header['reac_id']))
+        self.dtype = numpy.dtype(float)
+        self._chunks = header['chunks']
+        self._chunk_start = numpy.zeros(len(self._chunks) + 1, dtype=numpy.int64)
+        numpy.cumsum([c[2] for c in self._chunks], out=self._chunk_start[1:])
+        self._cache = OrderedDict()
+        self.max_cached_chunks = max_cached_chunks
+
+    @property
+    def num_chunks(self):
+        return len(self._chunks)
+
+    def chunk_range(self, chunk_idx):
+        return self._chunk_start[chunk_idx], self._chunk_start[chunk_idx + 1]
+
+    def get_chunk(self, chunk_idx) -> scipy.sparse.csr_matrix:
+        chunk = self._cache.get(chunk_idx, None)
+        if chunk is None:
+            offset, length, num_rows = self._chunks[chunk_idx]
+            with open(self.fname, 'rb') as fh:
+                fh.seek(offset)
+                l = numpy.load(io.BytesIO(fh.read(length)))
+                chunk = scipy.sparse.csr_matrix((l['data'], l['indices'], l['indptr']), shape=(num_rows, self.shape[1]))
+            self._cache[chunk_idx] = chunk
+            if len(self._cache) > self.max_cached_chunks:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(chunk_idx)
+        return chunk
+
+    def _locate(self, row):
+        if row < 0:
+            row += self.shape[0]
+        if row < 0 or row >= self.shape[0]:
+            raise IndexError('row index '+str(row)+' is out of range')
+        chunk_idx = numpy.searchsorted(self._chunk_start, row, side='right') - 1
+        return chunk_idx, row - self._chunk_start[chunk_idx]
+
+    def get_row(self, row) -> scipy.sparse.csr_matrix:
+        chunk_idx, local_row = self._locate(row)
+        return self.get_chunk(chunk_idx)[local_row, :]
+
+    def get_rows(self, rows) -> scipy.sparse.csr_matrix:
+        rows = numpy.asarray(rows)
+        if rows.dtype == bool:
+            rows = numpy.nonzero(rows)[0]
+        if len(rows) == 0:
+            return scipy.sparse.csr_matrix((0, self.shape[1]))
+        chunk_idx = numpy.searchsorted(self._chunk_start, rows, side='right') - 1
+        order = numpy.argsort(chunk_idx, kind='stable')
+        blocks = []
+        for c in numpy.unique(chunk_idx):
+            sel = order[chunk_idx[order] == c]
+            blocks.append((sel, self.get_chunk(c)[rows[sel] - self._chunk_start[c], :]))
+        result = scipy.sparse.vstack([b for _, b in blocks], format='csr')
+        # restore the requested row order
+        return result[numpy.argsort(numpy.concatenate([sel for sel, _ in blocks]), kind='stable'), :]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+        else:
+            rows, cols = key, slice(None)
+        if isinstance(rows, (int, numpy.integer)):
+            row = self.get_row(int(rows))
+            if isinstance(cols, (int, numpy.integer)):
+                return row[0, cols]
+            return row[:, cols].toarray().ravel()
+        if isinstance(rows, slice):
+            rows = numpy.arange(*rows.indices(self.shape[0]))
+        return self.get_rows(rows)[:, cols]
+
+    def iter_chunks(self):
+        for c in range(self.num_chunks):
+            yield self._chunk_start[c], self.get_chunk(c)
+
+
+class FluxVectorChunked(FluxVectorContainer):
+    '''
+    Opens a chunked mode set file (.fvc); only the header is read on construction,
+    the flux vectors are decompressed chunk-wise on demand
+    '''
+
+    def __init__(self, fname):
+        try:
+            with open(fname, 'rb') as fh:
+                if fh.read(len(CHUNKED_FILE_MAGIC)) != CHUNKED_FILE_MAGIC:
+                    raise ValueError('not a chunked mode set file')
+                fh.seek(-(16 + len(CHUNKED_FILE_MAGIC)), os.SEEK_END)
+                header_offset, header_length = numpy.frombuffer(fh.read(16), dtype='<u8')
+                if fh.read(len(CHUNKED_FILE_MAGIC)) != CHUNKED_FILE_MAGIC:
+                    raise ValueError('incomplete chunked mode set file')
+                fh.seek(int(header_offset))
+                header = json.loads(fh.read(int(header_length)).decode('utf-8'))
+                flags_offset, flags_length = header['flags']
+                fh.seek(flags_offset)
+                flags = numpy.load(io.BytesIO(fh.read(flags_length)))
+                irreversible, unbounded = flags['irreversible'], flags['unbounded']
+        except Exception:
+            QMessageBox.critical(
+                None,
+                'Could not open file',
+                "File could not be opened as it does not seem to be a valid mode set file. "
+                "Maybe the file got the .fvc ending for other reasons than being a mode set file or the file is corrupted."
+            )
+            self.clear()
+            return
+        self.fname = fname
+        super().__init__(ChunkedFluxMatrix(fname, header), reac_id=header['reac_id'],
+                         irreversible=irreversible, unbounded=unbounded)
+
+    def iter_chunks(self, chunk_size=None):
+        # chunk_size is determined by the file
+        return self.fv_mat.iter_chunks()
+
+    def is_integer_vector_rounded(self, idx, decimals=0):
+        values = self.fv_mat.get_row(idx).data
+        return bool(numpy.all(numpy.mod(numpy.round(values, decimals), 1) == 0))
+
+    def __getitem__(self, idx):
+        row = self.fv_mat.get_row(idx)
+        return {self.reac_id[i]: float(v) for i, v in zip(row.indices, row.data)}
+
+    def save(self, fname):
+        if os.path.abspath(fname) != os.path.abspath(self.fname):
+            save_chunked(self, fname)
+
+
+def save_chunked(modes: FluxVectorContainer, fname, chunk_size=10000):
+    with ChunkedModeSetWriter(fname, modes.reac_id, chunk_size=chunk_size) as writer:
+        for _, block in modes.iter_chunks(chunk_size):
+            writer.append(block)
+        writer.close(irreversible=modes.irreversible, unbounded=modes.unbounded)
+
+
+def load_flux_vector_container(fname) -> FluxVectorContainer:
+    '''opens .fvc files lazily, other (.npz) files are loaded into a FluxVectorSparse, FluxVectorCompact or FluxVectorCutSets'''
+    if fname.endswith('.fvc'):
+        return FluxVectorChunked(fname)
+    try:
+        with numpy.load(fname) as l:
+            compact = 'compact_scale' in l.files
+            cut_sets = 'cut_set_indptr' in l.files
+    except Exception:
+        compact = cut_sets = False # FluxVectorSparse reports the error
+    if compact:
+        return FluxVectorCompact(fname)
+    elif cut_sets:
+        return FluxVectorCutSets(fname)
+    else:
+        return FluxVectorSparse(fname)
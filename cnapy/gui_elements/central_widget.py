@@ -1,5 +1,7 @@
 """The central widget"""
 
+import json
+from typing import List
 import numpy
 from enum import IntEnum
 import cobra
@@ -113,6 +115,7 @@ class CentralWidget(QWidget):
         self.splitter2 = QSplitter()
         self.splitter2.addWidget(self.map_tabs)
         self.mode_navigator = ModeNavigator(self.appdata, self)
+        self.mode_display = None # (display key, comp_values, low and high) of the mode shown by update_mode
         self.splitter2.addWidget(self.mode_navigator)
         self.splitter2.addWidget(self.console)
         self.splitter2.setOrientation(Qt.Vertical)
@@ -377,10 +380,16 @@ class CentralWidget(QWidget):
         QApplication.restoreOverrideCursor()
 
     def update_mode(self):
+        # the mode currently shown can be replaced by updating only the reactions that differ when nothing
+        # else has been displayed in between, see update_mode_delta
+        delta_possible = self.mode_display is not None and self.mode_display[0] == self.__mode_display_key() \
+            and self.mode_display[1] == self.appdata.project.comp_values
+        bnd_dict = None
         if self.mode_navigator.mode_type <= 1:
             if len(self.appdata.project.modes) > self.mode_navigator.current:
                 values = self.appdata.project.modes[self.mode_navigator.current]
-                if self.mode_navigator.mode_type == 0 and not self.appdata.project.modes.is_integer_vector_rounded(
+                if self.mode_navigator.mode_type == 0 and self.mode_navigator.normalize_modes and \
+                    not self.appdata.project.modes.is_integer_vector_rounded(
                     self.mode_navigator.current, self.appdata.rounding):
                     # normalize non-integer EFM for better display
                     mean = sum(abs(v) for v in values.values())/len(values)
@@ -397,10 +406,6 @@ class CentralWidget(QWidget):
                     self.appdata.project.comp_values[i] = (values[i], values[i])
                 self.appdata.project.comp_values_type = 0
 
-            self.appdata.modes_coloring = True
-            self.update()
-            self.appdata.modes_coloring = False
-
         elif self.mode_navigator.mode_type == 2:
             if len(self.appdata.project.modes) > self.mode_navigator.current:
                 # clear previous coloring
@@ -415,80 +420,139 @@ class CentralWidget(QWidget):
                     else:
                         mod_bnds = self.appdata.project.cobra_py_model.reactions.get_by_id(k).bounds
                         self.appdata.project.comp_values[k] = (numpy.max((v[0],mod_bnds[0])),numpy.min((v[1],mod_bnds[1])))
-                self.appdata.modes_coloring = True
-                self.update()
-                self.appdata.modes_coloring = False
-                idx = self.appdata.window.centralWidget().tabs.currentIndex()
-                if idx == ModelTabIndex.Reactions and self.appdata.project.comp_values_type == 0:
-                    view = self.appdata.window.centralWidget().reaction_list
-                    view.reaction_list.blockSignals(True) # block itemChanged while recoloring
-                    root = view.reaction_list.invisibleRootItem()
-                    child_count = root.childCount()
-                    for i in range(child_count):
-                        item = root.child(i)
-                        if item.text(0) in bnd_dict:
-                            v = bnd_dict[item.text(0)]
-                            if numpy.any(numpy.isnan(v)):
-                                item.setBackground(ReactionListColumn.Flux, self.appdata.special_color_1)
-                            elif (v[0]<0 and v[1]>=0) or (v[0]<=0 and v[1]>0):
-                                item.setBackground(ReactionListColumn.Flux, self.appdata.special_color_2)
-                            elif v[0] == 0.0 and v[1] == 0.0:
-                                item.setBackground(ReactionListColumn.Flux, QColor.fromRgb(255, 0, 0))
-                            elif (v[0]<0 and v[1]<0) or (v[0]>0 and v[1]>0):
-                                item.setBackground(ReactionListColumn.Flux, self.appdata.special_color_1)
-                        else:
-                            item.setBackground(ReactionListColumn.Flux, QColor.fromRgb(255, 255, 255))
-                    view.reaction_list.blockSignals(False)
-                idx = self.appdata.window.centralWidget().map_tabs.currentIndex()
-                if idx < 0:
-                    return
-                name = self.appdata.window.centralWidget().map_tabs.tabText(idx)
-                view = self.appdata.window.centralWidget().map_tabs.widget(idx)
-                for key in self.appdata.project.maps[name]["boxes"]:
-                    if key in bnd_dict:
-                        v = bnd_dict[key]
-                        if numpy.any(numpy.isnan(v)):
-                            view.reaction_boxes[key].set_color(self.appdata.special_color_1)
-                        elif (v[0]<0 and v[1]>=0) or (v[0]<=0 and v[1]>0):
-                            view.reaction_boxes[key].set_color(self.appdata.special_color_2)
-                        elif v[0] == 0.0 and v[1] == 0.0:
-                            view.reaction_boxes[key].set_color(QColor.fromRgb(255, 0, 0))
-                        elif (v[0]<0 and v[1]<0) or (v[0]>0 and v[1]>0):
-                            view.reaction_boxes[key].set_color(self.appdata.special_color_1)
-                    else:
-                        view.reaction_boxes[key].set_color(QColor.fromRgb(255, 255, 255))
-                if self.appdata.window.sd_sols and self.appdata.window.sd_sols.__weakref__: # if dialog exists
-                    self.mode_navigator.current
-                    for i in range(self.appdata.window.sd_sols.sd_table.rowCount()):
-                        if self.mode_navigator.current == int(self.appdata.window.sd_sols.sd_table.item(i,0).text())-1:
-                            self.appdata.window.sd_sols.sd_table.item(i,0).setBackground(QBrush(QColor(230,230,230)))
-                            self.appdata.window.sd_sols.sd_table.item(i,1).setBackground(QBrush(QColor(230,230,230)))
-                            if self.appdata.window.sd_sols.sd_table.columnCount() == 3:
-                                self.appdata.window.sd_sols.sd_table.item(i,2).setBackground(QBrush(QColor(230,230,230)))
-                        else:
-                            self.appdata.window.sd_sols.sd_table.item(i,0).setBackground(QBrush(QColor(255, 255, 255)))
-                            self.appdata.window.sd_sols.sd_table.item(i,1).setBackground(QBrush(QColor(255, 255, 255)))
-                            if self.appdata.window.sd_sols.sd_table.columnCount() == 3:
-                                self.appdata.window.sd_sols.sd_table.item(i,2).setBackground(QBrush(QColor(255, 255, 255)))
+            else:
+                self.mode_navigator.current_flux_values = self.appdata.project.comp_values.copy()
+                return
+
+        if delta_possible and (self.mode_display[2] == self.appdata.low_and_high() or
+                               not (self.parent.heaton_action.isChecked() or self.parent.onoff_action.isChecked())):
+            previous = self.mode_display[1]
+            current = self.appdata.project.comp_values
+            self.update_mode_delta([r for r in previous.keys() | current.keys() if previous.get(r) != current.get(r)],
+                                   bnd_dict)
+        else:
+            self.appdata.modes_coloring = True
+            self.update()
+            self.appdata.modes_coloring = False
+            if bnd_dict is not None:
+                self.__set_strain_design_colors(bnd_dict)
+        if bnd_dict is not None and self.appdata.window.sd_sols and self.appdata.window.sd_sols.__weakref__: # if dialog exists
+            for i in range(self.appdata.window.sd_sols.sd_table.rowCount()):
+                if self.mode_navigator.current == int(self.appdata.window.sd_sols.sd_table.item(i,0).text())-1:
+                    self.appdata.window.sd_sols.sd_table.item(i,0).setBackground(QBrush(QColor(230,230,230)))
+                    self.appdata.window.sd_sols.sd_table.item(i,1).setBackground(QBrush(QColor(230,230,230)))
+                    if self.appdata.window.sd_sols.sd_table.columnCount() == 3:
+                        self.appdata.window.sd_sols.sd_table.item(i,2).setBackground(QBrush(QColor(230,230,230)))
+                else:
+                    self.appdata.window.sd_sols.sd_table.item(i,0).setBackground(QBrush(QColor(255, 255, 255)))
+                    self.appdata.window.sd_sols.sd_table.item(i,1).setBackground(QBrush(QColor(255, 255, 255)))
+                    if self.appdata.window.sd_sols.sd_table.columnCount() == 3:
+                        self.appdata.window.sd_sols.sd_table.item(i,2).setBackground(QBrush(QColor(255, 255, 255)))
         self.mode_navigator.current_flux_values = self.appdata.project.comp_values.copy()
+        self.mode_display = (self.__mode_display_key(), self.mode_navigator.current_flux_values, self.appdata.low_and_high())
+
+    def update_reactions(self, reac_ids):
+        ''' updates the reaction list and the current map only for the given reactions whose values have changed '''
+        if self.tabs.currentIndex() == ModelTabIndex.Reactions:
+            self.reaction_list.update_reactions(reac_ids)
+        idx = self.map_tabs.currentIndex()
+        if idx >= 0:
+            m = self.map_tabs.widget(idx)
+            if isinstance(m, MapView):
+                m.update_reactions(reac_ids)
+                self.__recolor_map(reac_ids)
+            else: # Escher only accepts the complete reaction data
+                m.visualize_comp_values()
+
+    def update_mode_delta(self, reac_ids, bnd_dict=None):
+        self.appdata.modes_coloring = True
+        self.update_reactions(reac_ids)
+        self.appdata.modes_coloring = False
+        if bnd_dict is not None:
+            self.__set_strain_design_colors(bnd_dict, reac_ids)
+
+    def visible_reactions(self) -> List[str]:
+        ''' the reactions on the current map followed by those selected in the reaction list '''
+        reac_ids = []
+        idx = self.map_tabs.currentIndex()
+        if idx >= 0:
+            name = self.map_tabs.tabText(idx)
+            if isinstance(self.map_tabs.widget(idx), MapView):
+                reac_ids += list(self.appdata.project.maps[name]["boxes"].keys())
+            else:
+                try:
+                    escher_map = json.loads(self.appdata.project.maps[name].get('escher_map_data', ""))
+                    reac_ids += [r['bigg_id'] for r in escher_map[1]['reactions'].values()]
+                except (ValueError, LookupError, TypeError):
+                    pass
+        reac_ids += [item.reaction.id for item in self.reaction_list.reaction_list.selectedItems()]
+        return list(dict.fromkeys(reac_ids))
+
+    def __mode_display_key(self):
+        # what else determines how a mode is displayed; any other call of update invalidates mode_display
+        return (self.mode_navigator.mode_type, id(self.appdata.project.modes), self.tabs.currentIndex(),
+                self.map_tabs.currentIndex(), self.parent.heaton_action.isChecked(),
+                self.parent.onoff_action.isChecked(), self.appdata.project.comp_values_type)
+
+    def __strain_design_color(self, v):
+        if numpy.any(numpy.isnan(v)):
+            return self.appdata.special_color_1
+        elif (v[0]<0 and v[1]>=0) or (v[0]<=0 and v[1]>0):
+            return self.appdata.special_color_2
+        elif v[0] == 0.0 and v[1] == 0.0:
+            return QColor.fromRgb(255, 0, 0)
+        elif (v[0]<0 and v[1]<0) or (v[0]>0 and v[1]>0):
+            return self.appdata.special_color_1
+        return None
+
+    def __set_strain_design_colors(self, bnd_dict, reac_ids=None):
+        # colors the interventions of a strain design in the reaction list and on the current map,
+        # either for all reactions or only for those in reac_ids
+        idx = self.tabs.currentIndex()
+        if idx == ModelTabIndex.Reactions and self.appdata.project.comp_values_type == 0:
+            view = self.reaction_list
+            view.reaction_list.blockSignals(True) # block itemChanged while recoloring
+            if reac_ids is None:
+                root = view.reaction_list.invisibleRootItem()
+                items = [root.child(i) for i in range(root.childCount())]
+            else:
+                items = [item for r in reac_ids for item in view.reaction_list.findItems(r, Qt.MatchExactly, ReactionListColumn.Id)]
+            for item in items:
+                if item.text(0) in bnd_dict:
+                    color = self.__strain_design_color(bnd_dict[item.text(0)])
+                    if color is not None:
+                        item.setBackground(ReactionListColumn.Flux, color)
+                else:
+                    item.setBackground(ReactionListColumn.Flux, QColor.fromRgb(255, 255, 255))
+            view.reaction_list.blockSignals(False)
+        idx = self.map_tabs.currentIndex()
+        if idx < 0:
+            return
+        name = self.map_tabs.tabText(idx)
+        view = self.map_tabs.widget(idx)
+        if not isinstance(view, MapView):
+            return
+        for key in self.appdata.project.maps[name]["boxes"] if reac_ids is None else reac_ids:
+            if key not in view.reaction_boxes:
+                continue
+            if key in bnd_dict:
+                color = self.__strain_design_color(bnd_dict[key])
+                if color is not None:
+                    view.reaction_boxes[key].set_color(color)
+            else:
+                view.reaction_boxes[key].set_color(QColor.fromRgb(255, 255, 255))
 
     def reaction_participation(self):
         self.appdata.project.comp_values.clear()
         self.parent.clear_status_bar()
         if self.appdata.window.centralWidget().mode_navigator.mode_type <=1:
-            relative_participation = numpy.sum(self.appdata.project.modes.fv_mat[self.mode_navigator.selection, :] != 0, axis=0)/self.mode_navigator.num_selected
-            if isinstance(relative_participation, numpy.matrix): # numpy.sum returns a matrix with one row when fv_mat is scipy.sparse
-                relative_participation = relative_participation.A1 # flatten into 1D array
+            participation = self.appdata.project.modes.support_index.participation(self.mode_navigator.selection)
+            relative_participation = participation/self.mode_navigator.num_selected
             self.appdata.project.comp_values = {r: (relative_participation[i], relative_participation[i]) for i,r in enumerate(self.appdata.project.modes.reac_id)}
         elif self.appdata.window.centralWidget().mode_navigator.mode_type == 2:
             reacs = self.appdata.project.cobra_py_model.reactions.list_attr('id')
-            abund = [0 for _ in reacs]
-            for i,r in enumerate(reacs):
-                for s in [self.appdata.project.modes[l] for l,t in enumerate(self.mode_navigator.selection) if t]:
-                    if r in s:
-                        if not numpy.any(numpy.isnan(s[r])) or numpy.all((s[r] == 0)):
-                            abund[i] += 1
-            relative_participation = [a/self.mode_navigator.num_selected for a in abund]
+            abund = self.appdata.project.modes.participation(self.mode_navigator.selection)
+            relative_participation = [abund.get(r, 0)/self.mode_navigator.num_selected for r in reacs]
             self.appdata.project.comp_values = {r: (p,p) for r,p in zip(reacs,relative_participation)}
         if isinstance(relative_participation, numpy.matrix): # numpy.sum returns a matrix with one row when fv_mat is scipy.sparse
             relative_participation = relative_participation.A1 # flatten into 1D array
@@ -498,6 +562,7 @@ class CentralWidget(QWidget):
 
     def update(self, rebuild_all_tabs=False):
         # use rebuild_all_tabs=True to rebuild all tabs when the model changes
+        self.mode_display = None
         if len(self.appdata.project.modes) == 0:
             self.mode_navigator.hide()
             self.mode_navigator.current = 0
@@ -600,13 +665,15 @@ class CentralWidget(QWidget):
                 item.setBackground(ReactionListColumn.Flux, color)
         view.reaction_list.blockSignals(False)
 
-    def __set_onoff_map(self):
+    def __set_onoff_map(self, reac_ids=None):
         idx = self.map_tabs.currentIndex()
         if idx < 0:
             return
         name = self.map_tabs.tabText(idx)
         map_view = self.map_tabs.widget(idx)
-        for key in self.appdata.project.maps[name]["boxes"]:
+        for key in self.appdata.project.maps[name]["boxes"] if reac_ids is None else reac_ids:
+            if key not in map_view.reaction_boxes:
+                continue
             if key in self.appdata.project.scen_values:
                 value = self.appdata.project.scen_values[key]
                 color = self.appdata.compute_color_onoff(value)
@@ -643,17 +710,19 @@ class CentralWidget(QWidget):
                 item.setBackground(ReactionListColumn.Flux, color)
         view.reaction_list.blockSignals(False)
 
-    def set_heaton_map(self):
+    def set_heaton_map(self, reac_ids=None):
         (low, high) = self.appdata.low_and_high()
-        self.__set_heaton_map(low, high)
+        self.__set_heaton_map(low, high, reac_ids)
 
-    def __set_heaton_map(self, low, high):
+    def __set_heaton_map(self, low, high, reac_ids=None):
         idx = self.map_tabs.currentIndex()
         if idx < 0:
             return
         name = self.map_tabs.tabText(idx)
         map_view = self.map_tabs.widget(idx)
-        for key in self.appdata.project.maps[name]["boxes"]:
+        for key in self.appdata.project.maps[name]["boxes"] if reac_ids is None else reac_ids:
+            if key not in map_view.reaction_boxes:
+                continue
             if key in self.appdata.project.scen_values:
                 value = self.appdata.project.scen_values[key]
                 color = self.appdata.compute_color_heat(value, low, high)
@@ -663,12 +732,12 @@ class CentralWidget(QWidget):
                 color = self.appdata.compute_color_heat(value, low, high)
                 map_view.reaction_boxes[key].set_color(color)
 
-    def __recolor_map(self):
+    def __recolor_map(self, reac_ids=None):
         ''' recolor the map based on the activated coloring mode '''
         if self.parent.heaton_action.isChecked():
-            self.set_heaton_map()
+            self.set_heaton_map(reac_ids)
         elif self.parent.onoff_action.isChecked():
-            self.__set_onoff_map()
+            self.__set_onoff_map(reac_ids)
 
     def jump_to_metabolite(self, metabolite: str):
         self.tabs.setCurrentIndex(ModelTabIndex.Metabolites)
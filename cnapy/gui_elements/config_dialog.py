@@ -5,8 +5,9 @@ from pathlib import Path
 from qtpy.QtGui import QDoubleValidator, QIntValidator, QPalette
 from qtpy.QtWidgets import (QColorDialog, QDialog, QFileDialog,
                             QHBoxLayout, QLabel, QLineEdit, QMessageBox, QPushButton,
-                            QVBoxLayout, QCheckBox)
+                            QVBoxLayout, QCheckBox, QSpinBox)
 from cnapy.appdata import AppData
+from cnapy.results_cache import ResultsCache
 
 
 class ConfigDialog(QDialog):
@@ -140,6 +141,29 @@ class ConfigDialog(QDialog):
         h.addWidget(self.results_cache_directory)
         self.layout.addItem(h)
 
+        h = QHBoxLayout()
+        h.addWidget(QLabel("Maximal cache size (MB):"))
+        self.results_cache_max_size = QSpinBox()
+        self.results_cache_max_size.setRange(0, 1000000)
+        self.results_cache_max_size.setSpecialValueText("unlimited")
+        self.results_cache_max_size.setValue(self.appdata.results_cache_max_size)
+        h.addWidget(self.results_cache_max_size)
+        h.addWidget(QLabel("Remove entries unused for (days):"))
+        self.results_cache_max_age = QSpinBox()
+        self.results_cache_max_age.setRange(0, 100000)
+        self.results_cache_max_age.setSpecialValueText("never")
+        self.results_cache_max_age.setValue(self.appdata.results_cache_max_age)
+        h.addWidget(self.results_cache_max_age)
+        self.layout.addItem(h)
+
+        h = QHBoxLayout()
+        self.results_cache_statistics = QLabel()
+        h.addWidget(self.results_cache_statistics)
+        self.clear_results_cache = QPushButton("Clear cache")
+        h.addWidget(self.clear_results_cache)
+        self.layout.addItem(h)
+        self.update_results_cache_statistics()
+
         l2 = QHBoxLayout()
         self.button = QPushButton("Apply Changes")
         l2.addWidget(self.button)
@@ -159,6 +183,7 @@ class ConfigDialog(QDialog):
         self.spec2_color_btn.clicked.connect(self.choose_spec2_color)
         self.default_color_btn.clicked.connect(self.choose_default_color)
         self.results_cache_directory.clicked.connect(self.choose_results_cache_directory)
+        self.clear_results_cache.clicked.connect(self.clear_cache)
         self.button.clicked.connect(self.apply)
 
         if first_start:
@@ -178,6 +203,32 @@ class ConfigDialog(QDialog):
         if not directory.exists():
             return
         self.results_cache_directory.setText(str(directory))
+        self.update_results_cache_statistics()
+
+    def results_cache(self) -> ResultsCache:
+        return ResultsCache(Path(self.results_cache_directory.text()), self.results_cache_max_size.value(),
+                            self.results_cache_max_age.value())
+
+    def update_results_cache_statistics(self):
+        if not Path(self.results_cache_directory.text()).exists():
+            self.results_cache_statistics.setText("The cache directory does not exist.")
+            return
+        stats = self.results_cache().statistics()
+        self.results_cache_statistics.setText(
+            "Cache: {} entries, {:.1f} MB, {} hits, {} misses".format(stats['entries'], stats['size']/(1024*1024),
+                                                                       stats['hits'], stats['misses']))
+
+    def clear_cache(self):
+        directory = Path(self.results_cache_directory.text())
+        if not directory.exists():
+            return
+        if QMessageBox.question(self, "Clear results cache",
+                "Delete all cached results in "+str(directory)+"?\n"
+                "Only the files of the cache index and the cached FVA results and compressed models are deleted.") \
+                != QMessageBox.Yes:
+            return
+        self.results_cache().clear()
+        self.update_results_cache_statistics()
 
     def choose_scen_color(self):
         palette = self.scen_color_btn.palette()
@@ -268,6 +319,11 @@ class ConfigDialog(QDialog):
         if not self.appdata.results_cache_dir.exists():
             self.use_results_cache.setChecked(False)
         self.appdata.use_results_cache = self.use_results_cache.isChecked()
+        self.appdata.results_cache_max_size = self.results_cache_max_size.value()
+        self.appdata.results_cache_max_age = self.results_cache_max_age.value()
+        if self.appdata.use_results_cache:
+            self.appdata.results_cache().evict() # the limits might have been lowered
+            self.update_results_cache_statistics()
 
         self.appdata.save_cnapy_config()
 
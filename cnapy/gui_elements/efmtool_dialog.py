@@ -1,10 +1,12 @@
 """The cnapy elementary flux modes calculator dialog"""
+import cobra
 from qtpy.QtCore import Qt, QThread, Signal, Slot
-from qtpy.QtWidgets import (QCheckBox, QDialog, QHBoxLayout, QMessageBox,
-                            QPushButton, QVBoxLayout, QTextEdit)
+from qtpy.QtWidgets import (QCheckBox, QDialog, QHBoxLayout, QLabel, QLineEdit, QMessageBox,
+                            QPushButton, QSpinBox, QVBoxLayout, QTextEdit)
 
 import cnapy.core
 from cnapy.appdata import AppData
+from cnapy.efmtool_worker import shared_worker
 
 
 class EFMtoolDialog(QDialog):
@@ -16,15 +18,41 @@ class EFMtoolDialog(QDialog):
 
         self.appdata = appdata
         self.central_widget = central_widget
+        shared_worker() # the JVM of the efmtool worker can already start while the dialog is open
 
         self.layout = QVBoxLayout()
 
         l1 = QHBoxLayout()
-        self.constraints = QCheckBox("consider 0 in current scenario as off")
+        self.constraints = QCheckBox("consider 0 and flux directions in current scenario")
         self.constraints.setCheckState(Qt.Checked)
         l1.addWidget(self.constraints)
+        self.compact_storage = QCheckBox("compact storage")
+        self.compact_storage.setToolTip("Store the EFMs as small integers (or float32) with a scale factor per mode\n"
+                                        "instead of float64 to save memory and disk space.")
+        l1.addWidget(self.compact_storage)
+        self.network_compression = QCheckBox("compress network")
+        self.network_compression.setToolTip("Remove blocked reactions and lump coupled reactions before calling efmtool;\n"
+                                            "the EFMs are mapped back to the original reactions afterwards.")
+        self.network_compression.setCheckState(Qt.Checked)
+        l1.addWidget(self.network_compression)
         self.layout.addItem(l1)
 
+        l2 = QHBoxLayout()
+        l2.addWidget(QLabel("Split on reactions:"))
+        self.split_reactions = QLineEdit()
+        self.split_reactions.setPlaceholderText("comma separated reaction IDs (optional)")
+        self.split_reactions.setToolTip("The computation is divided into one subproblem for each combination of the directions\n"
+                                        "of the reversible split reactions (2^k subproblems for k split reactions); the subproblems\n"
+                                        "run in parallel processes. Irreversible split reactions are ignored.")
+        l2.addWidget(self.split_reactions)
+        l2.addWidget(QLabel("Processes:"))
+        self.processes = QSpinBox()
+        self.processes.setMinimum(1)
+        self.processes.setMaximum(max(1, cobra.Configuration().processes * 4))
+        self.processes.setValue(cobra.Configuration().processes)
+        l2.addWidget(self.processes)
+        self.layout.addItem(l2)
+
         self.text_field = QTextEdit("*** EFMtool output ***")
         self.text_field.setReadOnly(True)
         self.layout.addWidget(self.text_field)
@@ -43,9 +71,18 @@ class EFMtoolDialog(QDialog):
         self.button.clicked.connect(self.compute)
 
     def compute(self):
+        split_reactions = [r.strip() for r in self.split_reactions.text().split(",") if len(r.strip()) > 0]
+        unknown = [r for r in split_reactions if not self.appdata.project.cobra_py_model.reactions.has_id(r)]
+        if len(unknown) > 0:
+            QMessageBox.warning(self, 'Unknown reactions',
+                                'The following split reactions are not in the model: '+", ".join(unknown))
+            return
         self.setCursor(Qt.BusyCursor)
         self.efm_computation = EFMComputationThread(self.appdata.project.cobra_py_model, self.appdata.project.scen_values,
-                                                    self.constraints.checkState() == Qt.Checked)
+                                                    self.constraints.checkState() == Qt.Checked,
+                                                    split_reactions, self.processes.value(),
+                                                    self.compact_storage.checkState() == Qt.Checked,
+                                                    self.network_compression.checkState() == Qt.Checked)
         self.button.setText("Abort computation")
         self.button.clicked.disconnect(self.compute)
         self.button.clicked.connect(self.efm_computation.activate_abort)
@@ -84,11 +121,16 @@ class EFMtoolDialog(QDialog):
         # self.central_widget.console._append_plain_text(text) # causes some kind of deadlock?!?
 
 class EFMComputationThread(QThread):
-    def __init__(self, model, scen_values, constraints):
+    def __init__(self, model, scen_values, constraints, split_reactions=None, processes=1, compact_storage=False,
+                 network_compression=False):
         super().__init__()
         self.model = model
         self.scen_values = scen_values
         self.constraints = constraints
+        self.split_reactions = split_reactions
+        self.processes = processes
+        self.compact_storage = compact_storage
+        self.network_compression = network_compression
         self.abort = False
         self.ems = None
         self.scenario = None
@@ -101,7 +143,10 @@ class EFMComputationThread(QThread):
 
     def run(self):
         (self.ems, self.scenario) = cnapy.core.efm_computation(self.model, self.scen_values, self.constraints,
-                                        print_progress_function=self.print_progress_function, abort_callback=self.do_abort)
+                                        print_progress_function=self.print_progress_function, abort_callback=self.do_abort,
+                                        split_reactions=self.split_reactions, processes=self.processes,
+                                        compact_storage=self.compact_storage, efmtool_worker=shared_worker(),
+                                        network_compression=self.network_compression)
         self.finished_computation.emit()
 
     def print_progress_function(self, text):
@@ -0,0 +1,189 @@
+"""The dialog for random sampling of the flux space"""
+import os
+import tempfile
+import traceback
+import numpy
+import cobra
+from qtpy.QtCore import Qt, QThread, QTimer, Signal, Slot
+from qtpy.QtWidgets import (QCheckBox, QDialog, QHBoxLayout, QLabel, QPushButton, QSpinBox,
+                            QVBoxLayout)
+
+from cnapy.appdata import AppData
+from cnapy.flux_sampling import sample_fluxes
+from cnapy.flux_vector_container import FluxVectorMemmap
+import cnapy.utils as utils
+
+_SAMPLES_FILE = "flux_samples.bin"
+
+
+class FluxSamplingDialog(QDialog):
+    """A dialog to sample flux vectors with hit-and-run chains; the samples are passed
+    to the mode navigator while the sampling is still running"""
+
+    def __init__(self, appdata: AppData, central_widget):
+        QDialog.__init__(self)
+        self.setWindowTitle("Flux sampling")
+
+        self.appdata = appdata
+        self.central_widget = central_widget
+        self.sampling = None
+        self.temp_dir = None
+        self.reac_id = None
+        self.num_written = 0
+        self.num_displayed = 0
+        self.streamed_modes = None
+
+        self.layout = QVBoxLayout()
+        l1 = QHBoxLayout()
+        l1.addWidget(QLabel("Number of samples"))
+        self.num_samples = QSpinBox()
+        self.num_samples.setRange(1, 100000000)
+        self.num_samples.setValue(10000)
+        l1.addWidget(self.num_samples)
+        l1.addWidget(QLabel("Thinning"))
+        self.thinning = QSpinBox()
+        self.thinning.setRange(1, 100000)
+        self.thinning.setValue(100)
+        self.thinning.setToolTip("Number of hit-and-run steps between two consecutive samples of a chain")
+        l1.addWidget(self.thinning)
+        self.layout.addItem(l1)
+
+        l2 = QHBoxLayout()
+        l2.addWidget(QLabel("Chains"))
+        self.chains = QSpinBox()
+        self.chains.setMinimum(1)
+        self.chains.setValue(cobra.Configuration().processes)
+        self.chains.setToolTip("Number of independent sampling chains, each runs in its own process")
+        l2.addWidget(self.chains)
+        self.consider_scenario = QCheckBox("Consider constraint given by scenario")
+        self.consider_scenario.setChecked(True)
+        l2.addWidget(self.consider_scenario)
+        self.layout.addItem(l2)
+
+        self.status = QLabel()
+        self.layout.addWidget(self.status)
+
+        l3 = QHBoxLayout()
+        self.button = QPushButton("Start")
+        l3.addWidget(self.button)
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setToolTip("Stop the sampling and keep the samples drawn so far")
+        self.stop_button.setEnabled(False)
+        l3.addWidget(self.stop_button)
+        self.cancel = QPushButton("Close")
+        l3.addWidget(self.cancel)
+        self.layout.addItem(l3)
+        self.setLayout(self.layout)
+
+        self.button.clicked.connect(self.compute)
+        self.stop_button.clicked.connect(self.stop)
+        self.cancel.clicked.connect(self.reject)
+
+        # new samples are passed on in intervals so that the navigator is not updated for each batch
+        self.display_timer = QTimer(self)
+        self.display_timer.setInterval(1000)
+        self.display_timer.timeout.connect(self.display_samples)
+
+    def compute(self):
+        self.reac_id = self.appdata.project.cobra_py_model.reactions.list_attr("id")
+        # the directory is kept alive by the FluxVectorMemmap objects that are opened on the samples file
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.num_written = 0
+        self.num_displayed = 0
+        self.streamed_modes = None
+        self.button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.sampling = FluxSamplingThread(self.appdata, os.path.join(self.temp_dir.name, _SAMPLES_FILE),
+                                           self.num_samples.value(), self.thinning.value(), self.chains.value(),
+                                           self.consider_scenario.isChecked())
+        self.sampling.output_connector.connect(self.status.setText, Qt.QueuedConnection)
+        self.sampling.samples_written.connect(self.receive_samples, Qt.QueuedConnection)
+        self.sampling.finished_sampling.connect(self.conclude_sampling, Qt.QueuedConnection)
+        self.status.setText("Generating the warmup points...")
+        self.display_timer.start()
+        self.sampling.start()
+
+    @Slot(int)
+    def receive_samples(self, num_written):
+        self.num_written = num_written
+
+    @Slot()
+    def display_samples(self):
+        if self.num_written == self.num_displayed:
+            return
+        modes = FluxVectorMemmap(_SAMPLES_FILE, self.reac_id, containing_temp_dir=self.temp_dir)
+        mode_navigator = self.central_widget.mode_navigator
+        if self.streamed_modes is not None and self.appdata.project.modes is self.streamed_modes:
+            # keep the current sample and the selection, the new samples are added as selected
+            added = len(modes) - len(self.streamed_modes)
+            mode_navigator.selection = numpy.concatenate((mode_navigator.selection, numpy.ones(added, dtype=bool)))
+            mode_navigator.num_selected += added
+            self.appdata.project.modes = modes
+            mode_navigator.update()
+        else:
+            self.appdata.project.modes = modes
+            mode_navigator.current = 0
+            mode_navigator.set_to_efm(normalize=False)
+            self.central_widget.update_mode()
+        self.streamed_modes = modes
+        self.num_displayed = len(modes)
+
+    @Slot(int, str)
+    def conclude_sampling(self, num_samples, error):
+        self.display_timer.stop()
+        self.button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        if len(error) > 0:
+            utils.show_unknown_error_box(error)
+            return
+        self.num_written = num_samples
+        self.display_samples()
+        self.status.setText(str(num_samples)+" flux vectors have been sampled.")
+
+    @Slot()
+    def stop(self):
+        if self.sampling is not None and self.sampling.isRunning():
+            self.sampling.activate_abort()
+            self.stop_button.setEnabled(False)
+            self.status.setText("Stopping the sampling after the current batch...")
+
+    def reject(self):
+        self.stop()
+        super().reject()
+
+
+class FluxSamplingThread(QThread):
+    def __init__(self, appdata: AppData, fname: str, num_samples: int, thinning: int, chains: int,
+                 consider_scenario: bool):
+        super().__init__()
+        self.appdata = appdata
+        self.fname = fname
+        self.num_samples = num_samples
+        self.thinning = thinning
+        self.chains = chains
+        self.consider_scenario = consider_scenario
+        self.abort = False
+
+    def do_abort(self):
+        return self.abort
+
+    @Slot()
+    def activate_abort(self):
+        self.abort = True
+
+    def run(self):
+        with self.appdata.project.cobra_py_model as model:
+            try:
+                if self.consider_scenario:  # integrate scenario into model bounds
+                    self.appdata.project.load_scenario_into_model(model)
+                num_samples = sample_fluxes(model, self.num_samples, self.fname, chains=self.chains,
+                                            thinning=self.thinning, samples_callback=self.samples_written.emit,
+                                            abort_callback=self.do_abort,
+                                            print_progress_function=self.output_connector.emit)
+                self.finished_sampling.emit(num_samples, "")
+            except Exception:
+                self.finished_sampling.emit(0, traceback.format_exc())
+
+    output_connector = Signal(str)
+    samples_written = Signal(int)
+    finished_sampling = Signal(int, str)
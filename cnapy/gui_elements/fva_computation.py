@@ -0,0 +1,84 @@
+"""The thread in which the flux variability analysis of the main window runs"""
+import pickle
+import traceback
+import cobra
+from qtpy.QtCore import QThread, Signal, Slot
+from optlang.symbolics import Zero
+
+from cnapy.appdata import AppData
+from cnapy.flux_variability import flux_variability_analysis, incremental_flux_variability_analysis
+
+
+class FVAComputationThread(QThread):
+    def __init__(self, appdata: AppData, fraction_of_optimum=0.0, zero_objective_with_zero_fraction_of_optimum=True,
+                 processes=1, priority_reactions=None):
+        super().__init__()
+        self.appdata = appdata
+        self.fraction_of_optimum = fraction_of_optimum
+        self.zero_objective_with_zero_fraction_of_optimum = zero_objective_with_zero_fraction_of_optimum
+        self.processes = processes
+        self.priority_reactions = priority_reactions
+        self.abort = False
+        self.fva_result = None
+
+    def do_abort(self):
+        return self.abort
+
+    @Slot()
+    def activate_abort(self):
+        self.abort = True
+
+    def run(self):
+        with self.appdata.project.cobra_py_model as model:
+            try:
+                self.appdata.project.load_scenario_into_model(model)
+                if self.zero_objective_with_zero_fraction_of_optimum:
+                    # completely remove objective for basic FVA, not the same as only setting fraction_of_optimum = 0.0
+                    model.objective = model.problem.Objective(Zero)
+                if len(self.appdata.project.scen_values) > 0 or len(self.appdata.project.scen_values.reactions) > 0:
+                    update_stoichiometry_hash = True
+                else:
+                    update_stoichiometry_hash = False
+                for r in model.reactions:
+                    if r.lower_bound == -float('inf'):
+                        r.lower_bound = cobra.Configuration().lower_bound
+                        r.set_hash_value()
+                        update_stoichiometry_hash = True
+                    if r.upper_bound == float('inf'):
+                        r.upper_bound = cobra.Configuration().upper_bound
+                        r.set_hash_value()
+                        update_stoichiometry_hash = True
+                results_cache = self.appdata.results_cache()
+                if results_cache is not None:
+                    if update_stoichiometry_hash:
+                        model.set_stoichiometry_hash_object()
+                    fva_hash = model.stoichiometry_hash_object.copy()
+                    if len(self.appdata.project.scen_values.constraints) > 0:
+                        # although the constraints are already in the model they are not covered by
+                        # the reaction hashes and therefore taken into account here
+                        fva_hash.update(pickle.dumps(sorted(self.appdata.project.scen_values.constraints)))
+                else:
+                    fva_hash = None
+                if self.zero_objective_with_zero_fraction_of_optimum and self.fraction_of_optimum == 0:
+                    # basic FVA, the ranges that are not affected by the changes since the last one are taken over
+                    self.fva_result = incremental_flux_variability_analysis(model,
+                        previous=self.appdata.project.fva_result, processes=self.processes,
+                        results_cache=results_cache, fva_hash=fva_hash,
+                        priority_reactions=self.priority_reactions, result_callback=self.ranges_available.emit,
+                        abort_callback=self.do_abort, print_progress_function=self.output_connector.emit)
+                    solution = None if self.fva_result is None else self.fva_result.ranges
+                else:
+                    solution = flux_variability_analysis(model, fraction_of_optimum=self.fraction_of_optimum,
+                        processes=self.processes, prune=True, results_cache=results_cache, fva_hash=fva_hash,
+                        priority_reactions=self.priority_reactions, result_callback=self.ranges_available.emit,
+                        abort_callback=self.do_abort, print_progress_function=self.output_connector.emit)
+                self.finished_fva.emit(solution, False, "")
+            except cobra.exceptions.Infeasible:
+                self.finished_fva.emit(None, True, "")
+            except Exception:
+                self.finished_fva.emit(None, False, traceback.format_exc())
+
+    output_connector = Signal(str)
+    # ranges of some reactions (IDs, minima, maxima) that are available before the FVA is finished
+    ranges_available = Signal(list, list, list)
+    finished_fva = Signal(object, bool, str)
@@ -4,14 +4,12 @@ import os
 import traceback
 from tempfile import TemporaryDirectory
 from zipfile import BadZipFile, ZipFile
-import pickle
 import xml.etree.ElementTree as ET
-from cnapy.flux_vector_container import FluxVectorContainer
+from cnapy.flux_vector_container import FluxVectorContainer, FluxVectorChunked, FluxVectorCutSets, FluxVectorSparse, \
+    load_flux_vector_container, save_chunked
 from cnapy.core import model_optimization_with_exceptions
 import cobra
 from optlang_enumerator.cobra_cnapy import CNApyModel
-from optlang_enumerator.mcs_computation import flux_variability_analysis
-from optlang.symbolics import Zero
 import numpy as np
 import cnapy.resources  # Do not delete this import - it seems to be unused but in fact it provides the menu icons
 import matplotlib.pyplot as plt
@@ -33,6 +31,8 @@ from cnapy.gui_elements.download_dialog import DownloadDialog
 from cnapy.gui_elements.config_cobrapy_dialog import ConfigCobrapyDialog
 from cnapy.gui_elements.efmtool_dialog import EFMtoolDialog
 from cnapy.gui_elements.flux_feasibility_dialog import FluxFeasibilityDialog
+from cnapy.gui_elements.flux_sampling_dialog import FluxSamplingDialog
+from cnapy.gui_elements.fva_computation import FVAComputationThread
 from cnapy.gui_elements.map_view import MapView
 from cnapy.gui_elements.escher_map_view import EscherMapView
 from cnapy.gui_elements.mcs_dialog import MCSDialog
@@ -346,9 +346,19 @@ class MainWindow(QMainWindow):
         pfba_action.triggered.connect(self.pfba)
         self.analysis_menu.addAction(pfba_action)
 
-        fva_action = QAction("Flux Variability Analysis (FVA)", self)
-        fva_action.triggered.connect(self.fva)
-        self.analysis_menu.addAction(fva_action)
+        self.fva_action = QAction("Flux Variability Analysis (FVA)", self)
+        self.fva_action.triggered.connect(self.fva)
+        self.analysis_menu.addAction(self.fva_action)
+        self.stop_fva_action = QAction("Stop FVA (keep ranges computed so far)", self)
+        self.stop_fva_action.triggered.connect(self.stop_fva)
+        self.stop_fva_action.setEnabled(False)
+        self.analysis_menu.addAction(self.stop_fva_action)
+        self.fva_computation = None
+        self.fva_pending_reactions = []
+        self.fva_clear_values = False
+        # the ranges that arrive during the FVA are displayed in intervals
+        self.fva_display_throttler = utils.SignalThrottler(500)
+        self.fva_display_throttler.triggered.connect(self.display_fva_ranges)
 
         make_scenario_feasible_action = QAction("Make scenario feasible...", self)
         make_scenario_feasible_action.triggered.connect(self.make_scenario_feasible)
@@ -402,6 +412,11 @@ class MainWindow(QMainWindow):
         plot_space_action.triggered.connect(self.plot_space)
         self.analysis_menu.addAction(plot_space_action)
 
+        flux_sampling_action = QAction("Flux sampling...", self)
+        flux_sampling_action.triggered.connect(self.flux_sampling)
+        self.analysis_menu.addAction(flux_sampling_action)
+        self.flux_sampling_dialog = None
+
         self.analysis_menu.addSeparator()
 
 
@@ -861,11 +876,11 @@ class MainWindow(QMainWindow):
     def load_modes(self):
         dialog = QFileDialog(self)
         filename: str = dialog.getOpenFileName(
-            directory=self.appdata.work_directory, filter="*.npz")[0]
+            directory=self.appdata.work_directory, filter="*.fvc *.npz")[0]
         if not filename or len(filename) == 0 or not os.path.exists(filename):
             return
 
-        self.appdata.project.modes = FluxVectorContainer(filename)
+        self.appdata.project.modes = self.open_modes_file(filename)
         self.centralWidget().mode_navigator.current = 0
 
         self.centralWidget().mode_navigator.set_to_efm()
@@ -875,15 +890,34 @@ class MainWindow(QMainWindow):
     def load_mcs(self):
         dialog = QFileDialog(self)
         filename: str = dialog.getOpenFileName(
-            directory=self.appdata.work_directory, filter="*.npz")[0]
+            directory=self.appdata.work_directory, filter="*.fvc *.npz")[0]
         if not filename or len(filename) == 0 or not os.path.exists(filename):
             return
 
-        self.appdata.project.modes = FluxVectorContainer(filename)
+        modes = load_flux_vector_container(filename)
+        if isinstance(modes, FluxVectorSparse) and np.all(modes.fv_mat.data == -1.0): # cut sets saved as flux vectors
+            modes = FluxVectorCutSets.from_cut_sets((modes.support(i) for i in range(len(modes))), modes.reac_id)
+        self.appdata.project.modes = modes
         self.centralWidget().mode_navigator.current = 0
         self.centralWidget().mode_navigator.set_to_mcs()
         self.centralWidget().update_mode()
 
+    def open_modes_file(self, filename: str) -> FluxVectorContainer:
+        modes = load_flux_vector_container(filename)
+        if filename.endswith('.npz') and len(modes) > 0 and not isinstance(modes, FluxVectorCutSets):
+            fvc_filename = filename[:-4] + '.fvc'
+            if QMessageBox.question(self, "Convert mode file",
+                    "Convert this file into the chunked .fvc format? Files in this format open instantly "
+                    "because modes are only decompressed when they are needed.\n"
+                    "The converted file will be saved as "+fvc_filename) == QMessageBox.Yes:
+                try:
+                    save_chunked(modes, fvc_filename)
+                except OSError as e:
+                    QMessageBox.warning(self, "Conversion failed", str(e))
+                else:
+                    modes = FluxVectorChunked(fvc_filename)
+        return modes
+
     @Slot()
     def change_background(self, caption="Select a SVG file", directory=None):
         '''Load a background image for the current map'''
@@ -1267,6 +1301,7 @@ class MainWindow(QMainWindow):
                 self.appdata.project.scen_values.clear()
                 self.appdata.project.comp_values.clear()
                 self.appdata.project.fva_values.clear()
+                self.appdata.project.fva_result = None
                 self.appdata.scenario_past.clear()
                 self.appdata.scenario_future.clear()
                 self.clear_status_bar()
@@ -1766,60 +1801,77 @@ class MainWindow(QMainWindow):
         self.centralWidget().update()
 
     def fva(self, fraction_of_optimum=0.0, zero_objective_with_zero_fraction_of_optimum=True):
+        if self.fva_computation is not None and self.fva_computation.isRunning():
+            return
         self.setCursor(Qt.BusyCursor)
-        with self.appdata.project.cobra_py_model as model:
-            self.appdata.project.load_scenario_into_model(model)
-            if zero_objective_with_zero_fraction_of_optimum:
-                # completely remove objective for basic FVA, not the same as only setting fraction_of_optimum = 0.0
-                model.objective = model.problem.Objective(Zero)
-            if len(self.appdata.project.scen_values) > 0 or len(self.appdata.project.scen_values.reactions) > 0:
-                update_stoichiometry_hash = True
-            else:
-                update_stoichiometry_hash = False
-            for r in self.appdata.project.cobra_py_model.reactions:
-                if r.lower_bound == -float('inf'):
-                    r.lower_bound = cobra.Configuration().lower_bound
-                    r.set_hash_value()
-                    update_stoichiometry_hash = True
-                if r.upper_bound == float('inf'):
-                    r.upper_bound = cobra.Configuration().upper_bound
-                    r.set_hash_value()
-                    update_stoichiometry_hash = True
-            if self.appdata.use_results_cache:
-                if update_stoichiometry_hash:
-                    model.set_stoichiometry_hash_object()
-                fva_hash = model.stoichiometry_hash_object.copy()
-                if len(self.appdata.project.scen_values.constraints) > 0:
-                    # although the constraints are already in the model they are not covered by
-                    # the reaction hashes and therefore taken into account here
-                    fva_hash.update(pickle.dumps(sorted(self.appdata.project.scen_values.constraints)))
-            else:
-                fva_hash = None
-            try:
-                solution = flux_variability_analysis(model, fraction_of_optimum=fraction_of_optimum,
-                    results_cache_dir=self.appdata.results_cache_dir if self.appdata.use_results_cache else None,
-                    fva_hash= fva_hash,
-                    print_func=lambda *txt: self.statusBar().showMessage(' '.join(list(txt))))
-            except cobra.exceptions.Infeasible:
-                QMessageBox.information(
-                    self, 'No solution', 'The scenario is infeasible')
-            except Exception:
-                output = io.StringIO()
-                traceback.print_exc(file=output)
-                exstr = output.getvalue()
-                print(exstr)
-                utils.show_unknown_error_box(exstr)
-            else:
-                minimum = solution.minimum.to_dict()
-                maximum = solution.maximum.to_dict()
-                for i in minimum:
-                    self.appdata.project.comp_values[i] = (
-                        minimum[i], maximum[i])
-                self.appdata.project.fva_values = self.appdata.project.comp_values.copy()
-                self.appdata.project.comp_values_type = 1
+        self.fva_action.setEnabled(False)
+        self.stop_fva_action.setEnabled(True)
+        self.fva_pending_reactions = []
+        self.fva_clear_values = True
+        # the reactions on the current map and those selected in the reaction list are computed first
+        self.fva_computation = FVAComputationThread(self.appdata, fraction_of_optimum,
+                                                    zero_objective_with_zero_fraction_of_optimum,
+                                                    processes=cobra.Configuration().processes,
+                                                    priority_reactions=self.centralWidget().visible_reactions())
+        self.fva_computation.output_connector.connect(self.statusBar().showMessage, Qt.QueuedConnection)
+        self.fva_computation.ranges_available.connect(self.receive_fva_ranges, Qt.QueuedConnection)
+        self.fva_computation.finished_fva.connect(self.conclude_fva, Qt.QueuedConnection)
+        self.fva_computation.start()
 
-        self.centralWidget().update()
+    @Slot()
+    def stop_fva(self):
+        if self.fva_computation is not None and self.fva_computation.isRunning():
+            self.fva_computation.activate_abort()
+            self.stop_fva_action.setEnabled(False)
+
+    @Slot(list, list, list)
+    def receive_fva_ranges(self, reac_ids, minimum, maximum):
+        if self.fva_clear_values: # the values of the previous computation are replaced when the first ranges arrive
+            self.appdata.project.comp_values.clear()
+            self.appdata.project.fva_values.clear()
+            self.appdata.project.comp_values_type = 1
+            self.fva_clear_values = False
+            self.centralWidget().update()
+        for r, lb, ub in zip(reac_ids, minimum, maximum):
+            if not (np.isnan(lb) or np.isnan(ub)):
+                self.appdata.project.comp_values[r] = (lb, ub)
+                self.appdata.project.fva_values[r] = (lb, ub)
+                self.fva_pending_reactions.append(r)
+        self.fva_display_throttler.throttle()
+
+    @Slot()
+    def display_fva_ranges(self):
+        if len(self.fva_pending_reactions) > 100: # updating everything is faster than searching each reaction
+            self.centralWidget().update()
+        elif len(self.fva_pending_reactions) > 0:
+            self.centralWidget().update_reactions(self.fva_pending_reactions)
+        self.fva_pending_reactions = []
+
+    @Slot(object, bool, str)
+    def conclude_fva(self, solution, infeasible, error):
+        self.fva_action.setEnabled(True)
+        self.stop_fva_action.setEnabled(False)
+        self.fva_display_throttler.finish()
+        self.fva_pending_reactions = []
         self.setCursor(Qt.ArrowCursor)
+        if infeasible:
+            QMessageBox.information(
+                self, 'No solution', 'The scenario is infeasible')
+        elif len(error) > 0:
+            print(error)
+            utils.show_unknown_error_box(error)
+        elif solution is not None or not self.fva_clear_values: # nothing to show if stopped before any range arrived
+            if self.fva_clear_values: # no ranges have been received
+                self.appdata.project.comp_values.clear()
+            if solution is not None: # None if the incremental FVA was stopped, its ranges have been received already
+                for i, lb, ub in zip(solution.index, solution.minimum, solution.maximum):
+                    if not (np.isnan(lb) or np.isnan(ub)): # NaN if the FVA was stopped before reaching i
+                        self.appdata.project.comp_values[i] = (lb, ub)
+            self.appdata.project.fva_values = self.appdata.project.comp_values.copy()
+            self.appdata.project.comp_values_type = 1
+            if self.fva_computation.fva_result is not None:
+                self.appdata.project.fva_result = self.fva_computation.fva_result
+        self.centralWidget().update()
 
     # def efm(self):
     #     self.efm_dialog = EFMDialog(
@@ -1841,6 +1893,11 @@ class MainWindow(QMainWindow):
             self.appdata, self.centralWidget())
         self.mcs_dialog.show()
 
+    def flux_sampling(self):
+        self.flux_sampling_dialog = FluxSamplingDialog(
+            self.appdata, self.centralWidget())
+        self.flux_sampling_dialog.show()
+
     def set_onoff(self):
         self.centralWidget().set_onoff()
 
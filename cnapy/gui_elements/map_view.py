@@ -350,6 +350,22 @@ class MapView(QGraphicsView):
             else:
                 self.reaction_boxes[r_id].item.setText("")
 
+    def update_reactions(self, reac_ids):
+        # like set_values and recolor_all but only for the boxes of the given reactions
+        boxes = self.appdata.project.maps[self.name]["boxes"]
+        for r_id in reac_ids:
+            if r_id not in boxes:
+                continue
+            if r_id in self.appdata.project.scen_values.keys():
+                self.reaction_boxes[r_id].set_value(
+                    self.appdata.project.scen_values[r_id])
+            elif r_id in self.appdata.project.comp_values.keys():
+                self.reaction_boxes[r_id].set_value(
+                    self.appdata.project.comp_values[r_id])
+            else:
+                self.reaction_boxes[r_id].item.setText("")
+            self.reaction_boxes[r_id].recolor()
+
     def remove_box(self, reaction: str):
         self.delete_box(reaction)
         del self.appdata.project.maps[self.name]["boxes"][reaction]
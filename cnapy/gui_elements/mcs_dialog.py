@@ -1,20 +1,23 @@
 """The dialog for calculating minimal cut sets"""
 
+from contextlib import redirect_stdout, redirect_stderr
 import io
 import traceback
-import scipy
+import numpy
 
-from qtpy.QtCore import Qt, Slot
+from qtpy.QtCore import Qt, Signal, Slot, QThread, QTimer
 from qtpy.QtWidgets import (QButtonGroup, QCheckBox, QComboBox, QCompleter,
                             QDialog, QGroupBox, QHBoxLayout, QHeaderView,
                             QLabel, QLineEdit, QMessageBox, QPushButton,
-                            QRadioButton, QTableWidget, QVBoxLayout)
+                            QRadioButton, QSpinBox, QTableWidget, QTextEdit, QVBoxLayout)
 import optlang_enumerator.mcs_computation as mcs_computation
 import cobra
 from cobra.util.solver import interface_to_str
 from cnapy.appdata import AppData
 import cnapy.utils as utils
-from cnapy.flux_vector_container import FluxVectorContainer
+from cnapy.flux_vector_container import FluxVectorCutSets
+from cnapy.mcs_enumeration import MCSEnumerationAborted, TRUNCATED_SUBPROBLEM, parallel_compute_mcs, \
+    streaming_compute_mcs
 
 
 class MCSDialog(QDialog):
@@ -181,6 +184,22 @@ class MCSDialog(QDialog):
         s4.addWidget(self.consider_scenario)
         self.layout.addItem(s4)
 
+        s5 = QHBoxLayout()
+        s5.addWidget(QLabel("Split on reactions:"))
+        self.split_reactions = QLineEdit()
+        self.split_reactions.setPlaceholderText("comma separated reaction IDs (optional)")
+        self.split_reactions.setToolTip("The enumeration is divided into one subproblem per split reaction in which it is cut\n"
+                                        "(and the preceding split reactions are not) plus one in which none of them is cut;\n"
+                                        "the subproblems run in parallel processes and their results are merged.")
+        s5.addWidget(self.split_reactions)
+        s5.addWidget(QLabel("Processes:"))
+        self.processes = QSpinBox()
+        self.processes.setMinimum(1)
+        self.processes.setMaximum(max(1, cobra.Configuration().processes * 4))
+        self.processes.setValue(cobra.Configuration().processes)
+        s5.addWidget(self.processes)
+        self.layout.addItem(s5)
+
         buttons = QHBoxLayout()
         self.compute_mcs = QPushButton("Compute MCS")
         buttons.addWidget(self.compute_mcs)
@@ -306,114 +325,74 @@ class MCSDialog(QDialog):
         elif self.mcs_continuous_search.isChecked():
             enum_method = 4
 
-        with self.appdata.project.cobra_py_model as model:
-            update_stoichiometry_hash = False
-            if self.consider_scenario.isChecked():  # integrate scenario into model bounds
-                self.appdata.project.load_scenario_into_model(model)
-                if len(self.appdata.project.scen_values) > 0:
-                    update_stoichiometry_hash = True
-            for r in model.reactions:  # make all reactions bounded for COBRApy FVA
-                if r.lower_bound == -float('inf'):
-                    r.lower_bound = cobra.Configuration().lower_bound
-                    r.set_hash_value()
-                    update_stoichiometry_hash = True
-                if r.upper_bound == float('inf'):
-                    r.upper_bound = cobra.Configuration().upper_bound
-                    r.set_hash_value()
-                    update_stoichiometry_hash = True
-            if self.appdata.use_results_cache and update_stoichiometry_hash:
-                model.set_stoichiometry_hash_object()
-            reac_id = model.reactions.list_attr("id")
-            reac_id_symbols = mcs_computation.get_reac_id_symbols(reac_id)
-            rows = self.target_list.rowCount()
-            targets = dict()
-            for i in range(0, rows):
-                p1 = self.target_list.cellWidget(i, 0).text()
-                p2 = self.target_list.cellWidget(i, 1).text()
-                if len(p1) > 0 and len(p2) > 0:
-                    if self.target_list.cellWidget(i, 2).currentText() == '≤':
-                        p3 = "<="
-                    else:
-                        p3 = ">="
-                    p4 = float(self.target_list.cellWidget(i, 3).text())
-                    targets.setdefault(p1, []).append((p2, p3, p4))
-            targets = list(targets.values())
-            try:
-                targets = [mcs_computation.relations2leq_matrix(mcs_computation.parse_relations(
-                    t, reac_id_symbols=reac_id_symbols), reac_id) for t in targets]
-            except ValueError:
-                QMessageBox.warning(self, "Failed to parse the target region(s)",
-                                    "Check that the equations are correct.")
-                return
-
-            rows = self.desired_list.rowCount()
-            desired = dict()
-            for i in range(0, rows):
-                p1 = self.desired_list.cellWidget(i, 0).text()
-                p2 = self.desired_list.cellWidget(i, 1).text()
-                if len(p1) > 0 and len(p2) > 0:
-                    if self.desired_list.cellWidget(i, 2).currentText() == '≤':
-                        p3 = "<="
-                    else:
-                        p3 = ">="
-                    p4 = float(self.desired_list.cellWidget(i, 3).text())
-                    desired.setdefault(p1, []).append((p2, p3, p4))
-            desired = list(desired.values())
-            try:
-                desired = [mcs_computation.relations2leq_matrix(mcs_computation.parse_relations(
-                    d, reac_id_symbols=reac_id_symbols), reac_id) for d in desired]
-            except ValueError:
-                QMessageBox.warning(self, "Failed to parse the desired region(s)",
-                                    "Check that the equations are correct.")
-                return
-
-            self.setCursor(Qt.BusyCursor)
-            try:
-                mcs, err_val = mcs_computation.compute_mcs(model,
-                                targets=targets, desired=desired, enum_method=enum_method,
-                                max_mcs_size=max_mcs_size, max_mcs_num=max_mcs_num, timeout=timeout,
-                                exclude_boundary_reactions_as_cuts=self.exclude_boundary.isChecked(),
-                                results_cache_dir=self.appdata.results_cache_dir
-                                if self.appdata.use_results_cache else None)
-            except mcs_computation.InfeasibleRegion as e:
-                QMessageBox.warning(self, 'Cannot calculate MCS', str(e))
-                return targets, desired
-            except Exception:
-                output = io.StringIO()
-                traceback.print_exc(file=output)
-                exstr = output.getvalue()
-                print(exstr)
-                utils.show_unknown_error_box(exstr)
-                return targets, desired
-            finally:
-                self.setCursor(Qt.ArrowCursor)
-
-        print(err_val)
-        if err_val == 1:
-            QMessageBox.warning(self, "Enumeration stopped abnormally",
-                                "Result is probably incomplete.\nCheck console output for more information.")
-        elif err_val == -1:
-            QMessageBox.warning(self, "Enumeration terminated permaturely",
-                                "Aborted due to excessive generation of candidates that are not cut sets.\n"
-                                "Modify the problem or try a different enumeration setup.")
-
-        if len(mcs) == 0:
-            QMessageBox.information(self, 'No cut sets',
-                                          'Cut sets have not been calculated or do not exist.')
-            return targets, desired
-
-        # omcs = [{reac_id[i]: -1.0 for i in m} for m in mcs]
-        omcs = scipy.sparse.lil_matrix((len(mcs), len(reac_id)))
-        for i,m in enumerate(mcs):
-            for j in m:
-                omcs[i, j] = -1.0
-        self.appdata.project.modes = FluxVectorContainer(omcs, reac_id=reac_id)
-        self.central_widget.mode_navigator.current = 0
-        QMessageBox.information(self, 'Cut sets found',
-                                      str(len(mcs))+' Cut sets have been calculated.')
+        reac_id = self.appdata.project.cobra_py_model.reactions.list_attr("id")
+        split_reactions = [r.strip() for r in self.split_reactions.text().split(",") if len(r.strip()) > 0]
+        unknown = [r for r in split_reactions if not self.appdata.project.cobra_py_model.reactions.has_id(r)]
+        if len(unknown) > 0:
+            QMessageBox.warning(self, 'Unknown reactions',
+                                'The following split reactions are not in the model: '+", ".join(unknown))
+            return
+        split_idx = [reac_id.index(r) for r in split_reactions]
+        reac_id_symbols = mcs_computation.get_reac_id_symbols(reac_id)
+        rows = self.target_list.rowCount()
+        targets = dict()
+        for i in range(0, rows):
+            p1 = self.target_list.cellWidget(i, 0).text()
+            p2 = self.target_list.cellWidget(i, 1).text()
+            if len(p1) > 0 and len(p2) > 0:
+                if self.target_list.cellWidget(i, 2).currentText() == '≤':
+                    p3 = "<="
+                else:
+                    p3 = ">="
+                p4 = float(self.target_list.cellWidget(i, 3).text())
+                targets.setdefault(p1, []).append((p2, p3, p4))
+        targets = list(targets.values())
+        regions = [[", ".join(" ".join((p2, p3, str(p4))) for p2, p3, p4 in t) for t in targets]]
+        try:
+            targets = [mcs_computation.relations2leq_matrix(mcs_computation.parse_relations(
+                t, reac_id_symbols=reac_id_symbols), reac_id) for t in targets]
+        except ValueError:
+            QMessageBox.warning(self, "Failed to parse the target region(s)",
+                                "Check that the equations are correct.")
+            return
 
-        self.central_widget.mode_navigator.set_to_mcs()
-        self.central_widget.update_mode()
+        rows = self.desired_list.rowCount()
+        desired = dict()
+        for i in range(0, rows):
+            p1 = self.desired_list.cellWidget(i, 0).text()
+            p2 = self.desired_list.cellWidget(i, 1).text()
+            if len(p1) > 0 and len(p2) > 0:
+                if self.desired_list.cellWidget(i, 2).currentText() == '≤':
+                    p3 = "<="
+                else:
+                    p3 = ">="
+                p4 = float(self.desired_list.cellWidget(i, 3).text())
+                desired.setdefault(p1, []).append((p2, p3, p4))
+        desired = list(desired.values())
+        regions.append([", ".join(" ".join((p2, p3, str(p4))) for p2, p3, p4 in d) for d in desired])
+        try:
+            desired = [mcs_computation.relations2leq_matrix(mcs_computation.parse_relations(
+                d, reac_id_symbols=reac_id_symbols), reac_id) for d in desired]
+        except ValueError:
+            QMessageBox.warning(self, "Failed to parse the desired region(s)",
+                                "Check that the equations are correct.")
+            return
+
+        mcs_setup = dict(targets=targets, desired=desired, enum_method=enum_method,
+                         max_mcs_size=max_mcs_size, max_mcs_num=max_mcs_num, timeout=timeout,
+                         exclude_boundary_reactions_as_cuts=self.exclude_boundary.isChecked(),
+                         results_cache_dir=self.appdata.results_cache_dir if self.appdata.use_results_cache else None)
+        # the viewer is owned by the central widget so that it outlives this dialog
+        self.computation_viewer = MCSComputationViewer(self.appdata, self.central_widget, reac_id, regions)
+        self.mcs_computation = MCSComputationThread(self.appdata, mcs_setup, self.consider_scenario.isChecked(),
+                                                    split_idx, self.processes.value())
+        self.mcs_computation.output_connector.connect(self.computation_viewer.receive_progress_text, Qt.QueuedConnection)
+        self.mcs_computation.found_cut_sets.connect(self.computation_viewer.receive_cut_sets, Qt.QueuedConnection)
+        self.mcs_computation.finished_computation.connect(self.computation_viewer.conclude_computation, Qt.QueuedConnection)
+        self.computation_viewer.stop_computation.connect(self.mcs_computation.activate_abort)
+        self.computation_viewer.mcs_computation = self.mcs_computation
+        self.computation_viewer.show()
+        self.mcs_computation.start()
         self.accept()
 
     def check_left_mcs_equation(self, equation: str) -> str:
@@ -564,3 +543,223 @@ class ReceiverLineEdit(QLineEdit):
     def focusInEvent(self, event):
         super().focusInEvent(event)
         self.mcs_dialog.active_receiver = self
+
+
+class MCSComputationThread(QThread):
+    def __init__(self, appdata: AppData, mcs_setup, consider_scenario: bool, split_idx=None, processes=1):
+        super().__init__()
+        self.appdata = appdata
+        self.mcs_setup = mcs_setup
+        self.consider_scenario = consider_scenario
+        self.split_idx = split_idx
+        self.processes = processes
+        self.abort = False
+        self.curr_threadID = self.currentThread()
+
+    def do_abort(self):
+        return self.abort
+
+    @Slot()
+    def activate_abort(self):
+        self.abort = True
+
+    def run(self):
+        with self.appdata.project.cobra_py_model as model:
+            try:
+                with redirect_stdout(self), redirect_stderr(self):
+                    self.curr_threadID = self.currentThread()
+                    update_stoichiometry_hash = False
+                    if self.consider_scenario:  # integrate scenario into model bounds
+                        self.appdata.project.load_scenario_into_model(model)
+                        if len(self.appdata.project.scen_values) > 0:
+                            update_stoichiometry_hash = True
+                    for r in model.reactions:  # make all reactions bounded for COBRApy FVA
+                        if r.lower_bound == -float('inf'):
+                            r.lower_bound = cobra.Configuration().lower_bound
+                            r.set_hash_value()
+                            update_stoichiometry_hash = True
+                        if r.upper_bound == float('inf'):
+                            r.upper_bound = cobra.Configuration().upper_bound
+                            r.set_hash_value()
+                            update_stoichiometry_hash = True
+                    if self.appdata.use_results_cache and update_stoichiometry_hash:
+                        model.set_stoichiometry_hash_object()
+                    if self.split_idx:
+                        mcs, err_val = parallel_compute_mcs(model, self.split_idx, self.processes,
+                                                            self.found_cut_sets.emit, self.do_abort, **self.mcs_setup)
+                    else:
+                        mcs, err_val = streaming_compute_mcs(model, self.found_cut_sets.emit, self.do_abort,
+                                                             **self.mcs_setup)
+                self.finished_computation.emit(mcs, err_val, "")
+            except MCSEnumerationAborted as e:
+                self.finished_computation.emit(e.mcs, 0, "")
+            except mcs_computation.InfeasibleRegion as e:
+                self.finished_computation.emit(None, 0, str(e))
+            except Exception:
+                exstr = traceback.format_exc()
+                self.write(exstr)
+                self.finished_computation.emit(None, 1, exstr)
+        results_cache = self.appdata.results_cache()
+        if results_cache is not None and self.mcs_setup.get('results_cache_dir') is not None:
+            # optlang_enumerator writes its intermediate results directly into the cache directory,
+            # they are added to the index and count towards the limits of the cache
+            results_cache.evict()
+
+    def write(self, input):
+        # avoid that other threads use this as an output
+        if self.curr_threadID == self.currentThread():
+            self.output_connector.emit(str(input))
+
+    def flush(self):
+        pass
+
+    # the progress output and the cut sets need to be passed as signals because all Qt widgets
+    # must run on the main thread and their methods cannot be safely called from other threads
+    output_connector = Signal(str)
+    found_cut_sets = Signal(list)
+    finished_computation = Signal(object, int, str)
+
+
+class MCSComputationViewer(QDialog):
+    """A dialog that shows the progress of an ongoing MCS computation and passes the
+    cut sets to the mode navigator while the enumeration is still running"""
+
+    def __init__(self, appdata: AppData, central_widget, reac_id, regions=None):
+        super().__init__(central_widget)
+        self.appdata = appdata
+        self.central_widget = central_widget
+        self.reac_id = reac_id
+        self.regions = regions # target and desired regions as text for the verification of the cut sets
+        self.mcs = []
+        self.num_displayed = 0
+        self.streamed_modes = None
+        self.mcs_computation = None
+
+        self.setWindowTitle("Minimal Cut Sets Computation")
+        self.setMinimumWidth(620)
+        self.layout = QVBoxLayout()
+        self.textbox = QTextEdit("MCS computation progress:")
+        self.textbox.setReadOnly(True)
+        self.layout.addWidget(self.textbox)
+        self.found_label = QLabel("0 cut sets found")
+        self.layout.addWidget(self.found_label)
+
+        buttons_layout = QHBoxLayout()
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setToolTip("Stop the enumeration and keep the cut sets found so far")
+        self.stop_button.setMaximumWidth(120)
+        self.stop_button.clicked.connect(self.stop)
+        close = QPushButton("Close")
+        close.setMaximumWidth(120)
+        close.clicked.connect(self.reject)
+        buttons_layout.addWidget(self.stop_button)
+        buttons_layout.addWidget(close)
+        self.layout.addItem(buttons_layout)
+        self.setLayout(self.layout)
+
+        # new cut sets are collected and passed on in intervals so that the navigator is not rebuilt for each one
+        self.display_timer = QTimer(self)
+        self.display_timer.setInterval(1000)
+        self.display_timer.timeout.connect(self.display_cut_sets)
+        self.display_timer.start()
+
+    @Slot(str)
+    def receive_progress_text(self, txt):
+        txt = txt.strip("\n\t\r ")
+        if txt != "":
+            self.textbox.append(txt)
+            self.textbox.verticalScrollBar().setValue(self.textbox.verticalScrollBar().maximum())
+
+    @Slot(list)
+    def receive_cut_sets(self, mcs):
+        self.mcs.extend(mcs)
+        self.found_label.setText(str(len(self.mcs))+" cut sets found")
+
+    @Slot()
+    def display_cut_sets(self):
+        if len(self.mcs) == self.num_displayed:
+            return
+        modes = FluxVectorCutSets.from_cut_sets(self.mcs, self.reac_id)
+        mode_navigator = self.central_widget.mode_navigator
+        if self.streamed_modes is not None and self.appdata.project.modes is self.streamed_modes:
+            # keep the current mode and the selection, the new cut sets are added as selected
+            added = len(modes) - len(self.streamed_modes)
+            mode_navigator.selection = numpy.concatenate((mode_navigator.selection, numpy.ones(added, dtype=bool)))
+            mode_navigator.num_selected += added
+            self.appdata.project.modes = modes
+            mode_navigator.update()
+        else:
+            self.appdata.project.modes = modes
+            mode_navigator.current = 0
+            mode_navigator.set_to_mcs()
+            mode_navigator.verification_regions = self.regions
+            self.central_widget.update_mode()
+        self.streamed_modes = modes
+        self.num_displayed = len(self.mcs)
+
+    @Slot(object, int, str)
+    def conclude_computation(self, mcs, err_val, error):
+        self.display_timer.stop()
+        self.stop_button.setEnabled(False)
+        if len(error) > 0:
+            if err_val == 1:
+                utils.show_unknown_error_box(error)
+            else:
+                QMessageBox.warning(self, 'Cannot calculate MCS', error)
+            return
+        if self.mcs_computation.abort:
+            # all cut sets received so far are complete, a parallel computation also
+            # passes them on after removing those that are supersets of others
+            if mcs is None:
+                self.display_cut_sets()
+            elif len(mcs) > 0:
+                self.show_cut_sets(mcs)
+            self.receive_progress_text("Enumeration stopped, "+str(len(self.mcs))+" cut sets have been found.")
+            return
+
+        if err_val == 1:
+            QMessageBox.warning(self, "Enumeration stopped abnormally",
+                                "Result is probably incomplete.\nCheck console output for more information.")
+        elif err_val == -1:
+            QMessageBox.warning(self, "Enumeration terminated permaturely",
+                                "Aborted due to excessive generation of candidates that are not cut sets.\n"
+                                "Modify the problem or try a different enumeration setup.")
+        elif err_val == TRUNCATED_SUBPROBLEM:
+            QMessageBox.warning(self, "Split enumeration incomplete",
+                                "At least one subproblem stopped at the maximal number of cut sets or the time limit.\n"
+                                "The cut sets may be incomplete and some of them may not be minimal.\n"
+                                "Increase these limits or compute without splitting.")
+
+        if len(mcs) == 0:
+            QMessageBox.information(self, 'No cut sets',
+                                          'Cut sets have not been calculated or do not exist.')
+            return
+
+        # the final result replaces the streamed cut sets because it may be sorted or filtered
+        self.show_cut_sets(mcs)
+        QMessageBox.information(self, 'Cut sets found',
+                                      str(len(mcs))+' Cut sets have been calculated.')
+
+    def show_cut_sets(self, mcs):
+        self.mcs = list(mcs)
+        self.num_displayed = len(self.mcs)
+        self.streamed_modes = None
+        self.appdata.project.modes = FluxVectorCutSets.from_cut_sets(self.mcs, self.reac_id)
+        self.central_widget.mode_navigator.current = 0
+        self.central_widget.mode_navigator.set_to_mcs()
+        self.central_widget.mode_navigator.verification_regions = self.regions
+        self.central_widget.update_mode()
+        self.found_label.setText(str(len(self.mcs))+" cut sets found")
+
+    @Slot()
+    def stop(self):
+        if self.mcs_computation is not None and self.mcs_computation.isRunning():
+            self.stop_computation.emit()
+            self.stop_button.setEnabled(False)
+            self.receive_progress_text("Stopping the enumeration after the current solver call...")
+
+    def reject(self):
+        self.stop()
+        super().reject()
+
+    stop_computation = Signal()
@@ -0,0 +1,188 @@
+"""The dialog for grouping the modes in the mode navigator into clusters of similar supports"""
+import traceback
+import numpy
+import cobra
+from qtpy.QtCore import Qt, QAbstractTableModel, QModelIndex, QThread, Signal, Slot
+from qtpy.QtWidgets import (QDialog, QDoubleSpinBox, QHBoxLayout, QLabel, QPushButton,
+                            QTableView, QVBoxLayout)
+
+from cnapy.appdata import AppData
+from cnapy.mode_clustering import ModeClusters, cluster_modes
+import cnapy.utils as utils
+
+
+class ModeClusterTableModel(QAbstractTableModel):
+    '''
+    One row per cluster with its size and representative mode; the clusters are ordered by decreasing size
+    '''
+    headers = ["Cluster", "Size", "Representative"]
+
+    def __init__(self, clusters: ModeClusters):
+        super().__init__()
+        self.clusters = clusters
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.clusters)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            if index.column() == 0:
+                return str(index.row() + 1)
+            elif index.column() == 1:
+                return str(self.clusters.sizes[index.row()])
+            else:
+                return str(self.clusters.representatives[index.row()] + 1)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+
+class ModeClusterDialog(QDialog):
+    """A dialog to group the modes by the similarity of their supports and to navigate through the clusters"""
+
+    def __init__(self, appdata: AppData, central_widget):
+        QDialog.__init__(self)
+        self.setWindowTitle("Mode clusters")
+
+        self.appdata = appdata
+        self.central_widget = central_widget
+        self.mode_navigator = central_widget.mode_navigator
+        self.clusters = None
+        self.clustered_modes = None # the mode set from which the clusters were computed
+        self.clustering = None
+
+        self.layout = QVBoxLayout()
+        l = QLabel("Group the modes so that the support of each mode has at least the given\n"+
+                   "(estimated) Jaccard similarity to the representative of its cluster.")
+        self.layout.addWidget(l)
+        l1 = QHBoxLayout()
+        l1.addWidget(QLabel("Minimal similarity"))
+        self.threshold = QDoubleSpinBox()
+        self.threshold.setRange(0.05, 1.0)
+        self.threshold.setSingleStep(0.05)
+        self.threshold.setValue(0.7)
+        l1.addWidget(self.threshold)
+        self.button = QPushButton("Compute")
+        l1.addWidget(self.button)
+        self.layout.addItem(l1)
+
+        self.status = QLabel()
+        self.layout.addWidget(self.status)
+
+        self.table = QTableView()
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setSelectionMode(QTableView.SingleSelection)
+        self.table.setToolTip("Double-click a row to show the modes of this cluster")
+        self.layout.addWidget(self.table)
+
+        l2 = QHBoxLayout()
+        self.representatives_button = QPushButton("Show representatives")
+        self.representatives_button.setToolTip("Select one representative mode per cluster in the mode navigator")
+        l2.addWidget(self.representatives_button)
+        self.members_button = QPushButton("Show cluster")
+        self.members_button.setToolTip("Select the modes of the chosen cluster in the mode navigator")
+        l2.addWidget(self.members_button)
+        self.all_button = QPushButton("Show all")
+        l2.addWidget(self.all_button)
+        self.layout.addItem(l2)
+        self.set_buttons_enabled(False)
+
+        self.cancel = QPushButton("Close")
+        self.layout.addWidget(self.cancel)
+        self.setLayout(self.layout)
+
+        self.button.clicked.connect(self.compute)
+        self.representatives_button.clicked.connect(self.show_representatives)
+        self.members_button.clicked.connect(self.show_selected_cluster)
+        self.all_button.clicked.connect(self.mode_navigator.reset_selection)
+        self.table.doubleClicked.connect(lambda index: self.show_cluster(index.row()))
+        self.cancel.clicked.connect(self.reject)
+        self.mode_navigator.modeNavigatorClosed.connect(self.reject)
+
+    def set_buttons_enabled(self, enabled: bool):
+        self.representatives_button.setEnabled(enabled)
+        self.members_button.setEnabled(enabled)
+        self.all_button.setEnabled(enabled)
+
+    def compute(self):
+        modes = self.appdata.project.modes
+        self.button.setEnabled(False)
+        self.set_buttons_enabled(False)
+        self.status.setText("Clustering "+str(len(modes))+" modes...")
+        self.setCursor(Qt.BusyCursor)
+        self.clustering = ModeClusterThread(modes, self.threshold.value(), cobra.Configuration().processes)
+        self.clustering.finished_clustering.connect(self.conclude_computation, Qt.QueuedConnection)
+        self.clustering.start()
+
+    @Slot(object, object, str)
+    def conclude_computation(self, modes, clusters, error):
+        self.setCursor(Qt.ArrowCursor)
+        self.button.setEnabled(True)
+        if len(error) > 0:
+            self.status.setText("")
+            utils.show_unknown_error_box(error)
+            return
+        self.clusters = clusters
+        self.clustered_modes = modes
+        self.table.setModel(ModeClusterTableModel(clusters))
+        if len(clusters) == 0:
+            self.status.setText("There are no modes to cluster.")
+        else:
+            self.status.setText(str(len(clusters))+" clusters")
+        self.set_buttons_enabled(len(clusters) > 0)
+
+    def valid(self) -> bool:
+        # the modes may have been replaced since the clusters were computed, even by a set of the same size
+        if self.clusters is None or len(self.clusters) == 0:
+            return False
+        if self.appdata.project.modes is not self.clustered_modes:
+            self.status.setText("The modes have changed, the clusters need to be computed again.")
+            return False
+        return True
+
+    def select_modes(self, mode_idx: numpy.ndarray):
+        if len(mode_idx) == 0:
+            return
+        self.mode_navigator.selection[:] = False
+        self.mode_navigator.selection[mode_idx] = True
+        self.mode_navigator.num_selected = numpy.sum(self.mode_navigator.selection)
+        self.mode_navigator.current = int(mode_idx[0])
+        self.mode_navigator.display_mode()
+
+    def show_representatives(self):
+        if self.valid():
+            self.select_modes(self.clusters.representatives)
+
+    def show_cluster(self, cluster: int):
+        if self.valid():
+            members = self.clusters.members(cluster)
+            # start with the representative
+            self.select_modes(numpy.concatenate(([self.clusters.representatives[cluster]], members)))
+
+    def show_selected_cluster(self):
+        rows = self.table.selectionModel().selectedRows() if self.table.selectionModel() is not None else []
+        if len(rows) > 0:
+            self.show_cluster(rows[0].row())
+
+
+class ModeClusterThread(QThread):
+    def __init__(self, modes, threshold: float, threads: int):
+        super().__init__()
+        self.modes = modes
+        self.threshold = threshold
+        self.threads = threads
+
+    def run(self):
+        try:
+            clusters = cluster_modes(self.modes, threshold=self.threshold, threads=self.threads)
+            self.finished_clustering.emit(self.modes, clusters, "")
+        except Exception:
+            self.finished_clustering.emit(self.modes, None, traceback.format_exc())
+
+    finished_clustering = Signal(object, object, str)
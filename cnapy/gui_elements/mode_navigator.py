@@ -1,4 +1,6 @@
+import re
 import numpy
+import scipy.sparse
 import matplotlib.pyplot as plt
 
 from qtpy.QtCore import Qt, Signal, Slot, QStringListModel
@@ -7,7 +9,11 @@ from qtpy.QtWidgets import (QFileDialog, QHBoxLayout, QLabel, QPushButton,
                             QVBoxLayout, QWidget, QCompleter, QLineEdit, QMessageBox, QToolButton)
 
 
-from cnapy.flux_vector_container import FluxVectorContainer
+from cnapy.flux_vector_container import FluxVectorContainer, FluxVectorChunked, FluxVectorSparse, save_chunked
+from cnapy.mode_query import ModeQuery, ModeQueryError
+from cnapy.gui_elements.mode_yield_dialog import ModeYieldDialog
+from cnapy.gui_elements.mode_cluster_dialog import ModeClusterDialog
+from cnapy.gui_elements.solution_verification_dialog import SolutionVerificationDialog
 
 
 class ModeNavigator(QWidget):
@@ -22,6 +28,8 @@ class ModeNavigator(QWidget):
         self.mode_type = 0 # EFM or some sort of flux vector
         self.scenario = {}
         self.modified_scenario = None
+        self.verification_regions = None # (target regions, desired regions) of the computation that produced the modes
+        self.normalize_modes = True # whether non-integer flux vectors are scaled for display
         self.setFixedHeight(70)
         self.layout = QVBoxLayout()
         self.layout.setContentsMargins(0, 0, 0, 0)
@@ -39,11 +47,20 @@ class ModeNavigator(QWidget):
         self.apply_button.setToolTip("Add interventions to current scenario")
         self.reaction_participation_button = QPushButton("Reaction participation")
         self.size_histogram_button = QPushButton("Size histogram")
+        self.yield_button = QPushButton("Yields")
+        self.yield_button.setToolTip("Compute a yield for all selected modes")
+        self.cluster_button = QPushButton("Clusters")
+        self.cluster_button.setToolTip("Group the modes by the similarity of their supports")
+        self.verify_button = QPushButton("Verify")
+        self.verify_button.setToolTip("Check the target and desired regions for all selected solutions")
 
         l1 = QHBoxLayout()
         self.title = QLabel("Mode Navigation")
         self.selector = SelectorLineEdit(self)
         self.selector.setPlaceholderText("Select...")
+        self.selector.setToolTip("Select modes with reaction IDs combined by AND (or ','), OR (or '|'), NOT (or '!') "
+                                 "and parentheses,\ne.g. (PGK | PFK), !EX_o2_e\n"
+                                 "Use r>0 / r<0 for the flux direction and size<=n or size=n..m for the number of active reactions.")
         self.selector.setClearButtonEnabled(True)
 
         self.completion_list = QStringListModel()
@@ -67,6 +84,9 @@ class ModeNavigator(QWidget):
         l2.addWidget(self.apply_button)
         l2.addWidget(self.reaction_participation_button)
         l2.addWidget(self.size_histogram_button)
+        l2.addWidget(self.yield_button)
+        l2.addWidget(self.cluster_button)
+        l2.addWidget(self.verify_button)
 
         self.layout.addLayout(l1)
         self.layout.addLayout(l2)
@@ -79,6 +99,9 @@ class ModeNavigator(QWidget):
         self.selector.returnPressed.connect(self.apply_selection)
         self.selector.findChild(QToolButton).triggered.connect(self.reset_selection) # findChild(QToolButton) retrieves the clear button
         self.size_histogram_button.clicked.connect(self.size_histogram)
+        self.yield_button.clicked.connect(self.show_yields)
+        self.cluster_button.clicked.connect(self.show_clusters)
+        self.verify_button.clicked.connect(self.show_verification)
         self.central_widget.broadcastReactionID.connect(self.selector.receive_input)
 
     def update(self):
@@ -102,18 +125,33 @@ class ModeNavigator(QWidget):
     def save_mcs(self):
         dialog = QFileDialog(self)
         filename: str = dialog.getSaveFileName(
-            directory=self.appdata.work_directory, filter="*.npz")[0]
+            directory=self.appdata.work_directory, filter="*.fvc;;*.npz")[0]
         if not filename or len(filename) == 0:
             return
-        self.appdata.project.modes.save(filename)
+        self.save_modes(filename)
 
     def save_efm(self):
         dialog = QFileDialog(self)
         filename: str = dialog.getSaveFileName(
-            directory=self.appdata.work_directory, filter="*.npz")[0]
+            directory=self.appdata.work_directory, filter="*.fvc;;*.npz")[0]
         if not filename or len(filename) == 0:
             return
-        self.appdata.project.modes.save(filename)
+        self.save_modes(filename)
+
+    def save_modes(self, filename: str):
+        modes = self.appdata.project.modes
+        if filename.endswith('.npz'):
+            if isinstance(modes, FluxVectorChunked):
+                modes = FluxVectorSparse(scipy.sparse.vstack([block for _, block in modes.iter_chunks()], format='csr'),
+                                         reac_id=modes.reac_id, irreversible=modes.irreversible, unbounded=modes.unbounded)
+            modes.save(filename)
+        else:
+            if not filename.endswith('.fvc'):
+                filename += '.fvc'
+            if isinstance(modes, FluxVectorChunked):
+                modes.save(filename)
+            else:
+                save_chunked(modes, filename)
 
     def save_sd(self):
         dialog = QFileDialog(self)
@@ -138,18 +176,27 @@ class ModeNavigator(QWidget):
         self.save_button.setToolTip("save minimal cut sets")
         self.clear_button.setToolTip("clear minimal cut sets")
         self.apply_button.setVisible(True)
+        self.yield_button.setVisible(False)
+        self.cluster_button.setVisible(True)
+        self.verify_button.setVisible(True)
+        self.verification_regions = None
         self.select_all()
         self.update_completion_list()
 
-    def set_to_efm(self):
+    def set_to_efm(self, normalize=True):
         self.mode_type = 0 # EFM or some sort of flux vector
-        self.title.setText("Mode Navigation")
+        self.normalize_modes = normalize # flux samples are displayed with their actual values
+        self.title.setText("Mode Navigation" if normalize else "Flux Sample Navigation")
         if self.save_button_connection is not None:
             self.save_button.clicked.disconnect(self.save_button_connection)
         self.save_button_connection = self.save_button.clicked.connect(self.save_efm)
         self.save_button.setToolTip("save modes")
         self.clear_button.setToolTip("clear modes")
         self.apply_button.setVisible(False)
+        self.yield_button.setVisible(True)
+        self.cluster_button.setVisible(True)
+        self.verify_button.setVisible(False)
+        self.verification_regions = None
         self.select_all()
         self.update_completion_list()
 
@@ -162,6 +209,10 @@ class ModeNavigator(QWidget):
         self.save_button.setToolTip("save strain designs")
         self.clear_button.setToolTip("clear strain designs")
         self.apply_button.setVisible(True)
+        self.yield_button.setVisible(False)
+        self.cluster_button.setVisible(False)
+        self.verify_button.setVisible(True)
+        self.verification_regions = None
         self.select_all()
         self.update_completion_list()
 
@@ -233,12 +284,17 @@ class ModeNavigator(QWidget):
             self.reset_selection()
         else:
             try:
-                for r in map(str.strip, selector_text.split(',')):
-                    if r[0] == "!":
-                        must_not_occur.append(r[1:].lstrip())
-                    else:
-                        must_occur.append(r)
-                self.select(must_occur=must_occur, must_not_occur=must_not_occur)
+                if self.mode_type <= 1:
+                    self.select_by_query(selector_text)
+                else:
+                    for r in map(str.strip, selector_text.split(',')):
+                        if r[0] == "!":
+                            must_not_occur.append(r[1:].lstrip())
+                        else:
+                            must_occur.append(r)
+                    self.select(must_occur=must_occur, must_not_occur=must_not_occur)
+            except ModeQueryError as e:
+                QMessageBox.critical(self, "Cannot apply selection", str(e))
             except (ValueError, IndexError): # some ID was not found / an empty ID was encountered
                 QMessageBox.critical(self, "Cannot apply selection", "Check the selection for mistakes.")
             if self.num_selected == 0:
@@ -251,34 +307,23 @@ class ModeNavigator(QWidget):
                 else:
                     self.next()
 
+    def select_by_query(self, query_text: str):
+        # the query is answered by set operations on the inverted index of the mode set, see cnapy.mode_query
+        modes = self.appdata.project.modes
+        query = ModeQuery(query_text, modes.reac_id)
+        self.selection[:] = query.evaluate(modes.inverted_index, modes.support_index.sizes())
+        self.num_selected = numpy.sum(self.selection)
+
     def select(self, must_occur=None, must_not_occur=None):
         self.selection[:] = True  # reset selection
         if self.appdata.window.centralWidget().mode_navigator.mode_type <=1:
-            if must_occur is not None:
-                for r in must_occur:
-                    r_idx = self.appdata.project.modes.reac_id.index(r)
-                    for i, selected in enumerate(self.selection):
-                        if selected and self.appdata.project.modes.fv_mat[i, r_idx] == 0:
-                            self.selection[i] = False
-            if must_not_occur is not None:
-                for r in must_not_occur:
-                    r_idx = self.appdata.project.modes.reac_id.index(r)
-                    for i, selected in enumerate(self.selection):
-                        if selected and self.appdata.project.modes.fv_mat[i, r_idx] != 0:
-                            self.selection[i] = False
+            reac_id = self.appdata.project.modes.reac_id
+            self.selection[:] = self.appdata.project.modes.support_index.select(
+                must_occur=[reac_id.index(r) for r in must_occur or []],
+                must_not_occur=[reac_id.index(r) for r in must_not_occur or []])
         elif self.appdata.window.centralWidget().mode_navigator.mode_type == 2:
-            if must_occur is not None:
-                for r in must_occur:
-                    for i, selected in enumerate(self.selection):
-                        s = self.appdata.project.modes[i]
-                        if selected and r not in s or numpy.any(numpy.isnan(s[r])) or numpy.all((s[r] == 0)):
-                            self.selection[i] = False
-            if must_not_occur is not None:
-                for r in must_not_occur:
-                    for i, selected in enumerate(self.selection):
-                        s = self.appdata.project.modes[i]
-                        if selected and r in s and not numpy.any(numpy.isnan(s[r])) or numpy.all((s[r] == 0)):
-                            self.selection[i] = False
+            self.selection[:] = self.appdata.project.modes.select(must_occur=must_occur or [],
+                                                                  must_not_occur=must_not_occur or [])
             if self.appdata.window.sd_sols and self.appdata.window.sd_sols.__weakref__: # if dialog exists
                 for i in range(self.appdata.window.sd_sols.sd_table.rowCount()):
                     r_sd_idx = int(self.appdata.window.sd_sols.sd_table.item(i,0).text())-1
@@ -296,15 +341,24 @@ class ModeNavigator(QWidget):
 
     def size_histogram(self):
         if self.appdata.window.centralWidget().mode_navigator.mode_type <=1:
-            sizes = numpy.sum(self.appdata.project.modes.fv_mat[self.selection, :] != 0, axis=1)
-            if isinstance(sizes, numpy.matrix): # numpy.sum returns a matrix with one row when fv_mat is scipy.sparse
-                sizes = sizes.A1 # flatten into 1D array
+            sizes = self.appdata.project.modes.support_index.sizes(self.selection)
         elif self.appdata.window.centralWidget().mode_navigator.mode_type == 2:
-            sizes = [numpy.sum([not numpy.any(numpy.isnan(v)) or numpy.all((v == 0)) \
-                                for v in self.appdata.project.modes[i].values()]) for i,s in enumerate(self.selection) if s]
+            sizes = self.appdata.project.modes.sizes(self.selection)
         plt.hist(sizes, bins="auto")
         plt.show()
 
+    def show_yields(self):
+        self.yield_dialog = ModeYieldDialog(self.appdata, self.central_widget)
+        self.yield_dialog.show()
+
+    def show_clusters(self):
+        self.cluster_dialog = ModeClusterDialog(self.appdata, self.central_widget)
+        self.cluster_dialog.show()
+
+    def show_verification(self):
+        self.verification_dialog = SolutionVerificationDialog(self.appdata, self.central_widget)
+        self.verification_dialog.show()
+
     def __del__(self):
         self.appdata.project.modes.clear() # for proper deallocation when it is a FluxVectorMemmap
 
@@ -337,13 +391,14 @@ class CustomCompleter(QCompleter):
     def __init__(self, parent=None):
         QCompleter.__init__(self, parent)
 
+    # the part of the selector text after the last operator or parenthesis is completed
+    last_term = re.compile(r"[^,&|()<>=\s]*$")
+
     def pathFromIndex(self, index): # overrides Qcompleter method
         path = QCompleter.pathFromIndex(self, index)
-        lst = str(self.widget().text()).split(',')
-        if len(lst) > 1:
-            path = '%s, %s' % (','.join(lst[:-1]), path)
-        return path
+        text = str(self.widget().text())
+        return text[:self.last_term.search(text).start()] + path
 
     def splitPath(self, path): # overrides Qcompleter method
-        path = str(path.split(',')[-1]).lstrip(' ')
-        return [path]
+        path = str(path)
+        return [path[self.last_term.search(path).start():]]
@@ -0,0 +1,183 @@
+"""The dialog for evaluating yields over all modes in the mode navigator"""
+import numpy
+import matplotlib.pyplot as plt
+from qtpy.QtCore import Qt, QAbstractTableModel, QModelIndex, Slot
+from qtpy.QtGui import QDoubleValidator
+from qtpy.QtWidgets import (QDialog, QFrame, QHBoxLayout, QLabel, QLineEdit, QMessageBox,
+                            QPushButton, QTableView, QVBoxLayout)
+from straindesign import linexpr2dict
+
+from cnapy.appdata import AppData
+from cnapy.mode_statistics import mode_yields
+from cnapy.utils import QComplReceivLineEdit, QHSeperationLine
+
+
+class ModeYieldTableModel(QAbstractTableModel):
+    '''
+    Presents the numerator, denominator and yield of the modes directly from numpy arrays
+    so that tables with millions of rows remain responsive; sorting only permutes the row order
+    '''
+    headers = ["Mode", "Numerator", "Denominator", "Yield"]
+
+    def __init__(self, mode_idx: numpy.ndarray, num: numpy.ndarray, den: numpy.ndarray, yields: numpy.ndarray):
+        super().__init__()
+        self.columns = [mode_idx, num, den, yields]
+        self.order = numpy.arange(len(mode_idx))
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            value = self.columns[index.column()][self.order[index.row()]]
+            if index.column() == 0:
+                return str(value + 1)
+            return str(round(float(value), 6))
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        # NaN yields are placed at the end in both sort orders
+        values = self.columns[column]
+        nan_last = numpy.isnan(values) if values.dtype.kind == 'f' else numpy.zeros(len(values), dtype=bool)
+        keys = -values if order == Qt.DescendingOrder else values
+        self.order = numpy.lexsort((keys, nan_last))
+        self.layoutChanged.emit()
+
+    def mode_at_row(self, row: int) -> int:
+        return int(self.columns[0][self.order[row]])
+
+
+class ModeYieldDialog(QDialog):
+    """A dialog to compute a yield for all selected modes at once"""
+
+    def __init__(self, appdata: AppData, central_widget):
+        QDialog.__init__(self)
+        self.setWindowTitle("Mode yields")
+
+        self.appdata = appdata
+        self.central_widget = central_widget
+        self.mode_navigator = central_widget.mode_navigator
+        self.reac_ids = self.appdata.project.modes.reac_id
+        self.yields = None
+        self.mode_idx = None
+
+        self.layout = QVBoxLayout()
+        l = QLabel("Evaluate a yield function for all selected modes.\n"+
+                   "Numerator and denominator are specified as linear expressions\n"+
+                   "with reaction identifiers and (optionally) coefficients.")
+        self.layout.addWidget(l)
+        self.numerator = QComplReceivLineEdit(self, self.reac_ids, check=True)
+        self.numerator.setPlaceholderText('numerator (e.g. 1.0 r_product)')
+        self.denominator = QComplReceivLineEdit(self, self.reac_ids, check=True)
+        self.denominator.setPlaceholderText('denominator (e.g. 1.0 r_substrate)')
+        self.layout.addWidget(self.numerator)
+        sep = QHSeperationLine()
+        sep.setFrameShadow(QFrame.Plain)
+        sep.setLineWidth(2)
+        self.layout.addWidget(sep)
+        self.layout.addWidget(self.denominator)
+
+        l2 = QHBoxLayout()
+        self.button = QPushButton("Compute")
+        self.histogram_button = QPushButton("Histogram")
+        self.histogram_button.setEnabled(False)
+        l2.addWidget(self.button)
+        l2.addWidget(self.histogram_button)
+        self.layout.addItem(l2)
+
+        self.table = QTableView()
+        self.table.setSortingEnabled(True)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setToolTip("Double-click a row to show the mode")
+        self.layout.addWidget(self.table)
+
+        l3 = QHBoxLayout()
+        l3.addWidget(QLabel("Select modes with yield from"))
+        self.min_yield = QLineEdit()
+        self.min_yield.setValidator(QDoubleValidator())
+        l3.addWidget(self.min_yield)
+        l3.addWidget(QLabel("to"))
+        self.max_yield = QLineEdit()
+        self.max_yield.setValidator(QDoubleValidator())
+        l3.addWidget(self.max_yield)
+        self.filter_button = QPushButton("Select")
+        self.filter_button.setToolTip("Restrict the selection in the mode navigator to the modes in this range")
+        self.filter_button.setEnabled(False)
+        l3.addWidget(self.filter_button)
+        self.layout.addItem(l3)
+
+        self.cancel = QPushButton("Close")
+        self.layout.addWidget(self.cancel)
+        self.setLayout(self.layout)
+
+        self.numerator.textCorrect.connect(self.validate_dialog)
+        self.denominator.textCorrect.connect(self.validate_dialog)
+        self.button.clicked.connect(self.compute)
+        self.histogram_button.clicked.connect(self.histogram)
+        self.filter_button.clicked.connect(self.apply_filter)
+        self.table.doubleClicked.connect(self.show_mode)
+        self.cancel.clicked.connect(self.reject)
+        self.mode_navigator.modeNavigatorClosed.connect(self.reject)
+
+        self.validate_dialog()
+
+    @Slot(bool)
+    def validate_dialog(self, b=True):
+        self.button.setEnabled(bool(self.numerator.is_valid and self.denominator.is_valid))
+
+    def compute(self):
+        self.setCursor(Qt.BusyCursor)
+        try:
+            self.mode_idx = numpy.nonzero(self.mode_navigator.selection)[0]
+            num, den, self.yields = mode_yields(self.appdata.project.modes,
+                                                linexpr2dict(self.numerator.text(), self.reac_ids),
+                                                linexpr2dict(self.denominator.text(), self.reac_ids),
+                                                selection=self.mode_navigator.selection)
+        except ValueError as e:
+            QMessageBox.critical(self, "Cannot compute yields", str(e))
+            return
+        finally:
+            self.setCursor(Qt.ArrowCursor)
+        self.table.setModel(ModeYieldTableModel(self.mode_idx, num, den, self.yields))
+        self.table.sortByColumn(3, Qt.DescendingOrder)
+        self.histogram_button.setEnabled(True)
+        self.filter_button.setEnabled(True)
+        undefined = numpy.sum(numpy.isnan(self.yields))
+        if undefined > 0:
+            QMessageBox.information(self, "Undefined yields",
+                                    "The denominator is 0 in "+str(undefined)+" of the selected modes.")
+
+    def histogram(self):
+        plt.hist(self.yields[~numpy.isnan(self.yields)], bins="auto")
+        plt.show()
+
+    def apply_filter(self):
+        if self.yields is None or len(self.yields) != len(self.mode_idx):
+            return
+        in_range = ~numpy.isnan(self.yields)
+        if len(self.min_yield.text()) > 0:
+            in_range &= self.yields >= float(self.min_yield.text())
+        if len(self.max_yield.text()) > 0:
+            in_range &= self.yields <= float(self.max_yield.text())
+        if not numpy.any(in_range):
+            QMessageBox.information(self, "Selection not applied",
+                                    "No mode has a yield in this range.")
+            return
+        self.mode_navigator.selection[:] = False
+        self.mode_navigator.selection[self.mode_idx[in_range]] = True
+        self.mode_navigator.num_selected = numpy.sum(self.mode_navigator.selection)
+        self.mode_navigator.current = int(self.mode_idx[in_range][0])
+        self.mode_navigator.display_mode()
+
+    def show_mode(self, index):
+        self.mode_navigator.current = self.table.model().mode_at_row(index.row())
+        self.mode_navigator.display_mode()
@@ -400,6 +400,16 @@ class ReactionList(QWidget):
         self.reaction_list.resizeColumnToContents(ReactionListColumn.UB)
         self.reaction_list.resizeColumnToContents(ReactionListColumn.DF)
 
+    def update_reactions(self, reac_ids):
+        # like update but only for the items of the given reactions
+        self.reaction_list.itemChanged.disconnect(self.handle_item_changed)
+        self.reaction_list.setSortingEnabled(False)
+        for r in reac_ids:
+            for item in self.reaction_list.findItems(r, Qt.MatchExactly, ReactionListColumn.Id):
+                self.update_item(item)
+        self.reaction_list.itemChanged.connect(self.handle_item_changed)
+        self.reaction_list.setSortingEnabled(True)
+
     def set_current_item(self, key: str):
         self.last_selected = key
         self.update()
@@ -0,0 +1,226 @@
+"""The dialog for verifying all cut sets or strain designs in the mode navigator"""
+import traceback
+import numpy
+import cobra
+from qtpy.QtCore import Qt, QAbstractTableModel, QModelIndex, QThread, Signal, Slot
+from qtpy.QtGui import QColor
+from qtpy.QtWidgets import (QCheckBox, QDialog, QHBoxLayout, QLabel, QMessageBox, QPushButton,
+                            QSpinBox, QTableView, QTextEdit, QVBoxLayout)
+from straindesign import parse_constraints
+
+from cnapy.appdata import AppData
+from cnapy.solution_verification import mode_interventions, verify_solutions
+import cnapy.utils as utils
+
+
+class VerificationTableModel(QAbstractTableModel):
+    '''
+    Presents the verification result of each solution; sorting only permutes the row order
+    '''
+    headers = ["Solution", "Passed", "Objective", "Targets blocked", "Desired feasible"]
+
+    def __init__(self, mode_idx: numpy.ndarray, passed: numpy.ndarray, objective: numpy.ndarray,
+                 target_feasible: numpy.ndarray, desired_feasible: numpy.ndarray):
+        super().__init__()
+        self.num_targets = target_feasible.shape[1]
+        self.num_desired = desired_feasible.shape[1]
+        self.columns = [mode_idx, passed, objective, numpy.sum(~target_feasible, axis=1),
+                        numpy.sum(desired_feasible, axis=1)]
+        self.order = numpy.arange(len(mode_idx))
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        value = self.columns[index.column()][self.order[index.row()]]
+        if role == Qt.DisplayRole:
+            if index.column() == 0:
+                return str(value + 1)
+            if index.column() == 1:
+                return "yes" if value else "no"
+            if index.column() == 2:
+                return str(round(float(value), 6))
+            return str(value)+"/"+str(self.num_targets if index.column() == 3 else self.num_desired)
+        if role == Qt.ForegroundRole and index.column() == 1 and not value:
+            return QColor.fromRgb(255, 0, 0)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        values = numpy.nan_to_num(self.columns[column].astype(float), nan=-numpy.inf)
+        self.order = numpy.argsort(-values if order == Qt.DescendingOrder else values, kind='stable')
+        self.layoutChanged.emit()
+
+    def mode_at_row(self, row: int) -> int:
+        return int(self.columns[0][self.order[row]])
+
+
+class SolutionVerificationDialog(QDialog):
+    """A dialog to check that the selected cut sets or strain designs block all target regions
+    and keep all desired regions feasible"""
+
+    def __init__(self, appdata: AppData, central_widget):
+        QDialog.__init__(self)
+        self.setWindowTitle("Verify solutions")
+
+        self.appdata = appdata
+        self.central_widget = central_widget
+        self.mode_navigator = central_widget.mode_navigator
+        self.mode_idx = None
+        self.passed = None
+        self.verification = None
+
+        self.layout = QVBoxLayout()
+        l = QLabel("Enter one region per line with its constraints separated by commas,\n"+
+                   "e.g. BIOMASS >= 0.1, EX_etoh_e <= 0")
+        self.layout.addWidget(l)
+        self.layout.addWidget(QLabel("Target regions (must be infeasible)"))
+        self.targets = QTextEdit()
+        self.targets.setAcceptRichText(False)
+        self.layout.addWidget(self.targets)
+        self.layout.addWidget(QLabel("Desired regions (must remain feasible)"))
+        self.desired = QTextEdit()
+        self.desired.setAcceptRichText(False)
+        self.layout.addWidget(self.desired)
+        if self.mode_navigator.verification_regions is not None:
+            targets, desired = self.mode_navigator.verification_regions
+            self.targets.setPlainText("\n".join(targets))
+            self.desired.setPlainText("\n".join(desired))
+
+        l2 = QHBoxLayout()
+        self.consider_scenario = QCheckBox("Consider constraint given by scenario")
+        self.consider_scenario.setChecked(True)
+        l2.addWidget(self.consider_scenario)
+        l2.addWidget(QLabel("Processes"))
+        self.processes = QSpinBox()
+        self.processes.setMinimum(1)
+        self.processes.setValue(cobra.Configuration().processes)
+        l2.addWidget(self.processes)
+        self.button = QPushButton("Verify")
+        l2.addWidget(self.button)
+        self.layout.addItem(l2)
+
+        self.status = QLabel()
+        self.layout.addWidget(self.status)
+        self.table = QTableView()
+        self.table.setSortingEnabled(True)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setToolTip("Double-click a row to show the solution")
+        self.layout.addWidget(self.table)
+
+        l3 = QHBoxLayout()
+        self.failed_button = QPushButton("Select failed")
+        self.failed_button.setToolTip("Restrict the selection in the mode navigator to the solutions that failed")
+        self.failed_button.setEnabled(False)
+        l3.addWidget(self.failed_button)
+        self.cancel = QPushButton("Close")
+        l3.addWidget(self.cancel)
+        self.layout.addItem(l3)
+        self.setLayout(self.layout)
+
+        self.button.clicked.connect(self.verify)
+        self.failed_button.clicked.connect(self.select_failed)
+        self.table.doubleClicked.connect(self.show_mode)
+        self.cancel.clicked.connect(self.reject)
+        self.mode_navigator.modeNavigatorClosed.connect(self.reject)
+
+    def parse_regions(self, text_edit: QTextEdit, reac_id):
+        return [parse_constraints(line, reac_id) for line in text_edit.toPlainText().splitlines()
+                if len(line.strip()) > 0]
+
+    def verify(self):
+        reac_id = self.appdata.project.cobra_py_model.reactions.list_attr("id")
+        try:
+            targets = self.parse_regions(self.targets, reac_id)
+            desired = self.parse_regions(self.desired, reac_id)
+        except Exception as e:
+            QMessageBox.warning(self, "Failed to parse the regions",
+                                "Check that the constraints are correct.\n"+str(e))
+            return
+        if len(targets) == 0 and len(desired) == 0:
+            QMessageBox.information(self, "No regions", "Enter at least one target or desired region.")
+            return
+        self.mode_idx = numpy.nonzero(self.mode_navigator.selection)[0]
+        modes = self.appdata.project.modes
+        interventions = [mode_interventions(modes[i], self.mode_navigator.mode_type) for i in self.mode_idx]
+        self.button.setEnabled(False)
+        self.failed_button.setEnabled(False)
+        self.verification = SolutionVerificationThread(self.appdata, interventions, targets, desired,
+                                                       self.consider_scenario.isChecked(), self.processes.value())
+        self.verification.output_connector.connect(self.status.setText, Qt.QueuedConnection)
+        self.verification.finished_verification.connect(self.conclude_verification, Qt.QueuedConnection)
+        self.verification.start()
+
+    @Slot(object, str)
+    def conclude_verification(self, result, error):
+        self.button.setEnabled(True)
+        if len(error) > 0:
+            utils.show_unknown_error_box(error)
+            return
+        if result is None:
+            return
+        self.passed, objective, target_feasible, desired_feasible = result
+        self.table.setModel(VerificationTableModel(self.mode_idx, self.passed, objective,
+                                                   target_feasible, desired_feasible))
+        self.failed_button.setEnabled(not numpy.all(self.passed))
+        self.status.setText(str(numpy.sum(self.passed))+" of "+str(len(self.passed))+" solutions passed.")
+
+    def select_failed(self):
+        if self.passed is None or len(self.passed) != len(self.mode_idx) or numpy.all(self.passed):
+            return
+        self.mode_navigator.selection[:] = False
+        self.mode_navigator.selection[self.mode_idx[~self.passed]] = True
+        self.mode_navigator.num_selected = numpy.sum(self.mode_navigator.selection)
+        self.mode_navigator.current = int(self.mode_idx[~self.passed][0])
+        self.mode_navigator.display_mode()
+
+    def show_mode(self, index):
+        self.mode_navigator.current = self.table.model().mode_at_row(index.row())
+        self.mode_navigator.display_mode()
+
+    def reject(self):
+        if self.verification is not None and self.verification.isRunning():
+            self.verification.activate_abort()
+        super().reject()
+
+
+class SolutionVerificationThread(QThread):
+    def __init__(self, appdata: AppData, interventions, targets, desired, consider_scenario: bool, processes=1):
+        super().__init__()
+        self.appdata = appdata
+        self.interventions = interventions
+        self.targets = targets
+        self.desired = desired
+        self.consider_scenario = consider_scenario
+        self.processes = processes
+        self.abort = False
+
+    def do_abort(self):
+        return self.abort
+
+    @Slot()
+    def activate_abort(self):
+        self.abort = True
+
+    def run(self):
+        with self.appdata.project.cobra_py_model as model:
+            try:
+                if self.consider_scenario:  # integrate scenario into model bounds
+                    self.appdata.project.load_scenario_into_model(model)
+                result = verify_solutions(model, self.interventions, self.targets, self.desired,
+                                          processes=self.processes, abort_callback=self.do_abort,
+                                          print_progress_function=self.output_connector.emit)
+                self.finished_verification.emit(result, "")
+            except Exception:
+                self.finished_verification.emit(None, traceback.format_exc())
+
+    output_connector = Signal(str)
+    finished_verification = Signal(object, str)
@@ -22,6 +22,7 @@ from qtpy.QtWidgets import (QButtonGroup, QCheckBox, QComboBox, QCompleter,
 from cnapy.appdata import AppData
 from cnapy.gui_elements.solver_buttons import get_solver_buttons
 from cnapy.utils import QTableCopyable, QComplReceivLineEdit, QTableItem
+from cnapy.strain_design_bounds import StrainDesignBounds
 import logging
 
 PROTECT_STR = 'Protect (MCS)'
@@ -1509,10 +1510,17 @@ class SDViewer(QDialog):
             rsd = self.solutions.get_reaction_sd_mark_no_ki()
             self.assoc = [i for i in range(len(rsd))]
         itv_bounds = self.solutions.get_reaction_sd_bnds()
-        appdata.project.modes = [itv_bounds[self.assoc.index(i)] for i in set(self.assoc)]
+        appdata.project.modes = StrainDesignBounds.from_bounds_dicts([itv_bounds[self.assoc.index(i)] for i in set(self.assoc)])
         central_widget = appdata.window.centralWidget()
         central_widget.mode_navigator.current = 0
         central_widget.mode_navigator.set_to_strain_design()
+        # only modules without an inner objective are plain feasibility checks
+        regions = {SUPPRESS: [], PROTECT: []}
+        sd_setup = json.loads(self.sd_setup) if type(self.sd_setup) == str else self.sd_setup
+        for m in sd_setup[MODULES]:
+            if m[MODULE_TYPE] in regions and not m.get(INNER_OBJECTIVE):
+                regions[m[MODULE_TYPE]].append(", ".join(lineqlist2str(c) for c in m[CONSTRAINTS]))
+        central_widget.mode_navigator.verification_regions = (regions[SUPPRESS], regions[PROTECT])
         central_widget.update_mode()
 
         # prepare strain designs
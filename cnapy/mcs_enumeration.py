@@ -0,0 +1,261 @@
+"""MCS enumeration with the cut sets reported as soon as they are found, optionally split into parallel subproblems"""
+from contextlib import redirect_stdout, redirect_stderr
+import itertools
+import multiprocessing
+import queue
+import threading
+import traceback
+from typing import Callable, List, Tuple
+import cobra
+from cobra.util.solver import interface_to_str
+
+import optlang_enumerator.mcs_computation as mcs_computation
+import optlang_enumerator.cMCS_enumerator as cMCS_enumerator
+from cnapy.flux_vector_container import FluxVectorCutSets
+
+
+class MCSEnumerationAborted(Exception):
+    mcs = None # the cut sets found before the enumeration was stopped if they are not streamed
+
+
+# err_val of parallel_compute_mcs when a subproblem stopped at max_mcs_num or at the time limit
+TRUNCATED_SUBPROBLEM = 2
+
+
+# compute_mcs offers no way to pass in the enumerator, streaming_compute_mcs therefore has to replace
+# the module attribute it uses; this lock keeps concurrent calls from replacing each other's enumerator
+_enumerator_lock = threading.Lock()
+
+
+def _expand_cut_set(mcs, subsets) -> List[Tuple[int]]:
+    # each reaction subset of the compressed network can be cut by any of its intervenable reactions
+    return [tuple(sorted(m)) for m in itertools.product(*(subsets[i] for i in mcs))]
+
+
+def streaming_compute_mcs(model: cobra.Model, solution_callback: Callable[[List[Tuple[int]]], None],
+                          abort_callback: Callable[[], bool] = None, zero_cuts=(), required_cut: int = None,
+                          info: dict = None, **kwargs):
+    '''
+    Runs mcs_computation.compute_mcs and passes every cut set to solution_callback when the enumerator
+    excludes it from the further search, i.e. immediately after it has been found. The cut sets are
+    given as tuples of reaction indices of model; cut sets of the compressed network are expanded
+    beforehand. After each reported solution abort_callback is queried; if it returns True the
+    enumeration is stopped by raising MCSEnumerationAborted so that all cut sets passed to
+    solution_callback up to this point are complete and minimal.
+    The reactions in zero_cuts are not used as cuts and required_cut must be part of every cut set;
+    this restricts the enumeration to one subproblem of parallel_compute_mcs. With network compression
+    these restrictions apply to the reaction subsets which contain the given reactions.
+    The continuous search (enum_method 4) does not add exclusion constraints, its cut sets
+    are therefore only reported at the end. Concurrent calls within one process run one after the other.
+    If a dictionary is passed as info, info['truncated'] is set to whether the enumeration stopped
+    because it reached max_mcs_num or the time limit before all cut sets were found.
+    '''
+    if info is not None:
+        info['truncated'] = False
+    exclude_boundary = kwargs.get('exclude_boundary_reactions_as_cuts', False)
+    intervenable = [not (exclude_boundary and r.boundary) for r in model.reactions]
+    with _enumerator_lock:
+        base_enumerator = cMCS_enumerator.ConstrainedMinimalCutSetsEnumerator
+        streaming_thread = threading.get_ident()
+
+        class StreamingEnumerator(base_enumerator):
+            subsets = None
+
+            def __new__(cls, *args, **kwargs):
+                # compute_mcs calls from other threads that do not stream get the original enumerator
+                if threading.get_ident() != streaming_thread:
+                    return base_enumerator(*args, **kwargs)
+                return super().__new__(cls)
+
+            def enumerate_mcs(self, *args, model=None, **kwargs):
+                # the model passed here is the compressed network if network compression is used
+                if model is not None and hasattr(model.reactions[0], 'subset_rxns'):
+                    self.subsets = [[i for i in r.subset_rxns if intervenable[i]] for r in model.reactions]
+                    z_idx = {i: j for j, r in enumerate(model.reactions) for i in r.subset_rxns}
+                else:
+                    z_idx = {i: i for i in range(len(self.z_vars))}
+                for r in zero_cuts:
+                    if r in z_idx:
+                        self.z_vars[z_idx[r]].ub = 0
+                if required_cut is not None:
+                    if required_cut not in z_idx or self.z_vars[z_idx[required_cut]].ub == 0:
+                        return [], 0 # the required reaction cannot be cut, this subproblem has no solutions
+                    self.z_vars[z_idx[required_cut]].lb = 1
+                enum_info = {}
+                mcs, err_val = super().enumerate_mcs(*args, model=model, info=enum_info, **kwargs)
+                if info is not None:
+                    # the enumerator stops its loop when less than half a second of the time limit is left
+                    timeout = kwargs.get('timeout')
+                    info['truncated'] = len(mcs) >= kwargs.get('max_mcs_num', float('inf')) or \
+                        (timeout is not None and (enum_info.get('optlang_status') == 'time_limit'
+                                                  or enum_info.get('time', 0) >= timeout - 0.5))
+                return mcs, err_val
+
+            def add_exclusion_constraint(self, mcs):
+                super().add_exclusion_constraint(mcs)
+                if self.subsets is None:
+                    solution_callback([tuple(sorted(mcs))])
+                else:
+                    solution_callback(_expand_cut_set(mcs, self.subsets))
+                if abort_callback is not None and abort_callback():
+                    raise MCSEnumerationAborted()
+
+        # compute_mcs creates its enumerator through the module attribute
+        cMCS_enumerator.ConstrainedMinimalCutSetsEnumerator = StreamingEnumerator
+        try:
+            return mcs_computation.compute_mcs(model, **kwargs)
+        finally:
+            cMCS_enumerator.ConstrainedMinimalCutSetsEnumerator = base_enumerator
+
+
+def minimal_cut_sets(mcs: List[Tuple[int]], reac_id: List[str]) -> List[Tuple[int]]:
+    # removes duplicates and all cut sets that are a proper superset of another one, sorted by cardinality
+    return list(FluxVectorCutSets.from_cut_sets(mcs, reac_id).minimal().cut_sets())
+
+
+def split_cut_subproblems(split_idx: List[int]):
+    '''
+    Partitions the MCS enumeration on the split reactions s_0, ..., s_k-1: subproblem i contains the
+    cut sets in which s_0, ..., s_i-1 are not cut and s_i is cut, the last subproblem those without
+    any of the split reactions. Returns a list of (reactions not to cut, required cut) tuples,
+    the required cut of the last subproblem is None.
+    '''
+    return [(split_idx[:i], split_idx[i] if i < len(split_idx) else None) for i in range(len(split_idx) + 1)]
+
+
+class _QueueWriter:
+    # redirects the printed output of a subproblem to the progress queue
+    def __init__(self, sub_idx, result_queue):
+        self.sub_idx = sub_idx
+        self.result_queue = result_queue
+
+    def write(self, text):
+        if len(text.strip()) > 0:
+            self.result_queue.put(('text', self.sub_idx, text.strip()))
+
+    def flush(self):
+        pass
+
+
+def _enumerate_mcs_subproblem(model_dict, solver, tolerance, mcs_setup, zero_cuts, required_cut,
+                              sub_idx, result_queue, abort_event):
+    # runs in a separate process with its own copy of the model and solver instance
+    writer = _QueueWriter(sub_idx, result_queue)
+    with redirect_stdout(writer), redirect_stderr(writer):
+        try:
+            model = cobra.io.model_from_dict(model_dict)
+            model.solver = solver
+            model.tolerance = tolerance
+            if mcs_setup.get('results_cache_dir') is not None:
+                model.set_reaction_hashes()
+                model.set_stoichiometry_hash_object()
+            info = {}
+            mcs, err_val = streaming_compute_mcs(model, lambda m: result_queue.put(('found', sub_idx, m)),
+                                                 abort_event.is_set, zero_cuts=zero_cuts, required_cut=required_cut,
+                                                 info=info, **mcs_setup)
+            result_queue.put(('done', sub_idx, (mcs, err_val, info['truncated'])))
+        except MCSEnumerationAborted:
+            pass
+        except Exception as e:
+            result_queue.put(('error', sub_idx, (e, traceback.format_exc())))
+
+
+def parallel_compute_mcs(model: cobra.Model, split_idx: List[int], processes: int,
+                         solution_callback: Callable[[List[Tuple[int]]], None] = None,
+                         abort_callback: Callable[[], bool] = None, print_progress_function=print, **kwargs):
+    '''
+    Enumerates the cut sets of the subproblems defined by split_cut_subproblems in up to 'processes'
+    worker processes at the same time, each with its own solver instance, and merges their results
+    with minimal_cut_sets. A cut set that is minimal within its subproblem can contain a cut set of a
+    later subproblem, therefore the merged result is only complete and minimal when all subproblems
+    have been solved. Cut sets are passed to solution_callback as they are found.
+    Takes the same keyword arguments as mcs_computation.compute_mcs and returns (mcs, err_val);
+    max_mcs_num and the time limit apply to each subproblem. If a subproblem stops at one of them the
+    cut sets it did not find can be contained in those of the other subproblems, err_val is then
+    TRUNCATED_SUBPROBLEM because the merged cut sets may be incomplete and not minimal. When abort_callback returns True MCSEnumerationAborted is raised, its mcs attribute contains the
+    cut sets found so far after removing those that are supersets of others.
+    '''
+    subproblems = split_cut_subproblems(split_idx)
+    processes = max(1, min(processes, len(subproblems)))
+    model_dict = cobra.io.model_to_dict(model)
+    solver = interface_to_str(model.problem)
+    ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+    result_queue = ctx.Queue()
+    abort_event = ctx.Event()
+    pending = list(range(len(subproblems)))
+    running = {}
+    found = []
+    results = {}
+    error = None
+    stopped = False
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < processes:
+            i = pending.pop(0)
+            zero_cuts, required_cut = subproblems[i]
+            running[i] = ctx.Process(target=_enumerate_mcs_subproblem, daemon=True,
+                                     args=(model_dict, solver, model.tolerance, kwargs, zero_cuts, required_cut,
+                                           i, result_queue, abort_event))
+            running[i].start()
+            print_progress_function("Started subproblem "+str(i+1)+" of "+str(len(subproblems))+".")
+        # processes that have ended have put all their messages into the queue before
+        ended = [i for i, process in running.items() if not process.is_alive()]
+        try:
+            timeout = 0.5 if len(ended) == 0 else 0
+            while True:
+                kind, i, value = result_queue.get(timeout=timeout)
+                timeout = 0
+                if kind == 'text':
+                    print_progress_function("["+str(i+1)+"] "+value)
+                elif kind == 'found':
+                    found.extend(value)
+                    if solution_callback is not None:
+                        solution_callback(value)
+                elif kind == 'done':
+                    results[i] = value
+                else:
+                    error = value
+        except queue.Empty:
+            pass
+        for i in ended:
+            running.pop(i).join()
+            if i in results:
+                print_progress_function("Finished subproblem "+str(i+1)+" of "+str(len(subproblems))+".")
+            elif error is None:
+                error = (RuntimeError("Subproblem "+str(i+1)+" of the MCS computation failed."), "")
+        if error is not None:
+            break
+        if abort_callback is not None and abort_callback():
+            stopped = True
+            break
+    if error is not None or stopped:
+        abort_event.set() # the remaining subproblems stop after their next cut set
+        for process in running.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if error is not None:
+            print_progress_function(error[1])
+            raise error[0]
+        aborted = MCSEnumerationAborted()
+        aborted.mcs = minimal_cut_sets(found, model.reactions.list_attr('id'))
+        raise aborted
+
+    mcs = minimal_cut_sets(itertools.chain.from_iterable(m for m, _, _ in results.values()),
+                           model.reactions.list_attr('id'))
+    max_mcs_num = kwargs.get('max_mcs_num', float('inf'))
+    if len(mcs) > max_mcs_num:
+        mcs = mcs[:int(max_mcs_num)]
+    err_vals = [e for _, e, _ in results.values() if e != 0]
+    truncated = [i for i, (_, _, t) in results.items() if t]
+    if 1 in err_vals:
+        err_val = 1
+    elif len(err_vals) > 0:
+        err_val = err_vals[0]
+    elif len(truncated) > 0:
+        err_val = TRUNCATED_SUBPROBLEM
+        print_progress_function("Subproblem(s) "+", ".join(str(i+1) for i in sorted(truncated))+
+                                " stopped at the maximal number of cut sets or the time limit.")
+    else:
+        err_val = 0
+    print_progress_function("Merged the cut sets of "+str(len(subproblems))+" subproblems.")
+    return mcs, err_val
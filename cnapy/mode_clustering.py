@@ -0,0 +1,129 @@
+"""Clustering of large mode sets by the similarity of their supports with MinHash signatures and LSH"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import scipy.sparse
+
+# signature value of a mode without any active reaction
+_EMPTY_SUPPORT = numpy.iinfo(numpy.uint32).max
+
+
+def _chunk_signatures(block, hash_values: numpy.ndarray) -> numpy.ndarray:
+    # MinHash signatures of the rows of a block: the minimum of each hash function over the support
+    block = scipy.sparse.csr_matrix(block)
+    block.eliminate_zeros()
+    signatures = numpy.full((block.shape[0], hash_values.shape[1]), _EMPTY_SUPPORT, dtype=numpy.uint32)
+    nonempty = numpy.diff(block.indptr) > 0
+    if numpy.any(nonempty):
+        values = hash_values[block.indices, :]
+        starts = block.indptr[:-1][nonempty]
+        signatures[nonempty, :] = numpy.minimum.reduceat(values, starts - block.indptr[0], axis=0)
+    return signatures
+
+
+def minhash_signatures(modes, num_hashes=32, chunk_size=4096, threads=1, seed=0) -> numpy.ndarray:
+    '''
+    Returns an (n x num_hashes) uint32 matrix with the MinHash signatures of the mode supports. Each hash
+    function assigns a random value to every reaction, so the fraction of equal signature entries of two
+    modes estimates the Jaccard similarity of their supports. The modes are read chunk by chunk so that
+    memory mapped mode sets are never loaded completely; the chunks are processed by 'threads' threads
+    (numpy releases the GIL in the reductions).
+    '''
+    rng = numpy.random.default_rng(seed)
+    hash_values = rng.integers(0, _EMPTY_SUPPORT, size=(len(modes.reac_id), num_hashes), dtype=numpy.uint32)
+    signatures = numpy.empty((len(modes), num_hashes), dtype=numpy.uint32)
+    if threads <= 1:
+        for start, block in modes.iter_chunks(chunk_size):
+            signatures[start:start+block.shape[0], :] = _chunk_signatures(block, hash_values)
+        return signatures
+
+    def store(start, block):
+        signatures[start:start+block.shape[0], :] = _chunk_signatures(block, hash_values)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = []
+        for start, block in modes.iter_chunks(chunk_size):
+            pending.append(executor.submit(store, start, block))
+            if len(pending) >= 2*threads: # limits the number of chunks that are held in memory
+                pending.pop(0).result()
+        for p in pending:
+            p.result()
+    return signatures
+
+
+def band_keys(signatures: numpy.ndarray, bands: int) -> numpy.ndarray:
+    # one 64 bit key per band of consecutive signature entries; modes with an equal key are LSH candidates
+    n, num_hashes = signatures.shape
+    rows = num_hashes // bands
+    multipliers = numpy.random.default_rng(1).integers(1, 2**63, size=rows, dtype=numpy.uint64) | numpy.uint64(1)
+    keys = numpy.zeros((n, bands), dtype=numpy.uint64)
+    with numpy.errstate(over='ignore'): # the keys are computed modulo 2**64
+        for j in range(rows):
+            keys ^= signatures[:, j::rows][:, :bands].astype(numpy.uint64) * multipliers[j]
+            keys = (keys << numpy.uint64(7)) | (keys >> numpy.uint64(57))
+    return keys
+
+
+class ModeClusters:
+    '''
+    The result of cluster_modes: the cluster of each mode, one representative mode per cluster and the
+    cluster sizes; clusters are ordered by decreasing size
+    '''
+
+    def __init__(self, labels: numpy.ndarray, representatives: numpy.ndarray, sizes: numpy.ndarray):
+        self.labels = labels
+        self.representatives = representatives
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def members(self, cluster: int) -> numpy.ndarray:
+        return numpy.nonzero(self.labels == cluster)[0]
+
+
+def cluster_modes(modes, threshold=0.7, num_hashes=32, bands=8, chunk_size=4096, threads=1,
+                  signatures=None) -> ModeClusters:
+    '''
+    Groups the modes so that the estimated Jaccard similarity of the support of each mode to the
+    representative of its cluster is at least threshold. Modes with identical signatures are merged first;
+    the distinct signatures are then assigned in order of decreasing multiplicity to the most similar
+    representative among their LSH candidates or become a new representative. Only candidates that share
+    a band key are compared so that the running time is close to linear in the number of modes.
+    '''
+    if signatures is None:
+        signatures = minhash_signatures(modes, num_hashes=num_hashes, chunk_size=chunk_size, threads=threads)
+    n = signatures.shape[0]
+    if n == 0:
+        return ModeClusters(numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0, dtype=numpy.int64),
+                            numpy.zeros(0, dtype=numpy.int64))
+    signatures = numpy.ascontiguousarray(signatures)
+    rows = signatures.view(numpy.dtype((numpy.void, signatures.dtype.itemsize * signatures.shape[1]))).ravel()
+    _, first, inverse, counts = numpy.unique(rows, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    unique_signatures = signatures[first, :]
+    keys = band_keys(unique_signatures, min(bands, signatures.shape[1])).tolist()
+    buckets = [dict() for _ in range(len(keys[0]))]
+    leader = numpy.empty(len(first), dtype=numpy.int64)
+    for u in numpy.argsort(-counts, kind='stable'):
+        candidates = set()
+        for bucket, key in zip(buckets, keys[u]):
+            candidates.update(bucket.get(key, ()))
+        best = -1
+        if len(candidates) > 0:
+            candidates = numpy.fromiter(candidates, dtype=numpy.int64, count=len(candidates))
+            similarity = numpy.mean(unique_signatures[candidates, :] == unique_signatures[u, :], axis=1)
+            i = numpy.argmax(similarity)
+            if similarity[i] >= threshold:
+                best = candidates[i]
+        if best < 0:
+            best = u
+            for bucket, key in zip(buckets, keys[u]):
+                bucket.setdefault(key, []).append(u)
+        leader[u] = best
+    leaders, cluster_of_unique = numpy.unique(leader, return_inverse=True)
+    sizes = numpy.bincount(cluster_of_unique.ravel(), weights=counts, minlength=len(leaders)).astype(numpy.int64)
+    order = numpy.argsort(-sizes, kind='stable')
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    labels = rank[cluster_of_unique.ravel()][inverse].astype(numpy.int32)
+    return ModeClusters(labels, first[leaders[order]], sizes[order])
@@ -0,0 +1,132 @@
+"""Index structures for fast selection and statistics on large mode sets"""
+import numpy
+import scipy.sparse
+
+# number of set bits for every possible byte value
+_POPCOUNT_TABLE = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+
+def popcount_rows(words: numpy.ndarray, chunk_size=100000) -> numpy.ndarray:
+    # number of set bits in each row of a uint64 matrix
+    counts = numpy.zeros(words.shape[0], dtype=numpy.int64)
+    for start in range(0, words.shape[0], chunk_size):
+        block = numpy.ascontiguousarray(words[start:start+chunk_size, :])
+        counts[start:start+block.shape[0]] = _POPCOUNT_TABLE[block.view(numpy.uint8)].sum(axis=1, dtype=numpy.int64)
+    return counts
+
+
+class SupportIndex:
+    '''
+    The supports of a mode set as packed bitsets: one uint64 word per 64 reactions per mode
+    where bit r % 64 of word r // 64 is set when reaction r has non-zero flux
+    '''
+
+    def __init__(self, words: numpy.ndarray, num_reac: int):
+        self.words = words
+        self.num_reac = num_reac
+
+    @classmethod
+    def from_modes(cls, modes, chunk_size=10000):
+        num_reac = len(modes.reac_id)
+        num_words = (num_reac + 63) // 64
+        words = numpy.zeros((len(modes), num_words), dtype='<u8')
+        for start, block in modes.iter_chunks(chunk_size):
+            if scipy.sparse.issparse(block):
+                block = block.toarray()
+            nz = numpy.zeros((block.shape[0], num_words * 64), dtype=bool)
+            nz[:, :num_reac] = block != 0
+            words[start:start+block.shape[0], :] = numpy.packbits(nz, axis=1, bitorder='little').view('<u8')
+        return cls(words, num_reac)
+
+    def __len__(self):
+        return self.words.shape[0]
+
+    def reactions_mask(self, reac_idx) -> numpy.ndarray:
+        # a single row of words in which the bits of the given reactions are set
+        mask = numpy.zeros(self.words.shape[1], dtype='<u8')
+        for r in reac_idx:
+            mask[r // 64] |= numpy.uint64(1) << numpy.uint64(r % 64)
+        return mask
+
+    def reaction_occurs(self, r: int) -> numpy.ndarray:
+        return (self.words[:, r // 64] >> numpy.uint64(r % 64)) & numpy.uint64(1) == 1
+
+    def select(self, must_occur=(), must_not_occur=()) -> numpy.ndarray:
+        # boolean array of the modes that contain all reactions in must_occur and none of those in must_not_occur
+        selection = numpy.ones(len(self), dtype=bool)
+        must_mask = self.reactions_mask(must_occur)
+        must_not_mask = self.reactions_mask(must_not_occur)
+        for w in numpy.nonzero(must_mask | must_not_mask)[0]: # only the words that are affected
+            column = self.words[:, w]
+            if must_mask[w]:
+                selection &= (column & must_mask[w]) == must_mask[w]
+            if must_not_mask[w]:
+                selection &= (column & must_not_mask[w]) == 0
+        return selection
+
+    def sizes(self, selection=None) -> numpy.ndarray:
+        # support sizes of the (selected) modes
+        if selection is None:
+            if getattr(self, '_sizes', None) is None:
+                self._sizes = popcount_rows(self.words)
+            return self._sizes
+        return popcount_rows(self.words[selection, :])
+
+    def participation(self, selection=None, chunk_size=10000) -> numpy.ndarray:
+        # in how many of the (selected) modes each reaction occurs
+        words = self.words if selection is None else self.words[selection, :]
+        counts = numpy.zeros(self.words.shape[1] * 64, dtype=numpy.int64)
+        for start in range(0, words.shape[0], chunk_size):
+            block = numpy.ascontiguousarray(words[start:start+chunk_size, :]).view(numpy.uint8)
+            counts += numpy.unpackbits(block, axis=1, bitorder='little').sum(axis=0, dtype=numpy.int64)
+        return counts[:self.num_reac]
+
+
+class InvertedModeIndex:
+    '''
+    For each reaction the sorted IDs of the modes in which it has non-zero flux together with the sign
+    of the flux (a CSC layout of the mode supports); queries on reactions are then answered by set
+    operations on these ID lists without touching the flux vectors
+    '''
+
+    def __init__(self, mode_ids: numpy.ndarray, positive: numpy.ndarray, indptr: numpy.ndarray, num_modes: int):
+        self.mode_ids = mode_ids # mode IDs ordered by reaction, ascending for each reaction
+        self.positive = positive # whether the corresponding flux is positive
+        self.indptr = indptr # the entries of reaction r are mode_ids[indptr[r]:indptr[r+1]]
+        self.num_modes = num_modes
+
+    @classmethod
+    def from_modes(cls, modes, chunk_size=10000):
+        num_reac = len(modes.reac_id)
+        id_type = numpy.int32 if len(modes) < 2**31 else numpy.int64
+        rows, cols, positive = [], [], []
+        for start, block in modes.iter_chunks(chunk_size):
+            block = scipy.sparse.coo_matrix(block)
+            rows.append(block.row.astype(id_type) + start)
+            cols.append(block.col)
+            positive.append(block.data > 0)
+        if len(rows) > 0:
+            rows, cols, positive = numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(positive)
+        else:
+            rows, cols, positive = numpy.zeros(0, dtype=id_type), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=bool)
+        # lexsort by reaction, then mode ID
+        order = numpy.lexsort((rows, cols))
+        indptr = numpy.zeros(num_reac + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(cols, minlength=num_reac), out=indptr[1:])
+        return cls(rows[order], positive[order], indptr, len(modes))
+
+    def reaction_mode_ids(self, r: int, sign: int = 0) -> numpy.ndarray:
+        # sorted IDs of the modes in which reaction r occurs (with the given sign if sign != 0)
+        ids = self.mode_ids[self.indptr[r]:self.indptr[r+1]]
+        if sign > 0:
+            return ids[self.positive[self.indptr[r]:self.indptr[r+1]]]
+        elif sign < 0:
+            return ids[~self.positive[self.indptr[r]:self.indptr[r+1]]]
+        else:
+            return ids
+
+    def mode_mask(self, r: int, sign: int = 0) -> numpy.ndarray:
+        # the mode IDs of reaction r as a bitmap over all modes
+        mask = numpy.zeros(self.num_modes, dtype=bool)
+        mask[self.reaction_mode_ids(r, sign)] = True
+        return mask
@@ -0,0 +1,193 @@
+"""A boolean query language for selecting modes
+
+Examples:
+    PGK, !PYK                       PGK occurs and PYK does not occur (the original selector syntax)
+    (PGK | PFK) & NOT EX_o2_e       AND/OR/NOT can be written as words or as &, | and !
+    EX_ac_e > 0 and size <= 10      sign conditions on reactions and support-size ranges
+    size = 5..8                     modes with 5 to 8 active reactions
+"""
+import re
+from typing import List, Tuple
+import numpy
+
+from cnapy.mode_index import InvertedModeIndex
+
+
+class ModeQueryError(ValueError):
+    pass
+
+
+_DELIMITERS = set(",&|!()<>=")
+_COMPARISONS = ("<=", ">=", "==", "!=", "<", ">", "=")
+_NUMBER = re.compile(r"\d+")
+
+
+class ModeQuery:
+    '''
+    Parses a query into a small expression tree of tuples:
+    ('and', a, b), ('or', a, b), ('not', a), ('reaction', index, sign) and ('size', min, max)
+    '''
+
+    def __init__(self, text: str, reac_id: List[str]):
+        self.text = text
+        self.reac_id = reac_id
+        self._reac_index = {r: i for i, r in enumerate(reac_id)}
+        self._tokens = self._tokenize(text)
+        self._pos = 0
+        if len(self._tokens) == 0:
+            raise ModeQueryError("The query is empty.")
+        self.tree = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise ModeQueryError("Unexpected '"+self._tokens[self._pos][1]+"' in query.")
+
+    def _tokenize(self, text: str) -> List[Tuple[str, str]]:
+        tokens = []
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c.isspace():
+                i += 1
+            elif c in "()":
+                tokens.append((c, c))
+                i += 1
+            elif c in ",&":
+                tokens.append(("and", c))
+                i += 1
+            elif c == "|":
+                tokens.append(("or", c))
+                i += 1
+            elif text.startswith("..", i):
+                tokens.append(("..", ".."))
+                i += 2
+            elif any(text.startswith(op, i) for op in _COMPARISONS):
+                op = next(op for op in _COMPARISONS if text.startswith(op, i))
+                tokens.append(("cmp", op))
+                i += len(op)
+            elif c == "!":
+                tokens.append(("not", c))
+                i += 1
+            elif c == "#":
+                tokens.append(("size", c))
+                i += 1
+            else:
+                j = i
+                while j < len(text) and not text[j].isspace() and text[j] not in _DELIMITERS \
+                        and not text.startswith("..", j):
+                    j += 1
+                # reaction IDs may contain parentheses, e.g. EX_glc(e)
+                while j < len(text) and text[j] == "(":
+                    close = text.find(")", j)
+                    if close < 0 or not any(r.startswith(text[i:close+1]) for r in self.reac_id):
+                        break
+                    j = close + 1
+                    while j < len(text) and not text[j].isspace() and text[j] not in _DELIMITERS:
+                        j += 1
+                word = text[i:j]
+                i = j
+                if word in self._reac_index:
+                    tokens.append(("id", word))
+                elif word.lower() in ("and", "or", "not"):
+                    tokens.append((word.lower(), word))
+                elif word.lower() == "size":
+                    tokens.append(("size", word))
+                elif _NUMBER.fullmatch(word):
+                    tokens.append(("number", word))
+                else:
+                    raise ModeQueryError("Unknown reaction '"+word+"' in query.")
+        return tokens
+
+    def _peek(self) -> str:
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos][0]
+        return None
+
+    def _next(self, expected: str = None) -> Tuple[str, str]:
+        if self._pos >= len(self._tokens):
+            raise ModeQueryError("The query ends unexpectedly.")
+        token = self._tokens[self._pos]
+        if expected is not None and token[0] != expected:
+            raise ModeQueryError("Expected "+expected+" but found '"+token[1]+"' in query.")
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self._peek() == "or":
+            self._next()
+            node = ("or", node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self._peek() == "and":
+            self._next()
+            node = ("and", node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self._peek() == "not":
+            self._next()
+            return ("not", self._parse_not())
+        return self._parse_atom()
+
+    def _parse_atom(self):
+        kind = self._peek()
+        if kind == "(":
+            self._next()
+            node = self._parse_or()
+            self._next(")")
+            return node
+        elif kind == "size":
+            self._next()
+            op = self._next("cmp")[1]
+            low = int(self._next("number")[1])
+            if self._peek() == "..":
+                if op not in ("=", "=="):
+                    raise ModeQueryError("A size range must be written as size = min..max")
+                self._next()
+                return ("size", low, int(self._next("number")[1]))
+            bounds = {"=": (low, low), "==": (low, low), "<=": (0, low), "<": (0, low - 1),
+                      ">=": (low, None), ">": (low + 1, None)}
+            if op not in bounds:
+                raise ModeQueryError("Use =, <, <=, > or >= in size conditions.")
+            return ("size",) + bounds[op]
+        elif kind == "id":
+            reac_idx = self._reac_index[self._next()[1]]
+            if self._peek() == "cmp":
+                op = self._next()[1]
+                if self._next("number")[1] != "0":
+                    raise ModeQueryError("Reactions can only be compared with 0.")
+                if op == ">":
+                    return ("reaction", reac_idx, 1)
+                elif op == "<":
+                    return ("reaction", reac_idx, -1)
+                elif op in ("=", "=="):
+                    return ("not", ("reaction", reac_idx, 0))
+                elif op == "!=":
+                    return ("reaction", reac_idx, 0)
+                else:
+                    raise ModeQueryError("Use >, <, = or != to compare reactions with 0.")
+            return ("reaction", reac_idx, 0)
+        elif kind is None:
+            raise ModeQueryError("The query ends unexpectedly.")
+        else:
+            raise ModeQueryError("Unexpected '"+self._tokens[self._pos][1]+"' in query.")
+
+    def evaluate(self, index: InvertedModeIndex, sizes: numpy.ndarray = None) -> numpy.ndarray:
+        # sizes are only needed when the query contains size conditions
+        return self._evaluate(self.tree, index, sizes)
+
+    def _evaluate(self, node, index: InvertedModeIndex, sizes: numpy.ndarray) -> numpy.ndarray:
+        if node[0] == "and":
+            return self._evaluate(node[1], index, sizes) & self._evaluate(node[2], index, sizes)
+        elif node[0] == "or":
+            return self._evaluate(node[1], index, sizes) | self._evaluate(node[2], index, sizes)
+        elif node[0] == "not":
+            return ~self._evaluate(node[1], index, sizes)
+        elif node[0] == "reaction":
+            return index.mode_mask(node[1], node[2])
+        else: # size
+            selection = sizes >= node[1]
+            if node[2] is not None:
+                selection &= sizes <= node[2]
+            return selection
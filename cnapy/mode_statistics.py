@@ -0,0 +1,55 @@
+"""Vectorized evaluation of linear expressions, yields and ratios over whole mode sets"""
+from typing import Dict, List
+import numpy
+import scipy.sparse
+
+
+def coefficient_matrix(expressions: List[Dict[str, float]], reac_id: List[str]) -> numpy.ndarray:
+    # one column of reaction coefficients per linear expression given as {reaction ID: coefficient}
+    reac_index = {r: i for i, r in enumerate(reac_id)}
+    coefficients = numpy.zeros((len(reac_id), len(expressions)))
+    for j, expression in enumerate(expressions):
+        for r, c in expression.items():
+            if r not in reac_index:
+                raise ValueError("Reaction '"+r+"' is not part of the modes.")
+            coefficients[reac_index[r], j] += c
+    return coefficients
+
+
+def evaluate_linear_expressions(modes, expressions: List[Dict[str, float]], selection=None,
+                                chunk_size=None) -> numpy.ndarray:
+    '''
+    Returns a matrix with one row per (selected) mode and one column per expression. The flux vectors are
+    multiplied chunk by chunk with the coefficient matrix so that memory mapped and chunked mode sets
+    are never loaded completely; sparse chunks are multiplied as sparse matrices.
+    '''
+    coefficients = coefficient_matrix(expressions, modes.reac_id)
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(len(modes.reac_id), 1)) # 32 MB of doubles per dense chunk
+    # only the columns of the reactions that occur in the expressions are needed
+    used = numpy.nonzero(numpy.any(coefficients != 0, axis=1))[0]
+    coefficients = coefficients[used, :]
+    values = numpy.empty((len(modes), len(expressions)))
+    for start, block in modes.iter_chunks(chunk_size):
+        if scipy.sparse.issparse(block):
+            values[start:start+block.shape[0], :] = scipy.sparse.csr_matrix(block)[:, used].dot(coefficients)
+        else:
+            values[start:start+block.shape[0], :] = numpy.asarray(block[:, used], dtype=float).dot(coefficients)
+    if selection is not None:
+        values = values[selection, :]
+    return values
+
+
+def mode_yields(modes, numerator: Dict[str, float], denominator: Dict[str, float], selection=None,
+                chunk_size=None):
+    '''
+    Returns the arrays (numerator, denominator, yield) for all (selected) modes;
+    the yield is NaN where the denominator is 0.
+    '''
+    values = evaluate_linear_expressions(modes, [numerator, denominator], selection=selection, chunk_size=chunk_size)
+    num = values[:, 0]
+    den = values[:, 1]
+    yields = numpy.full(len(num), numpy.nan)
+    nonzero = den != 0
+    yields[nonzero] = num[nonzero] / den[nonzero]
+    return num, den, yields
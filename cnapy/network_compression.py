@@ -0,0 +1,130 @@
+"""Lossless network compression with an exact mapping of compressed flux vectors back to the original reactions"""
+import hashlib
+from collections import OrderedDict
+from typing import List
+import numpy
+import scipy.sparse
+
+
+class CompressedNetwork:
+    '''
+    The result of compress_network: the compressed stoichiometric matrix and reversibilities together
+    with the expansion matrix that maps a compressed flux vector v_c to the original one as expansion @ v_c
+    '''
+
+    def __init__(self, stoich: numpy.ndarray, reversible: numpy.ndarray, expansion: scipy.sparse.csr_matrix,
+                 metabolites: numpy.ndarray, blocked: numpy.ndarray):
+        self.stoich = stoich
+        self.reversible = reversible
+        self.expansion = expansion # original reactions x compressed reactions
+        self.metabolites = metabolites # indices of the metabolites that remain in the compressed network
+        self.blocked = blocked # indices of the original reactions that cannot carry steady-state flux
+
+    @property
+    def num_reactions(self) -> int:
+        return self.stoich.shape[1]
+
+    def compressed_reactions(self, reac_idx) -> List[int]:
+        # the compressed reactions into which the given original reactions were lumped
+        return sorted(set(self.expansion[reac_idx, :].indices.tolist()))
+
+    def expand(self, fluxes) -> numpy.ndarray:
+        # fluxes has one compressed flux vector per row, the result has one original flux vector per row
+        if scipy.sparse.issparse(fluxes):
+            return (fluxes @ self.expansion.T).toarray()
+        return numpy.asarray(self.expansion @ numpy.asarray(fluxes, dtype=float).T).T
+
+
+def compress_network(st: numpy.ndarray, reversible, tolerance=1e-12) -> CompressedNetwork:
+    '''
+    Repeats these steps until none of them applies any more:
+    - a metabolite that occurs in only one reaction blocks this reaction (dead end)
+    - a metabolite that only irreversible reactions produce (or only consume) blocks all of them
+    - a metabolite that occurs in exactly two reactions couples their fluxes, the second reaction
+      is lumped into the first one; if the lumped reaction can only run backwards its direction is inverted
+    Metabolites that no longer occur in any reaction are removed. Because all steps only use
+    steady-state conditions the EFMs of the compressed network expand to the EFMs of the original one.
+    '''
+    st = numpy.array(st.toarray() if scipy.sparse.issparse(st) else st, dtype=float)
+    num_met, num_reac = st.shape
+    reversible = numpy.array(reversible, dtype=bool)
+    active = numpy.ones(num_reac, dtype=bool)
+    # for each compressed reaction (indexed by its first original reaction) the factors of the original reactions
+    mapping = [{r: 1.0} for r in range(num_reac)]
+    blocked = []
+
+    def block(cols):
+        for c in cols:
+            blocked.extend(mapping[c].keys())
+            active[c] = False
+            st[:, c] = 0
+
+    changed = True
+    while changed:
+        changed = False
+        for m in range(num_met):
+            cols = numpy.nonzero(st[m, :])[0]
+            if len(cols) == 0:
+                continue
+            coeff = st[m, cols]
+            if len(cols) == 1:
+                block(cols)
+                changed = True
+            elif not numpy.any(reversible[cols]) and (numpy.all(coeff > 0) or numpy.all(coeff < 0)):
+                block(cols)
+                changed = True
+            elif len(cols) == 2:
+                a, b = cols
+                factor = -coeff[0]/coeff[1] # v_b = factor * v_a
+                # direction constraints on v_a from both reactions
+                forward = not reversible[a] or (not reversible[b] and factor > 0)
+                backward = not reversible[b] and factor < 0
+                if forward and backward:
+                    block(cols)
+                    changed = True
+                    continue
+                st[:, a] += factor * st[:, b]
+                st[m, a] = 0.0 # exactly balanced
+                st[numpy.abs(st[:, a]) <= tolerance * numpy.abs(st[:, a]).max(initial=0), a] = 0.0
+                for r, f in mapping[b].items():
+                    mapping[a][r] = mapping[a].get(r, 0.0) + factor * f
+                if backward: # the lumped reaction can only run backwards, invert it
+                    st[:, a] *= -1
+                    mapping[a] = {r: -f for r, f in mapping[a].items()}
+                reversible[a] = not (forward or backward)
+                active[b] = False
+                st[:, b] = 0
+                changed = True
+
+    cols = numpy.nonzero(active)[0]
+    metabolites = numpy.nonzero(numpy.any(st[:, cols] != 0, axis=1))[0]
+    rows, col_idx, data = [], [], []
+    for j, c in enumerate(cols):
+        for r, f in mapping[c].items():
+            rows.append(r)
+            col_idx.append(j)
+            data.append(f)
+    expansion = scipy.sparse.csr_matrix((data, (rows, col_idx)), shape=(num_reac, len(cols)))
+    return CompressedNetwork(st[numpy.ix_(metabolites, cols)], reversible[cols].astype(numpy.int32), expansion,
+                             metabolites, numpy.array(sorted(blocked), dtype=int))
+
+
+_compression_cache = OrderedDict()
+_COMPRESSION_CACHE_SIZE = 8
+
+
+def cached_compress_network(st: numpy.ndarray, reversible) -> CompressedNetwork:
+    # compress_network with the results of the last few networks kept per stoichiometry hash
+    st = numpy.ascontiguousarray(st.toarray() if scipy.sparse.issparse(st) else st, dtype=float)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(numpy.array(st.shape, dtype=numpy.int64).tobytes())
+    h.update(st.tobytes())
+    h.update(numpy.asarray(reversible, dtype=numpy.int64).tobytes())
+    key = h.digest()
+    if key in _compression_cache:
+        _compression_cache.move_to_end(key)
+    else:
+        _compression_cache[key] = compress_network(st, reversible)
+        if len(_compression_cache) > _COMPRESSION_CACHE_SIZE:
+            _compression_cache.popitem(last=False)
+    return _compression_cache[key]
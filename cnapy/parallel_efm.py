@@ -0,0 +1,128 @@
+"""EFM enumeration split by the directions of reversible reactions into efmtool runs in parallel processes"""
+import itertools
+import multiprocessing
+import os
+import queue
+from tempfile import TemporaryDirectory
+from typing import List
+import numpy
+
+import efmtool_link.efmtool_extern as efmtool_extern
+from cnapy.flux_vector_container import FluxVectorMemmap, FluxVectorMemmapWriter
+
+
+def split_subproblems(num_split: int):
+    '''
+    Partitions the EFM enumeration on num_split reversible split reactions s_0, ..., s_k-1 by their
+    directions: in each of the 2**k subproblems every s_i is made irreversible, either in forward (1)
+    or backward (-1) direction. The EFMs of such a subproblem are exactly the EFMs of the whole network
+    whose flux through each s_i has the given sign or is zero, so efmtool itself enumerates only the
+    EFMs of its orthant. An EFM in which some s_i carry no flux belongs to several orthants and is
+    only kept in the one where these s_i are forward. Returns a list of direction tuples.
+    '''
+    return list(itertools.product((1, -1), repeat=num_split))
+
+
+def _enumerate_subproblem(st, reversible, split_idx, directions, out_fname, max_threads,
+                          sub_idx, progress_queue, abort_event):
+    # runs in a separate process because efmtool_extern changes the working directory of the process
+    def print_progress(text):
+        progress_queue.put((sub_idx, text))
+
+    signs = numpy.ones(st.shape[1])
+    signs[split_idx] = directions
+    reversible = reversible.copy()
+    reversible[split_idx] = False # the split reactions are turned into the direction of this subproblem
+    work_dir = efmtool_extern.calculate_flux_modes(st * signs, reversible, return_work_dir_only=True,
+                                                   max_threads=max_threads, print_progress_function=print_progress,
+                                                   abort_callback=abort_event.is_set)
+    if work_dir is None:
+        raise SystemExit(1)
+    num_reac = st.shape[1]
+    part = FluxVectorMemmap('efms.bin', [None]*num_reac, containing_temp_dir=work_dir)
+    del work_dir
+    backward = [s for s, d in zip(split_idx, directions) if d < 0]
+    with FluxVectorMemmapWriter(out_fname, num_reac) as writer:
+        for _, block in part.iter_chunks(max(1, 2**22 // max(num_reac, 1))):
+            block = numpy.asarray(block, dtype=float)
+            # EFMs with zero flux through a backward split reaction are kept by the subproblem where it is forward
+            block = block[numpy.all(block[:, backward] != 0, axis=1), :]
+            writer.append(block * signs)
+    part.clear()
+
+
+def parallel_efm_computation(st: numpy.ndarray, reversible, split_idx: List[int], processes: int,
+                             print_progress_function=print, abort_callback=None):
+    '''
+    Enumerates the EFMs of the subproblems defined by split_subproblems for the reversible reactions in
+    split_idx (irreversible ones are ignored) in up to 'processes' efmtool runs at the same time and
+    concatenates their results in the file efms.bin of the returned temporary directory. The result is
+    in the same format as the efms.bin of efmtool itself, i.e. the reversible EFMs still appear in both
+    directions. Returns None if the computation was aborted or failed.
+    '''
+    num_reac = st.shape[1]
+    reversible = numpy.asarray(reversible, dtype=bool)
+    irreversible = [s for s in split_idx if not reversible[s]]
+    if len(irreversible) > 0:
+        print_progress_function(str(len(irreversible))+" irreversible split reaction(s) are ignored, "
+                                "only the directions of reversible reactions can be split.")
+    split_idx = sorted(set(s for s in split_idx if reversible[s]))
+    subproblems = split_subproblems(len(split_idx))
+    processes = max(1, min(processes, len(subproblems)))
+    max_threads = max(1, (os.cpu_count() or 1) // processes)
+    ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+    progress_queue = ctx.Queue()
+    abort_event = ctx.Event()
+    work_dir = TemporaryDirectory()
+    part_fnames = [os.path.join(work_dir.name, 'part'+str(i)+'.bin') for i in range(len(subproblems))]
+    pending = list(range(len(subproblems)))
+    running = {}
+    success = True
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < processes:
+            i = pending.pop(0)
+            running[i] = ctx.Process(target=_enumerate_subproblem, daemon=True,
+                                     args=(st, reversible, split_idx, subproblems[i], part_fnames[i], max_threads,
+                                           i, progress_queue, abort_event))
+            running[i].start()
+            print_progress_function("Started subproblem "+str(i+1)+" of "+str(len(subproblems))+".")
+        try:
+            i, text = progress_queue.get(timeout=0.5)
+            print_progress_function("["+str(i+1)+"] "+text)
+            while True:
+                i, text = progress_queue.get_nowait()
+                print_progress_function("["+str(i+1)+"] "+text)
+        except queue.Empty:
+            pass
+        if abort_callback is not None and abort_callback():
+            success = False
+            break
+        for i, process in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                del running[i]
+                if process.exitcode == 0:
+                    print_progress_function("Finished subproblem "+str(i+1)+" of "+str(len(subproblems))+".")
+                else:
+                    print_progress_function("Subproblem "+str(i+1)+" failed.")
+                    success = False
+        if not success:
+            break
+    if not success:
+        abort_event.set() # the efmtool runs of the remaining processes are stopped by their abort callback
+        for process in running.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        return None
+
+    with FluxVectorMemmapWriter(os.path.join(work_dir.name, 'efms.bin'), num_reac) as writer:
+        for fname in part_fnames:
+            part = FluxVectorMemmap(fname, [None]*num_reac)
+            for _, block in part.iter_chunks(max(1, 2**22 // max(num_reac, 1))):
+                writer.append(block)
+            part.clear()
+            del part
+            os.remove(fname)
+    print_progress_function("Merged the EFMs of "+str(len(subproblems))+" subproblems.")
+    return work_dir
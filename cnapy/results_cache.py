@@ -0,0 +1,222 @@
+"""A directory of cached computation results with an index, size and age limits and LRU eviction
+that can be shared by several CNApy processes"""
+import json
+import os
+import pickle
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+INDEX_FILE = "cnapy_results_cache_index.json"
+_LOCK_FILE = INDEX_FILE + ".lock"
+_TEMP_FILE_PREFIX = ".cnapy_results_cache_tmp"
+# files that are not in the index are only managed when they have one of these names: the FVA results and
+# compressed models that optlang_enumerator writes into the cache directory and older CNApy FVA results
+_FOREIGN_CACHE_FILE_NAME = re.compile(r"^(fva_|.*_FVA_|.*_subsets_compressed_)[0-9a-f]{32,128}$")
+_STALE_TEMP_FILE_SECONDS = 3600
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(fd):
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _unlock_file(fd):
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class ResultsCache:
+    '''
+    Stores results as files in directory and keeps an index with the size and time of last access of
+    each entry together with the hit and miss counts. The index is only changed while holding an
+    operating system lock on a lock file and result files are written under a temporary name and then
+    renamed, therefore several processes can use the same directory. When an entry is saved the entries
+    that have not been accessed for max_age_days are removed and then the least recently used ones until
+    the total size is at most max_size_mb. The FVA results and compressed models that optlang_enumerator
+    writes into the directory are added to the index when the limits are enforced; other files that are
+    not in the index are never touched. A value of 0 for max_size_mb or max_age_days means no limit.
+    '''
+
+    def __init__(self, directory: Path, max_size_mb=1000, max_age_days=30, lock_timeout=10.0):
+        self.directory = Path(directory)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_age = max_age_days * 24 * 3600
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def key(prefix: str, hash_object, *parts) -> str:
+        # name of the entry for a copy of hash_object (e.g. CNApyModel.stoichiometry_hash_object) updated with parts
+        hash_object = hash_object.copy()
+        for p in parts:
+            hash_object.update(p if isinstance(p, bytes) else pickle.dumps(p))
+        return prefix + "_" + hash_object.hexdigest()
+
+    def path(self, name: str) -> Path:
+        return self.directory / name
+
+    @contextmanager
+    def _locked_index(self):
+        # yields the index which is written back afterwards, or None if the lock could not be acquired;
+        # the lock is held by the operating system which releases it when the process terminates
+        try:
+            fd = os.open(self.directory / _LOCK_FILE, os.O_CREAT | os.O_RDWR)
+        except OSError:
+            yield None
+            return
+        try:
+            start = time.time()
+            locked = False
+            while not locked:
+                try:
+                    _lock_file(fd)
+                    locked = True
+                except OSError:
+                    if time.time() - start > self.lock_timeout:
+                        break
+                    time.sleep(0.05)
+            if not locked:
+                yield None
+                return
+            try:
+                index = self._read_index()
+                yield index
+                self._write_index(index)
+            finally:
+                _unlock_file(fd)
+        finally:
+            os.close(fd)
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.directory / INDEX_FILE, "r") as fp:
+                index = json.load(fp)
+            if isinstance(index.get('entries'), dict):
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'entries': {}, 'hits': 0, 'misses': 0}
+
+    def _write_index(self, index: dict):
+        temp_file = self.path(_TEMP_FILE_PREFIX + str(os.getpid()) + "_" + INDEX_FILE)
+        with open(temp_file, "w") as fp:
+            json.dump(index, fp)
+        os.replace(temp_file, self.directory / INDEX_FILE)
+
+    def load(self, name: str, load_function: Callable = None):
+        '''
+        Returns the cached result or None if there is none; by default the file is unpickled,
+        load_function receives the file path instead
+        '''
+        result = None
+        try:
+            if load_function is None:
+                with open(self.path(name), "rb") as fp:
+                    result = pickle.load(fp)
+            else:
+                result = load_function(self.path(name))
+        except Exception: # missing (e.g. evicted by another process) or unreadable
+            pass
+        with self._locked_index() as index:
+            if index is not None:
+                if result is None:
+                    index['misses'] += 1
+                    index['entries'].pop(name, None)
+                else:
+                    index['hits'] += 1
+                    self._touch(index, name)
+        return result
+
+    def save(self, name: str, result, save_function: Callable = None) -> bool:
+        '''
+        Stores the result (pickled by default, save_function receives the result and the file path
+        instead) and then enforces the limits; returns whether the result could be written
+        '''
+        temp_file = self.path(_TEMP_FILE_PREFIX + str(os.getpid()) + "_" + name)
+        try:
+            if save_function is None:
+                with open(temp_file, "wb") as fp:
+                    pickle.dump(result, fp)
+            else:
+                save_function(result, temp_file)
+            os.replace(temp_file, self.path(name))
+        except Exception:
+            temp_file.unlink(missing_ok=True)
+            return False
+        self.register(name)
+        return True
+
+    def register(self, name: str):
+        # adds a result that was written directly to path(name) and enforces the limits
+        with self._locked_index() as index:
+            if index is not None:
+                self._touch(index, name)
+                self._evict(index)
+
+    def _touch(self, index: dict, name: str):
+        try:
+            index['entries'][name] = {'size': self.path(name).stat().st_size, 'last_access': time.time()}
+        except OSError:
+            index['entries'].pop(name, None)
+
+    def evict(self) -> int:
+        # enforces the limits, returns the number of removed entries
+        with self._locked_index() as index:
+            if index is None:
+                return 0
+            return self._evict(index)
+
+    def _evict(self, index: dict) -> int:
+        entries = index['entries']
+        now = time.time()
+        present = set()
+        for file in os.scandir(self.directory):
+            if not file.is_file():
+                continue
+            if file.name in entries:
+                present.add(file.name)
+            elif _FOREIGN_CACHE_FILE_NAME.match(file.name):
+                present.add(file.name)
+                stat = file.stat()
+                entries[file.name] = {'size': stat.st_size, 'last_access': max(stat.st_atime, stat.st_mtime)}
+            elif file.name.startswith(_TEMP_FILE_PREFIX) and now - file.stat().st_mtime > _STALE_TEMP_FILE_SECONDS:
+                Path(file.path).unlink(missing_ok=True) # left behind by a process that terminated while saving
+        for name in set(entries) - present:
+            del entries[name]
+        removed = [name for name, e in entries.items() if self.max_age > 0 and now - e['last_access'] > self.max_age]
+        total_size = sum(e['size'] for name, e in entries.items() if name not in removed)
+        if self.max_size > 0:
+            for name in sorted(set(entries) - set(removed), key=lambda n: entries[n]['last_access']):
+                if total_size <= self.max_size:
+                    break
+                removed.append(name)
+                total_size -= entries[name]['size']
+        for name in removed:
+            self.path(name).unlink(missing_ok=True)
+            del entries[name]
+        return len(removed)
+
+    def statistics(self) -> dict:
+        # number and total size of the entries in the index together with the hit and miss counts
+        index = self._read_index()
+        return {'entries': len(index['entries']), 'size': sum(e['size'] for e in index['entries'].values()),
+                'hits': index['hits'], 'misses': index['misses']}
+
+    def clear(self):
+        # removes all entries and resets the counters
+        with self._locked_index() as index:
+            if index is not None:
+                self._evict(index) # adds the foreign cache files to the index
+                for name in index['entries']:
+                    self.path(name).unlink(missing_ok=True)
+                index.clear()
+                index.update({'entries': {}, 'hits': 0, 'misses': 0})
@@ -0,0 +1,143 @@
+"""Batched LP verification of cut sets and strain designs against their target and desired regions"""
+import itertools
+import multiprocessing
+from typing import Callable, Dict, List, Tuple
+import numpy
+import cobra
+from optlang.interface import OPTIMAL, UNBOUNDED
+
+
+def mode_interventions(mode: Dict, mode_type: int) -> Dict[str, Tuple[float, float]]:
+    '''
+    Translates a mode of the mode navigator into the reaction bounds that it imposes: the reactions of a
+    cut set (mode_type 1) are knocked out, a strain design (mode_type 2) gives the bounds directly where
+    NaN bounds mark a knock-in that is not used and therefore also a knockout.
+    '''
+    if mode_type == 1:
+        return {r: (0.0, 0.0) for r in mode}
+    return {r: (0.0, 0.0) if numpy.any(numpy.isnan(v)) else (float(v[0]), float(v[1])) for r, v in mode.items()}
+
+
+class _RegionVerifier:
+    '''
+    Holds one model with its solver instance in which the constraints of all regions are added once;
+    a region is switched on by setting the bounds of its constraints, the interventions of a solution
+    only change reaction bounds so that the solver can start from the previous basis.
+    '''
+
+    def __init__(self, model: cobra.Model, targets, desired):
+        self.model = model
+        self.regions = []
+        for region in itertools.chain(targets, desired):
+            constraints = []
+            for lhs, sense, rhs in region:
+                expression = sum(c * model.reactions.get_by_id(r).flux_expression for r, c in lhs.items())
+                bounds = (rhs if sense in ('>=', '=') else None, rhs if sense in ('<=', '=') else None)
+                constraints.append((model.problem.Constraint(expression, lb=None, ub=None), bounds))
+            model.add_cons_vars([c for c, _ in constraints])
+            self.regions.append(constraints)
+        self.num_targets = len(targets)
+
+    def _feasible(self) -> bool:
+        # only the status matters, unbounded means that the region contains flux vectors
+        return self.model.solver.optimize() in (OPTIMAL, UNBOUNDED)
+
+    def _region_feasible(self, region) -> bool:
+        for constraint, (lb, ub) in region:
+            constraint.lb, constraint.ub = None, None # an equality constraint cannot pass through lb > ub
+            constraint.ub = ub
+            constraint.lb = lb
+        try:
+            return self._feasible()
+        finally:
+            for constraint, _ in region:
+                constraint.lb, constraint.ub = None, None
+
+    def verify(self, interventions: Dict[str, Tuple[float, float]]):
+        # returns (objective value, feasibility of each target region, feasibility of each desired region)
+        original = {}
+        conflict = False
+        for r, (lb, ub) in interventions.items():
+            reaction = self.model.reactions.get_by_id(r)
+            original[r] = reaction.bounds
+            lb, ub = max(lb, reaction.lower_bound), min(ub, reaction.upper_bound)
+            if lb > ub: # the intervention is incompatible with the model bounds
+                conflict = True
+                break
+            reaction.bounds = (lb, ub)
+        try:
+            if conflict:
+                return numpy.nan, [False]*self.num_targets, [False]*(len(self.regions) - self.num_targets)
+            status = self.model.solver.optimize()
+            objective = self.model.solver.objective.value if status == OPTIMAL else \
+                (numpy.inf if status == UNBOUNDED else numpy.nan)
+            feasible = [self._region_feasible(region) for region in self.regions]
+            return objective, feasible[:self.num_targets], feasible[self.num_targets:]
+        finally:
+            for r, bounds in original.items():
+                self.model.reactions.get_by_id(r).bounds = bounds
+
+
+_worker_verifier = None
+
+
+def _init_worker(model, targets, desired):
+    # runs once in each worker process which then keeps its model and solver instance for all its chunks;
+    # the model is passed pickled together with its solver so that additional (scenario) constraints are kept
+    global _worker_verifier
+    _worker_verifier = _RegionVerifier(model, targets, desired)
+
+
+def _verify_chunk(chunk):
+    start, interventions = chunk
+    return start, [_worker_verifier.verify(i) for i in interventions]
+
+
+def verify_solutions(model: cobra.Model, interventions: List[Dict[str, Tuple[float, float]]], targets, desired,
+                     processes=1, chunk_size=50, abort_callback: Callable[[], bool] = None,
+                     print_progress_function=print):
+    '''
+    Checks for each solution, given by the reaction bounds it imposes (see mode_interventions), that all
+    target regions are infeasible and all desired regions feasible. The regions are lists of constraints
+    in the form [{reaction ID: coefficient}, '<=' | '>=' | '=', rhs] as returned by straindesign.parse_constraints.
+    The current objective of the model is optimized for each solution as well.
+    With more than one process the solutions are checked in chunks by worker processes that each
+    set up their own solver instance once. Returns the arrays (passed, objective, target_feasible,
+    desired_feasible) with one row per solution or None if abort_callback returned True.
+    '''
+    n = len(interventions)
+    target_feasible = numpy.zeros((n, len(targets)), dtype=bool)
+    desired_feasible = numpy.zeros((n, len(desired)), dtype=bool)
+    objective = numpy.full(n, numpy.nan)
+
+    def store(start, results):
+        for i, (obj, t, d) in enumerate(results, start=start):
+            objective[i] = obj
+            target_feasible[i, :] = t
+            desired_feasible[i, :] = d
+
+    chunks = [(start, interventions[start:start+chunk_size]) for start in range(0, n, chunk_size)]
+    processes = max(1, min(processes, len(chunks)))
+    done = 0
+    if processes == 1:
+        with model:
+            verifier = _RegionVerifier(model, targets, desired)
+            for start, chunk in chunks:
+                store(start, [verifier.verify(i) for i in chunk])
+                done += len(chunk)
+                print_progress_function("Verified "+str(done)+" of "+str(n)+" solutions.")
+                if abort_callback is not None and abort_callback():
+                    return None
+    else:
+        ctx = multiprocessing.get_context('spawn') # forking a process with a running Qt application is not safe
+        with ctx.Pool(processes, initializer=_init_worker,
+                      initargs=(model, targets, desired)) as pool:
+            for start, results in pool.imap_unordered(_verify_chunk, chunks):
+                store(start, results)
+                done += len(results)
+                print_progress_function("Verified "+str(done)+" of "+str(n)+" solutions.")
+                if abort_callback is not None and abort_callback():
+                    pool.terminate()
+                    return None
+    passed = ~numpy.any(target_feasible, axis=1) & numpy.all(desired_feasible, axis=1)
+    return passed, objective, target_feasible, desired_feasible
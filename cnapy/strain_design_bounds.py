@@ -0,0 +1,78 @@
+"""Strain design solutions as arrays of intervention bounds for vectorized selection and statistics"""
+from typing import Dict, List, Tuple
+import numpy
+
+
+class StrainDesignBounds:
+    '''
+    The interventions of n strain designs as an (n x reactions x 2) array of lower and upper bounds together
+    with a mask of the reactions each design intervenes on. Only reactions that are part of at least one
+    design have a column. NaN bounds mark a knock-in that is not used by the design; all other masked
+    entries are active interventions.
+    '''
+
+    def __init__(self, bounds: numpy.ndarray, mask: numpy.ndarray, reac_id: List[str]):
+        self.bounds = bounds
+        self.mask = mask
+        self.reac_id = reac_id
+        self._active = None
+
+    @classmethod
+    def from_bounds_dicts(cls, solutions: List[Dict[str, Tuple[float, float]]]):
+        reac_index = {}
+        for s in solutions:
+            for r in s:
+                reac_index.setdefault(r, len(reac_index))
+        bounds = numpy.full((len(solutions), len(reac_index), 2), numpy.nan)
+        mask = numpy.zeros((len(solutions), len(reac_index)), dtype=bool)
+        for i, s in enumerate(solutions):
+            if len(s) > 0:
+                cols = [reac_index[r] for r in s]
+                bounds[i, cols, :] = [(v[0], v[1]) for v in s.values()]
+                mask[i, cols] = True
+        return cls(bounds, mask, list(reac_index))
+
+    def __len__(self):
+        return self.bounds.shape[0]
+
+    def __getitem__(self, idx) -> Dict[str, Tuple[float, float]]:
+        return {self.reac_id[c]: (float(self.bounds[idx, c, 0]), float(self.bounds[idx, c, 1]))
+                for c in numpy.nonzero(self.mask[idx])[0]}
+
+    @property
+    def active(self) -> numpy.ndarray:
+        # the interventions that are used by each design, i.e. without the unused knock-ins
+        if self._active is None:
+            self._active = self.mask & ~numpy.isnan(self.bounds[:, :, 0])
+        return self._active
+
+    def columns(self, reac_ids) -> List[int]:
+        # the columns of the given reactions, reactions without any intervention are left out
+        reac_index = {r: c for c, r in enumerate(self.reac_id)}
+        return [reac_index[r] for r in reac_ids if r in reac_index]
+
+    def select(self, must_occur=(), must_not_occur=()) -> numpy.ndarray:
+        # boolean array of the designs that intervene on all reactions in must_occur and on none of those in must_not_occur
+        selection = numpy.ones(len(self), dtype=bool)
+        if len(self.columns(must_occur)) < len(set(must_occur)):
+            selection[:] = False # some reaction is not part of any design
+        else:
+            selection &= numpy.all(self.active[:, self.columns(must_occur)], axis=1)
+        selection &= ~numpy.any(self.active[:, self.columns(must_not_occur)], axis=1)
+        return selection
+
+    def sizes(self, selection=None) -> numpy.ndarray:
+        # number of interventions of the (selected) designs
+        active = self.active if selection is None else self.active[selection, :]
+        return numpy.sum(active, axis=1)
+
+    def participation(self, selection=None) -> Dict[str, int]:
+        # in how many of the (selected) designs each reaction is an intervention
+        active = self.active if selection is None else self.active[selection, :]
+        return dict(zip(self.reac_id, numpy.sum(active, axis=0).tolist()))
+
+    def clear(self):
+        self.bounds = numpy.zeros((0, 0, 2))
+        self.mask = numpy.zeros((0, 0), dtype=bool)
+        self.reac_id = []
+        self._active = None
@@ -1,10 +1,383 @@
 ''' Tests '''
+import hashlib
+import itertools
+import os
+import time
+from tempfile import TemporaryDirectory
 import cobra
+import numpy
+import pytest
+import efmtool_link.efmtool_extern as efmtool_extern
 
 import cnapy.core
+from cnapy.efmtool_worker import EFMToolWorker
+from cnapy.parallel_efm import parallel_efm_computation, split_subproblems
+from cnapy.mcs_enumeration import TRUNCATED_SUBPROBLEM, minimal_cut_sets, parallel_compute_mcs, split_cut_subproblems, \
+    streaming_compute_mcs
+from cnapy.mode_query import ModeQuery, ModeQueryError
+from cnapy.flux_sampling import sample_fluxes
+from cnapy.flux_variability import flux_coupling, flux_variability_analysis, incremental_flux_variability_analysis
+from cnapy.mode_clustering import cluster_modes
+from cnapy.mode_statistics import mode_yields
+from cnapy.results_cache import ResultsCache
+from cnapy.network_compression import compress_network
+from cnapy.solution_verification import mode_interventions, verify_solutions
+from cnapy.strain_design_bounds import StrainDesignBounds
+from cnapy.flux_vector_container import FluxVectorSparse, FluxVectorMemmap, FluxVectorMemmapWriter, \
+    FluxVectorChunked, FluxVectorCompact, FluxVectorCutSets, load_flux_vector_container, save_chunked
 
 
 def test_efm_computation():
     model = cobra.Model()
     scen_values = {}
     cnapy.core.efm_computation(model, scen_values, True)
+
+
+def test_efmtool_worker():
+    # two computations run in the same worker process and neither is passed on to efmtool_extern
+    worker = EFMToolWorker()
+    fallbacks = []
+    worker._fallback = lambda *args: fallbacks.append(args)
+    st = numpy.array([[1, -1, 0], [0, 1, -1]])
+    pids = []
+    try:
+        for _ in range(2):
+            work_dir = worker.calculate_flux_modes(st, [0, 0, 0])
+            assert work_dir is not None and os.path.isfile(os.path.join(work_dir.name, 'efms.bin'))
+            assert worker.process.is_alive()
+            pids.append(worker.process.pid)
+    finally:
+        worker.stop()
+    assert len(fallbacks) == 0
+    assert pids[0] == pids[1]
+
+
+def test_split_subproblems():
+    subproblems = split_subproblems(2)
+    assert len(subproblems) == 4
+    # every sign pattern of the split reactions is kept in exactly one subproblem
+    for signs in itertools.product((-1, 0, 1), repeat=2):
+        owners = [d for d in subproblems if all(v == 0 or v == di for v, di in zip(signs, d))
+                  and all(v != 0 for v, di in zip(signs, d) if di < 0)]
+        assert len(owners) == 1
+
+
+def test_parallel_efm_computation():
+    # A and B with uptake of A, A <-> B, secretion of A and B and a reversible exchange of B
+    st = numpy.array([[1, -1, 0, -1, 0], [0, 1, -1, 0, 1]])
+    reversible = [0, 1, 0, 0, 1]
+
+    def efms(work_dir):
+        modes = FluxVectorMemmap('efms.bin', [None]*st.shape[1], containing_temp_dir=work_dir)
+        return sorted(tuple(row) for row in numpy.round(numpy.asarray(modes.fv_mat), 6))
+    expected = efms(efmtool_extern.calculate_flux_modes(st, reversible, return_work_dir_only=True))
+    assert efms(parallel_efm_computation(st, reversible, [1, 4], 2)) == expected
+
+
+def test_flux_vector_sparse(tmp_path):
+    fv_mat = numpy.array([[0., 1.5, 0., -2.], [0., 0., 0., 0.], [3., 0., 0., 1.]])
+    modes = FluxVectorSparse.from_dense_chunks(fv_mat, ['a', 'b', 'c', 'd'], chunk_size=2)
+    assert len(modes) == 3
+    assert modes[0] == {'b': 1.5, 'd': -2.0}
+    assert modes[1] == {}
+    assert list(modes.support(2)) == [0, 3]
+    assert modes.is_integer_vector_rounded(2)
+    modes.save(tmp_path / "modes.npz")
+    loaded = FluxVectorSparse(str(tmp_path / "modes.npz"))
+    assert loaded[2] == {'a': 3.0, 'd': 1.0}
+    assert loaded.reac_id == ['a', 'b', 'c', 'd']
+
+
+def test_flux_vector_compact(tmp_path):
+    fv_mat = numpy.array([[1., -2., 300., 0.], [0.5, 0., 1.5, 0.], [0., 0., 0., 70000.]])
+    modes = FluxVectorCompact.from_modes(FluxVectorSparse(fv_mat, reac_id=['a', 'b', 'c', 'd']), chunk_size=2)
+    assert modes.is_integral
+    assert [mat.dtype for _, mat in modes.fv_mat.groups] == [numpy.int8, numpy.int16, numpy.int32]
+    assert numpy.allclose(modes.fv_mat[:, :], fv_mat)
+    assert modes[1] == {'a': 0.5, 'c': 1.5}
+    modes.save(tmp_path / "compact.npz")
+    loaded = load_flux_vector_container(str(tmp_path / "compact.npz"))
+    assert isinstance(loaded, FluxVectorCompact)
+    assert numpy.allclose(loaded.fv_mat[:, :], fv_mat)
+    fv_mat[0, 0] = numpy.pi
+    modes = FluxVectorCompact.from_modes(FluxVectorSparse(fv_mat, reac_id=['a', 'b', 'c', 'd']))
+    assert not modes.is_integral
+    assert numpy.allclose(modes.fv_mat[:, :], fv_mat, rtol=1e-6)
+
+
+def test_compact_efm_memmap():
+    work_dir = TemporaryDirectory()
+    raw_efms = numpy.array([[1., 0., 1., 0.], [0., 1., -1., 0.], [0., -1., 1., 0.], [2., 0., 0., 3.]])
+    with FluxVectorMemmapWriter(os.path.join(work_dir.name, 'efms.bin'), 4) as writer:
+        writer.append(raw_efms)
+    ems = FluxVectorMemmap('efms.bin', ['a', 'b', 'c', 'd'], containing_temp_dir=work_dir)
+    ems = cnapy.core.compact_efm_memmap(ems, [0, 1, 1, 0], [3], chunk_size=2)
+    assert isinstance(ems, FluxVectorMemmap)
+    assert len(ems) == 3 # the backward copy of the reversible EFM is dropped
+    assert list(ems.irreversible) == [True, False, True]
+    assert ems[2] == {'a': 2.0, 'd': -3.0}
+
+
+def test_efm_result_cache():
+    work_dir = TemporaryDirectory()
+    with FluxVectorMemmapWriter(os.path.join(work_dir.name, 'efms.bin'), 4) as writer:
+        writer.append(numpy.array([[1., 0., 1., 0.], [0., 1., -1., 0.], [2., 0., 0., 3.]]))
+    ems = FluxVectorMemmap('efms.bin', ['a', 'b', 'c', 'd'], containing_temp_dir=work_dir)
+    ems.irreversible = numpy.array([True, False, True])
+    cache = cnapy.core.EFMResultCache()
+    cache.store(b'network', [], [], [], ems)
+    ems.clear()
+    assert cache.lookup(b'other network', ['b', 'c']) is None
+    filtered = cache.lookup(b'network', ['b', 'c'])
+    assert filtered.reac_id == ['a', 'd']
+    assert numpy.array_equal(filtered.fv_mat, [[2., 3.]])
+    assert list(filtered.irreversible) == [True]
+    # the reversible EFM is reversed to fulfill c >= 0
+    restricted = cache.lookup(b'network', [], ['c'], [])
+    assert numpy.array_equal(restricted.fv_mat, [[1., 0., 1., 0.], [0., -1., 1., 0.], [2., 0., 0., 3.]])
+    assert list(restricted.irreversible) == [True, True, True]
+    restricted = cache.lookup(b'network', [], [], ['c'])
+    assert numpy.array_equal(restricted.fv_mat, [[0., 1., -1., 0.], [2., 0., 0., 3.]])
+    cache.store(b'network', [], ['c'], [], restricted)
+    assert cache.lookup(b'network', [], [], []) is None
+
+
+def test_chunked_mode_set(tmp_path):
+    fv_mat = numpy.zeros((25, 5))
+    fv_mat[numpy.arange(25), numpy.arange(25) % 5] = numpy.arange(1, 26)
+    modes = FluxVectorSparse(fv_mat, reac_id=['a', 'b', 'c', 'd', 'e'], irreversible=numpy.arange(25) % 2 == 0)
+    save_chunked(modes, str(tmp_path / "modes.fvc"), chunk_size=10)
+    chunked = load_flux_vector_container(str(tmp_path / "modes.fvc"))
+    assert isinstance(chunked, FluxVectorChunked)
+    assert len(chunked) == 25 and chunked.fv_mat.num_chunks == 3
+    assert chunked[13] == {'d': 14.0}
+    assert list(chunked.irreversible) == list(modes.irreversible)
+    assert numpy.array_equal(chunked.fv_mat[[24, 0, 12], :].toarray(), fv_mat[[24, 0, 12], :])
+
+
+def test_support_index():
+    fv_mat = numpy.array([[1., 0., 2.], [0., -1., 0.], [3., 4., 0.]])
+    modes = FluxVectorSparse(fv_mat, reac_id=['a', 'b', 'c'])
+    index = modes.support_index
+    assert list(index.select(must_occur=[0], must_not_occur=[2])) == [False, False, True]
+    assert list(index.sizes()) == [2, 1, 2]
+    assert list(index.participation(numpy.array([True, True, False]))) == [1, 1, 1]
+
+
+def test_mode_query():
+    fv_mat = numpy.array([[1., 0., 2.], [0., -1., 0.], [3., 4., 0.], [0., 0., -5.]])
+    modes = FluxVectorSparse(fv_mat, reac_id=['a', 'b', 'c'])
+    def select(text):
+        return list(ModeQuery(text, modes.reac_id).evaluate(modes.inverted_index, modes.support_index.sizes()))
+    assert select("a, !c") == [False, False, True, False]
+    assert select("(b | c) AND NOT a") == [False, True, False, True]
+    assert select("b > 0 or c < 0") == [False, False, True, True]
+    assert select("size = 2..3") == [True, False, True, False]
+    with pytest.raises(ModeQueryError):
+        ModeQuery("a, (b", modes.reac_id)
+
+
+def test_mode_yields():
+    fv_mat = numpy.array([[1., 2., 0.], [0., 1., 1.], [2., 1., 4.]])
+    modes = FluxVectorSparse.from_dense_chunks(fv_mat, ['a', 'b', 'c'])
+    num, den, yields = mode_yields(modes, {'b': 1., 'c': 1.}, {'a': 2.}, chunk_size=2)
+    assert numpy.array_equal(num, [2., 2., 5.])
+    assert numpy.array_equal(den, [2., 0., 4.])
+    assert yields[0] == 1. and numpy.isnan(yields[1]) and yields[2] == 1.25
+    num, den, yields = mode_yields(modes, {'c': 1.}, {'a': 1.}, selection=numpy.array([True, False, True]))
+    assert numpy.array_equal(yields, [0., 2.])
+
+
+def test_network_compression():
+    # R0: -> A, R1: A -> B, R2: B <=> C, R3: C ->, R4: B <=> D, R5: D -> E (E is a dead end)
+    st = numpy.array([[1., -1., 0., 0., 0., 0.],
+                      [0., 1., -1., 0., -1., 0.],
+                      [0., 0., 1., -1., 0., 0.],
+                      [0., 0., 0., 0., 1., -1.],
+                      [0., 0., 0., 0., 0., 1.]])
+    network = compress_network(st, [0, 0, 1, 0, 1, 0])
+    assert list(network.blocked) == [4, 5]
+    assert network.num_reactions == 1 and list(network.reversible) == [0]
+    assert numpy.array_equal(network.expand(numpy.array([[2.]])), [[2., 2., 2., 2., 0., 0.]])
+    # the expanded compressed network is balanced where the original one is
+    assert numpy.allclose((st @ network.expansion)[network.metabolites, :], network.stoich)
+
+
+def test_minimal_cut_sets():
+    assert minimal_cut_sets([(1, 2), (2,), (3, 1), (1, 3, 4), (2, 5), (1, 3)], list('abcdef')) == [(2,), (1, 3)]
+    subproblems = split_cut_subproblems([4, 0])
+    assert subproblems == [([], 4), ([4], 0), ([4, 0], None)]
+
+
+def small_mcs_model():
+    # the minimal cut sets for EX_P >= 1 are {EX_A}, {R3}, {EX_P} and {R1, R2}
+    model = cobra.Model()
+    model.add_metabolites([cobra.Metabolite(m) for m in "ABP"])
+    for rxn_id, stoichiometry in [("EX_A", {"A": 1}), ("R1", {"A": -1, "B": 1}), ("R2", {"A": -1, "B": 1}),
+                                  ("R3", {"B": -1, "P": 1}), ("EX_P", {"P": -1})]:
+        reaction = cobra.Reaction(rxn_id, lower_bound=0, upper_bound=10)
+        model.add_reactions([reaction])
+        reaction.add_metabolites({model.metabolites.get_by_id(m): c for m, c in stoichiometry.items()})
+    targets = [(numpy.array([[0., 0., 0., 0., -1.]]), numpy.array([-1.]))]
+    return model, targets
+
+
+def test_streaming_compute_mcs():
+    model, targets = small_mcs_model()
+    streamed = []
+    info = {}
+    mcs, err_val = streaming_compute_mcs(model, streamed.extend, targets=targets, max_mcs_size=3,
+                                         network_compression=False, info=info)
+    assert err_val == 0 and not info['truncated']
+    assert sorted(streamed) == sorted(tuple(sorted(m)) for m in mcs) == [(0,), (1, 2), (3,), (4,)]
+
+
+def test_parallel_compute_mcs():
+    model, targets = small_mcs_model()
+    mcs, err_val = parallel_compute_mcs(model, [1], 2, targets=targets, max_mcs_size=3, network_compression=False)
+    assert err_val == 0 and sorted(mcs) == [(0,), (1, 2), (3,), (4,)]
+    # the subproblem without R1 only finds two of {EX_A}, {R3}, {EX_P}, the cut set of the
+    # subproblem with R1 that contains the third one is then not recognized as a superset
+    mcs, err_val = parallel_compute_mcs(model, [1], 2, targets=targets, max_mcs_size=3, max_mcs_num=2,
+                                        network_compression=False)
+    assert err_val == TRUNCATED_SUBPROBLEM and len(mcs) == 2
+
+
+def test_flux_vector_cut_sets(tmp_path):
+    cut_sets = FluxVectorCutSets.from_cut_sets([(2, 0), (1,), (0, 2, 3), (1, 3)], ['a', 'b', 'c', 'd'])
+    assert cut_sets[0] == {'a': -1.0, 'c': -1.0}
+    assert numpy.array_equal(cut_sets.fv_mat[2], [-1., 0., -1., -1.])
+    assert list(cut_sets.cardinality_histogram()) == [0, 1, 2, 1]
+    assert list(cut_sets.containing(['a', 'c'])) == [True, False, True, False]
+    assert list(cut_sets.minimal().cut_sets()) == [(1,), (0, 2)]
+    merged = FluxVectorCutSets.merge([cut_sets, FluxVectorCutSets.from_cut_sets([(3,)], ['a', 'b', 'c', 'd'])])
+    assert list(merged.cut_sets()) == [(1,), (3,), (0, 2)]
+    cut_sets.irreversible = numpy.array([1, 0, 1, 0])
+    cut_sets.unbounded = numpy.array([0, 0, 0, 1])
+    cut_sets.save(tmp_path / "mcs.npz")
+    loaded = load_flux_vector_container(str(tmp_path / "mcs.npz"))
+    assert isinstance(loaded, FluxVectorCutSets) and list(loaded.cut_sets()) == list(cut_sets.cut_sets())
+    assert numpy.array_equal(loaded.irreversible, cut_sets.irreversible)
+    assert numpy.array_equal(loaded.unbounded, cut_sets.unbounded)
+
+
+def test_verify_solutions():
+    model = cobra.io.load_model('textbook')
+    targets = [[[{'Biomass_Ecoli_core': 1.0}, '>=', 0.1]]]
+    desired = [[[{'EX_glc__D_e': 1.0}, '<=', -1.0]]]
+    interventions = [mode_interventions({'PGI': -1.0}, 1), mode_interventions({'GAPD': -1.0}, 1),
+                     mode_interventions({'EX_glc__D_e': (numpy.nan, numpy.nan)}, 2)]
+    passed, objective, target_feasible, desired_feasible = verify_solutions(model, interventions, targets, desired)
+    assert list(passed) == [False, True, False]
+    assert list(target_feasible[:, 0]) == [True, False, False]
+    assert list(desired_feasible[:, 0]) == [True, True, False]
+    assert objective[0] > 0.1 and numpy.isnan(objective[2])
+    assert model.reactions.PGI.bounds == (-1000.0, 1000.0)
+
+
+def test_strain_design_bounds():
+    designs = StrainDesignBounds.from_bounds_dicts([{'a': (0, 0), 'b': (numpy.nan, numpy.nan)},
+                                                    {'b': (0, 10), 'c': (-5, 5)}, {}])
+    assert len(designs) == 3
+    assert designs[1] == {'b': (0.0, 10.0), 'c': (-5.0, 5.0)}
+    assert list(designs.sizes()) == [1, 2, 0]
+    assert designs.participation(numpy.array([True, True, False])) == {'a': 1, 'b': 1, 'c': 1}
+    assert list(designs.select(must_occur=['b'])) == [False, True, False]
+    assert list(designs.select(must_not_occur=['a'])) == [False, True, True]
+
+
+def test_cluster_modes():
+    fv_mat = numpy.array([[1., 1., 1., 1., 0., 0., 0., 0.], [1., 1., 1., 1., 0., 0., 0., 0.],
+                          [1., 1., -1., 1., 2., 0., 0., 0.], [0., 0., 0., 0., 1., 1., 1., 1.],
+                          [0., 0., 0., 0., 1., 1., 1., 0.]])
+    modes = FluxVectorSparse.from_dense_chunks(fv_mat, list('abcdefgh'), chunk_size=2)
+    clusters = cluster_modes(modes, threshold=0.5, num_hashes=64, bands=16, chunk_size=2, threads=2)
+    assert list(clusters.sizes) == [3, 2]
+    assert list(clusters.labels) == [0, 0, 0, 1, 1]
+    assert list(clusters.members(1)) == [3, 4]
+    assert list(clusters.labels[clusters.representatives]) == [0, 1]
+
+
+def test_sample_fluxes(tmp_path):
+    model = cobra.io.load_model("textbook")
+    reac_id = model.reactions.list_attr("id")
+    fname = os.path.join(str(tmp_path), "samples.bin")
+    streamed = []
+    # the file can be opened while it is still being written
+    num_samples = sample_fluxes(model, 250, fname, thinning=10, batch_size=100, seed=1,
+                                samples_callback=lambda n: streamed.append(len(FluxVectorMemmap(fname, reac_id))))
+    assert num_samples == 250
+    assert streamed == [100, 200, 250]
+    samples = FluxVectorMemmap(fname, reac_id)
+    stoich = cobra.util.create_stoichiometric_matrix(model)
+    assert numpy.max(numpy.abs(stoich @ numpy.asarray(samples.fv_mat).T)) < 1e-6
+
+
+def test_flux_variability_analysis():
+    model = cobra.io.load_model("textbook")
+    expected = cobra.flux_analysis.flux_variability_analysis(model, fraction_of_optimum=0.5)
+    streamed = []
+    result = flux_variability_analysis(model, fraction_of_optimum=0.5, min_chunk_size=10,
+                                       result_callback=lambda reac_ids, lb, ub: streamed.extend(reac_ids))
+    assert sorted(streamed) == sorted(model.reactions.list_attr("id"))
+    assert numpy.allclose(result.loc[expected.index].values, expected.values, atol=1e-6)
+    # blocked and coupled reactions are inferred, LPs whose bound was already reached are skipped
+    pruned = flux_variability_analysis(model, fraction_of_optimum=0.5, prune=True)
+    assert numpy.allclose(pruned.loc[expected.index].values, expected.values, atol=1e-6)
+    # the ranges of the priority reactions are reported first
+    batches = []
+    prioritized = flux_variability_analysis(model, fraction_of_optimum=0.5, priority_reactions=['PGK', 'CS'],
+                                            result_callback=lambda reac_ids, lb, ub: batches.append(reac_ids))
+    assert set(batches[0]) == {'PGK', 'CS'}
+    assert numpy.allclose(prioritized.loc[expected.index].values, expected.values, atol=1e-6)
+    blocked, coupled = flux_coupling(model)
+    assert {'EX_fru_e', 'FRUpts2'} <= blocked # fructose is not available
+    assert coupled['CS'] == ('ACONTa', 1.0)
+
+
+def test_incremental_flux_variability_analysis():
+    model = cobra.io.load_model("textbook")
+    model.objective = model.problem.Objective(0)
+    previous = incremental_flux_variability_analysis(model)
+    with model:
+        # tighter bounds and an additional constraint, only the ranges whose witnesses became infeasible are solved again
+        model.reactions.EX_glc__D_e.lower_bound = -5
+        model.add_cons_vars(model.problem.Constraint(model.reactions.PGK.flux_expression, lb=-5, ub=5))
+        result = incremental_flux_variability_analysis(model, previous=previous, priority_reactions=['PGK'])
+        expected = flux_variability_analysis(model)
+        assert numpy.allclose(result.ranges.values, expected.values, atol=1e-6)
+        assert previous.valid_ranges(result.fingerprint, model.tolerance).any()
+    # a relaxed flux space is computed from scratch
+    assert not previous.fingerprint.tightens(result.fingerprint)
+    assert numpy.allclose(incremental_flux_variability_analysis(model, previous=result).ranges.values,
+                          previous.ranges.values, atol=1e-6)
+
+
+def test_results_cache(tmp_path):
+    cache = ResultsCache(tmp_path, max_size_mb=0, max_age_days=1)
+    hash_object = hashlib.md5(b"model")
+    names = [ResultsCache.key("test", hash_object, i) for i in range(3)]
+    assert cache.load(names[0]) is None
+    for i, name in enumerate(names):
+        assert cache.save(name, numpy.full(1000, i))
+    assert numpy.all(cache.load(names[0]) == 0)
+    # the files that optlang_enumerator writes are indexed, other files are left alone
+    (tmp_path / ("model_FVA_" + hash_object.hexdigest())).write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("keep")
+    (tmp_path / ("data_" + hash_object.hexdigest())).write_text("keep")
+    assert cache.evict() == 0
+    assert cache.statistics() == {'entries': 4, 'size': sum(cache.path(n).stat().st_size for n in names) + 1,
+                                  'hits': 1, 'misses': 1}
+    # the least recently used entries are removed first
+    cache.max_size = cache.path(names[0]).stat().st_size + 1
+    cache.evict()
+    assert [cache.path(n).exists() for n in names] == [True, False, False]
+    cache.max_age = 0.5
+    time.sleep(1)
+    cache.evict()
+    assert not cache.path(names[0]).exists()
+    cache.save(names[1], 1)
+    (tmp_path / ("model_FVA_" + hash_object.hexdigest())).write_bytes(b"x")
+    cache.clear()
+    assert cache.statistics()['entries'] == 0 and not (tmp_path / ("model_FVA_" + hash_object.hexdigest())).exists()
+    assert (tmp_path / "notes.txt").exists() and (tmp_path / ("data_" + hash_object.hexdigest())).exists()